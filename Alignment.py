@@ -1,8 +1,10 @@
 #-*- coding:utf-8 -*-
 
-import os, General, random
+import os, General
 
 class BlastNHit(object):
+    __slots__ = ('query_id', 'subject_id', 'identity', 'align_len', 'mismatch', 'gap_opens', 
+        'query_start', 'query_end', 'subject_start', 'subject_end', 'evalue', 'bit_score', 'strand')
     def __init__(self):
         self.query_id = ""
         self.subject_id = ""
@@ -33,7 +35,78 @@ class BlastNHit(object):
             self.subject_id, self.subject_start, self.subject_end, self.strand, \
             self.identity)
 
-def blast_seq(query_seq, blastdb, clear=True, verbose=False, perc_identity=90, evalue=10, maxhit=500, threads=1):
+### Columns of BLAST tabular output (-outfmt 6/7), subject_start<=subject_end and strand is added
+BLAST_COLUMNS = ('query_id', 'subject_id', 'identity', 'align_len', 'mismatch', 'gap_opens', 
+    'query_start', 'query_end', 'subject_start', 'subject_end', 'evalue', 'bit_score', 'strand')
+
+def parse_blast_tabular(tabularFnList):
+    """
+    Read BLAST tabular outputs (-outfmt 6 or 7) into a numpy structured array in one pass
+    
+    tabularFnList           -- A file or a list of files
+    
+    Return a structured array with fields of BLAST_COLUMNS
+    """
+    import numpy as np
+    
+    if isinstance(tabularFnList, str):
+        tabularFnList = [ tabularFnList ]
+    lines = []
+    for tabularFn in tabularFnList:
+        with open(tabularFn) as IN:
+            lines += [ line for line in IN.read().split('\n') if line and line[0]!='#' ]
+    
+    columns = list(zip(*[ line.split('\t') for line in lines ])) if lines else [ () ] * 12
+    sub_start = np.array(columns[8], dtype=np.int64)
+    sub_end = np.array(columns[9], dtype=np.int64)
+    reverse = sub_end < sub_start
+    
+    query_ids = np.array(columns[0], dtype=str) if lines else np.array([], dtype='U1')
+    subject_ids = np.array(columns[1], dtype=str) if lines else np.array([], dtype='U1')
+    dtype = [ ('query_id', query_ids.dtype), ('subject_id', subject_ids.dtype), ('identity', 'f8'), 
+        ('align_len', 'i8'), ('mismatch', 'i8'), ('gap_opens', 'i8'), ('query_start', 'i8'), ('query_end', 'i8'), 
+        ('subject_start', 'i8'), ('subject_end', 'i8'), ('evalue', 'f8'), ('bit_score', 'f8'), ('strand', 'U1') ]
+    hits = np.empty(len(lines), dtype=dtype)
+    hits['query_id'] = query_ids
+    hits['subject_id'] = subject_ids
+    for idx, name in zip(range(2, 8), BLAST_COLUMNS[2:8]):
+        hits[name] = np.array(columns[idx], dtype=hits.dtype[name])
+    hits['subject_start'] = np.where(reverse, sub_end, sub_start)
+    hits['subject_end'] = np.where(reverse, sub_start, sub_end)
+    hits['evalue'] = np.array(columns[10], dtype=np.float64)
+    hits['bit_score'] = np.array(columns[11], dtype=np.float64)
+    hits['strand'] = np.where(reverse, '-', '+')
+    return hits
+
+def iter_blast_hits(hits):
+    """
+    hits                    -- Structured array from parse_blast_tabular or blast_seq(output='array')
+    
+    Yield BlastNHit objects
+    """
+    for row in hits.tolist():
+        hit = BlastNHit()
+        hit.query_id, hit.subject_id, hit.identity, hit.align_len, hit.mismatch, hit.gap_opens, \
+            hit.query_start, hit.query_end, hit.subject_start, hit.subject_end, \
+            hit.evalue, hit.bit_score, hit.strand = row
+        yield hit
+
+def __split_query(query_seq, shards):
+    """
+    Split a dict of sequences into shards with balanced total length
+    """
+    import heapq
+    
+    heap = [ (0, i) for i in range(shards) ]
+    groups = [ {} for i in range(shards) ]
+    for name in sorted(query_seq, key=lambda name: len(query_seq[name]), reverse=True):
+        load, idx = heapq.heappop(heap)
+        groups[idx][name] = query_seq[name]
+        heapq.heappush(heap, (load+len(query_seq[name]), idx))
+    return [ group for group in groups if group ]
+
+def blast_seq(query_seq, blastdb, clear=True, verbose=False, perc_identity=90, evalue=10, maxhit=500, threads=1, 
+    output='object', shards=1):
     """
     Blastn a sequence or sequences and return a list of BlastNHit
     
@@ -44,9 +117,13 @@ def blast_seq(query_seq, blastdb, clear=True, verbose=False, perc_identity=90, e
     perc_identity           -- Minimum percentage of identity
     evalue                  -- Maximun evalue
     maxhit                  -- Maximum number of aligned sequences to keep
-    threads                 -- How many threads to use
+    threads                 -- How many threads to use for each blastn process
+    output                  -- object: a list of BlastNHit; 
+                               array: a numpy structured array with fields of BLAST_COLUMNS;
+                               dataframe: a pandas DataFrame
+    shards                  -- Split the query sequences into shards and run blastn processes in parallel
     
-    Return: [ BlastNHit, BlastNHit,... ]
+    Return: [ BlastNHit, BlastNHit,... ], structured array or DataFrame
     
     Require: blastn
     """
@@ -56,100 +133,98 @@ def blast_seq(query_seq, blastdb, clear=True, verbose=False, perc_identity=90, e
         raise RuntimeError("Error: %s.nhr does not exists" % (blastdb))
     if type(query_seq) is not str and type(query_seq) is not dict:
         raise RuntimeError("Error: parameter query_seq should a sequence or a dict of sequence")
-    
-    rand_id = random.randint(10000,99999)
-    seq_fa_file = "/tmp/blast_seq_%s.fa" % (rand_id)
-    result_file = "/tmp/blast_result_%s.tabular" % (rand_id)
+    if output not in ('object', 'array', 'dataframe'):
+        raise RuntimeError("Error: parameter output should be one of object, array, dataframe")
     
     if type(query_seq) is str:
-        General.write_fasta({"query_id":query_seq}, seq_fa_file)
-    else:
-        General.write_fasta(query_seq, seq_fa_file)
-    cmd = f"{blastn} -db {blastdb} -query {seq_fa_file} -out {result_file} -outfmt 7 -num_threads {threads} -perc_identity {perc_identity} -evalue {evalue} -max_target_seqs {maxhit}"
-    
-    if verbose:
-        print(cmd)
-    os.system(cmd)
-    
-    Hit_List = []
-    for line in open(result_file):
-        if line[0]!='#':
-            data = line.strip().split()
-            hit = BlastNHit()
-            hit.query_id = data[0]
-            hit.subject_id = data[1]
-            hit.identity = float(data[2])
-            hit.align_len = int(data[3])
-            hit.mismatch = int(data[4])
-            hit.gap_opens = int(data[5])
-            hit.query_start = int(data[6])
-            hit.query_end = int(data[7])
-            hit.set_sub_range( int(data[8]), int(data[9]) )
-            hit.evalue = float(data[10])
-            hit.bit_score = float(data[11])
-            Hit_List.append(hit)
-    
-    if clear:
-        os.remove(seq_fa_file)
-        os.remove(result_file)
-    
-    return Hit_List
+        query_seq = {"query_id":query_seq}
+    
+    with General.scratch_dir("blast_seq_", clean=clear) as tmpdir:
+        commands = []
+        result_files = []
+        for i, group in enumerate(__split_query(query_seq, max(shards, 1))):
+            seq_fa_file = os.path.join(tmpdir, f"query_{i}.fa")
+            result_file = os.path.join(tmpdir, f"result_{i}.tabular")
+            General.write_fasta(group, seq_fa_file)
+            cmd = [ blastn, "-db", blastdb, "-query", seq_fa_file, "-out", result_file, "-outfmt", "7", 
+                "-num_threads", str(threads), "-perc_identity", str(perc_identity), "-evalue", str(evalue), 
+                "-max_target_seqs", str(maxhit) ]
+            if verbose:
+                print(General.format_command(cmd))
+            commands.append(cmd)
+            result_files.append(result_file)
+        
+        General.run_tools(commands, verbose=verbose)
+        
+        hits = parse_blast_tabular(result_files)
+    
+    if output == 'array':
+        return hits
+    elif output == 'dataframe':
+        import pandas as pd
+        return pd.DataFrame(hits)
+    return list(iter_blast_hits(hits))
 
-def annotate_seq(Fasta, genome_blastn_db, Gaper, verbose=True, threads=10):
+def annotate_seq(Fasta, genome_blastn_db, Gaper, verbose=True, threads=10, shards=1):
     """
     Given sequence, blast in genome blastn db and annotate
     
     Fasta                   -- Sequence dict, { tid1:seq1, tid2:seq2, ... }
     genome_blastn_db        -- Balstn db, such as /150T/zhangqf/GenomeAnnotation/INDEX/blast/hg38/hg38
-    Gaper                   -- A object of GAP.init()
+    Gaper                   -- A object of GAP.init() or TranscriptIndex. With TranscriptIndex all hits are annotated at once
     verbose                 -- Output information during processing
     threads                 -- How many threads to use
+    shards                  -- Number of parallel blastn processes
     
     Return: {raw_id=>new_id}, unmaped_ids, unannot_ids
     
     Require: blastn
     """
+    import numpy as np
     
     id_map = {}
     unmapped_ids = []
     unannot_ids = {}
     
-    Hits = blast_seq(Fasta, genome_blastn_db, threads=threads)
-    Hit_dict = {}
+    hits = blast_seq(Fasta, genome_blastn_db, threads=threads, output='array', shards=shards)
     
-    Hit_dict = {}
-    for hit in Hits:
-        qid = hit.query_id
-        try:
-            Hit_dict[qid].append(hit)
-        except KeyError:
-            Hit_dict[qid] = [hit]
+    ### Sort by query and decreasing identity, then find the hit range of each query
+    hits = hits[ np.lexsort((-hits['identity'], hits['query_id'])) ]
+    query_ids, first_idx, hit_count = np.unique(hits['query_id'], return_index=True, return_counts=True)
+    query_range = { qid:(start, start+count) for qid, start, count in zip(query_ids.tolist(), first_idx.tolist(), hit_count.tolist()) }
     
-    for qid in Hit_dict:
-        Hit_dict[qid].sort(key=lambda x: x.identity, reverse=True)
+    ### With a TranscriptIndex, all hits are annotated in one bulk query
+    bulk_annot = {}
+    if isinstance(Gaper, TranscriptIndex):
+        good = np.nonzero(hits['identity'] >= 90)[0]
+        annot = Gaper.bulk_genomeCoor2transCoor(hits['subject_id'][good], hits['subject_start'][good], 
+            hits['subject_end'][good], hits['strand'][good])
+        for hit_idx, trans_id, trans_start, trans_end in annot.tolist():
+            hit_idx = int(good[hit_idx])
+            qid = str(hits['query_id'][hit_idx])
+            if qid not in bulk_annot or hit_idx < bulk_annot[qid][0]:
+                bulk_annot[qid] = (hit_idx, [ [None, None, None, trans_id, trans_start, trans_end] ])
     
     for qid in Fasta:
         seq = Fasta[qid]
         if verbose: print("ID:", qid, "Len:", len(seq), sep=" ", end="\t")
-        #Hit_list = blast_single_seq(seq, genome_blastn_db, threads=threads)
-        if qid not in Hit_dict:
+        if qid not in query_range:
             if verbose: print(" has 0 alignment")
             unmapped_ids.append(qid)
             continue
         
-        Hit_list = Hit_dict[qid]
-        i = 0
-        while i<len(Hit_list):
-            hit = Hit_list[i]
-            if hit.identity < 90: continue
-            trans_loc = Gaper.genomeCoor2transCoor(hit.subject_id, hit.subject_start, hit.subject_end, hit.strand)
-            if len(trans_loc)==0: 
-                i += 1
-            else:
-                break
-        if i==len(Hit_list):
-            if verbose: print(" has no annotation: %s"%(Hit_list[0]))
-            hit = Hit_list[0]
+        start, end = query_range[qid]
+        trans_loc = []
+        if isinstance(Gaper, TranscriptIndex):
+            trans_loc = bulk_annot.get(qid, (None, []))[1]
+        else:
+            for row in hits[start:end][ hits['identity'][start:end] >= 90 ].tolist():
+                trans_loc = Gaper.genomeCoor2transCoor(row[1], row[8], row[9], row[12])
+                if len(trans_loc) > 0:
+                    break
+        if len(trans_loc) == 0:
+            hit = next(iter_blast_hits(hits[start:start+1]))
+            if verbose: print(" has no annotation: %s"%(hit))
             unannot_ids[qid] = "%s:%d-%d(%c)" % (hit.subject_id, hit.subject_start, hit.subject_end, hit.strand)
             continue
         
@@ -157,12 +232,487 @@ def annotate_seq(Fasta, genome_blastn_db, Gaper, verbose=True, threads=10):
         trans_region = trans_loc[0][4:6]
         ft = Gaper.getTransFeature(gencode_id)
         annot_name = ft['gene_type']+"-"+ft['gene_name']+"-"+gencode_id+"_%d-%d" % (trans_region[0], trans_region[1])
-        if verbose: print("Found", len(Hit_list), "hits", "gene_type:", ft['gene_type'], sep=" ")
+        if verbose: print("Found", end-start, "hits", "gene_type:", ft['gene_type'], sep=" ")
         
         id_map[qid] = annot_name
     
     return id_map, unmapped_ids, unannot_ids
 
+class TranscriptIndex(object):
+    def __init__(self, annotFn, indexFn=None, verbose=True):
+        """
+        Index exons of transcripts from a GTF/GFF3 file to map genome coordinates to transcript coordinates.
+        The exons of each chromosome and strand are sorted by start with a running maximum of ends, 
+        so all exons overlapping an interval are found with two binary searches.
+        
+        annotFn                 -- GTF or GFF3 file
+        indexFn                 -- Index file (.npz). Loaded if newer than annotFn, otherwise built and saved.
+                                   Default: annotFn+".tindex.npz"
+        verbose                 -- Print information
+        
+        It can be used as Gaper in annotate_seq
+        """
+        import numpy as np
+        
+        if indexFn is None:
+            indexFn = annotFn + ".tindex.npz"
+        if os.path.exists(indexFn) and (not os.path.exists(annotFn) or os.path.getmtime(indexFn) >= os.path.getmtime(annotFn)):
+            arrays = np.load(indexFn)
+            if verbose: print(f"Load transcript index from {indexFn}")
+        else:
+            arrays = self.__build(annotFn)
+            np.savez(indexFn, **arrays)
+            if verbose: print(f"Build transcript index from {annotFn} and save to {indexFn}")
+        self.__set_arrays({ key:arrays[key] for key in arrays })
+    
+    @staticmethod
+    def __parse_attributes(text):
+        attrs = {}
+        for item in text.strip().rstrip(';').split(';'):
+            item = item.strip()
+            if not item:
+                continue
+            if '=' in item and '"' not in item.split('=')[0]:
+                key, value = item.split('=', 1)
+            else:
+                key, value = (item.split(None, 1) + [''])[:2]
+            attrs[key] = value.strip().strip('"')
+        return attrs
+    
+    def __build(self, annotFn):
+        import numpy as np
+        
+        features = {}
+        exons = []
+        for line in open(annotFn):
+            if line[0] == '#':
+                continue
+            data = line.rstrip('\n').split('\t')
+            if len(data) < 9:
+                continue
+            attrs = self.__parse_attributes(data[8])
+            if data[2] == 'exon':
+                trans_id = attrs.get('transcript_id') or attrs.get('Parent', '').split(',')[0]
+                trans_id = trans_id.split(':', 1)[1] if trans_id.startswith('transcript:') else trans_id
+                exons.append( (data[0], data[6], int(data[3]), int(data[4]), trans_id) )
+                feature = features.setdefault(trans_id, {})
+            elif 'ID' in attrs and data[2] not in ('gene', 'CDS', 'five_prime_UTR', 'three_prime_UTR', 'start_codon', 'stop_codon'):
+                trans_id = attrs['ID'].split(':', 1)[1] if attrs['ID'].startswith('transcript:') else attrs['ID']
+                feature = features.setdefault(trans_id, {})
+            else:
+                continue
+            for key in ('gene_name', 'Name'):
+                if key in attrs: feature.setdefault('gene_name', attrs[key])
+            for key in ('gene_type', 'gene_biotype', 'transcript_type', 'transcript_biotype', 'biotype'):
+                if key in attrs: feature.setdefault('gene_type', attrs[key])
+        
+        if not exons:
+            raise RuntimeError(f"Error: no exon found in {annotFn}")
+        
+        trans_ids = sorted(set([ exon[4] for exon in exons ]))
+        trans_idx = { trans_id:i for i,trans_id in enumerate(trans_ids) }
+        chrs = np.array([ exon[0] for exon in exons ])
+        strands = np.array([ exon[1] for exon in exons ])
+        starts = np.array([ exon[2] for exon in exons ], dtype=np.int64)
+        ends = np.array([ exon[3] for exon in exons ], dtype=np.int64)
+        tids = np.array([ trans_idx[exon[4]] for exon in exons ], dtype=np.int64)
+        
+        ### Transcript coordinate of the 5' end of each exon: sum of lengths of upstream exons
+        order = np.lexsort((np.where(strands=='-', -starts, starts), tids))
+        lengths = (ends - starts + 1)[order]
+        cumsum = np.cumsum(lengths) - lengths
+        first = np.r_[0, np.nonzero(np.diff(tids[order]))[0]+1]
+        group_start = np.repeat(cumsum[first], np.diff(np.r_[first, len(order)]))
+        offsets = np.empty(len(order), dtype=np.int64)
+        offsets[order] = cumsum - group_start
+        
+        gene_name = np.array([ features.get(trans_id, {}).get('gene_name', '') for trans_id in trans_ids ])
+        gene_type = np.array([ features.get(trans_id, {}).get('gene_type', '') for trans_id in trans_ids ])
+        return { 'chrs':chrs, 'strands':strands, 'starts':starts, 'ends':ends, 'tids':tids, 'offsets':offsets,
+            'trans_ids':np.array(trans_ids), 'gene_name':gene_name, 'gene_type':gene_type }
+    
+    def __set_arrays(self, arrays):
+        import numpy as np
+        
+        self.trans_ids = arrays['trans_ids']
+        self.gene_name = arrays['gene_name']
+        self.gene_type = arrays['gene_type']
+        self.trans_idx = { trans_id:i for i,trans_id in enumerate(self.trans_ids.tolist()) }
+        self.blocks = {}
+        keys = np.char.add(np.char.add(arrays['chrs'], '\t'), arrays['strands'])
+        for key in np.unique(keys).tolist():
+            idx = np.nonzero(keys == key)[0]
+            idx = idx[ np.argsort(arrays['starts'][idx], kind='stable') ]
+            ends = arrays['ends'][idx]
+            self.blocks[tuple(key.split('\t'))] = {
+                'starts': arrays['starts'][idx], 'ends': ends, 'max_ends': np.maximum.accumulate(ends),
+                'tids': arrays['tids'][idx], 'offsets': arrays['offsets'][idx] }
+    
+    def bulk_genomeCoor2transCoor(self, chrIDs, starts, ends, strands):
+        """
+        Map many genome intervals to transcript coordinates. Each interval is clipped 
+        to the exons of every transcript it overlaps on the same strand
+        
+        chrIDs, starts, ends, strands   -- Arrays of intervals, 1-based and closed
+        
+        Return a structured array sorted by (query, transcript) with fields:
+            query (index of interval), trans_id, trans_start, trans_end
+        """
+        import numpy as np
+        
+        chrIDs, strands = np.asarray(chrIDs).astype(str), np.asarray(strands).astype(str)
+        starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+        query_list, tid_list, tstart_list, tend_list = [], [], [], []
+        keys = np.char.add(np.char.add(chrIDs, '\t'), strands)
+        for key in np.unique(keys).tolist():
+            block = self.blocks.get(tuple(key.split('\t')))
+            if block is None:
+                continue
+            query = np.nonzero(keys == key)[0]
+            q_start, q_end = starts[query], ends[query]
+            lo = np.searchsorted(block['max_ends'], q_start, side='left')
+            hi = np.searchsorted(block['starts'], q_end, side='right')
+            count = np.maximum(hi - lo, 0)
+            if count.sum() == 0:
+                continue
+            rep = np.repeat(np.arange(len(query)), count)
+            exon = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + np.repeat(lo, count)
+            hit = block['ends'][exon] >= q_start[rep]
+            rep, exon = rep[hit], exon[hit]
+            e_start, e_end, offset = block['starts'][exon], block['ends'][exon], block['offsets'][exon]
+            o_start, o_end = np.maximum(q_start[rep], e_start), np.minimum(q_end[rep], e_end)
+            if key.endswith('-'):
+                t_start, t_end = offset + (e_end - o_end) + 1, offset + (e_end - o_start) + 1
+            else:
+                t_start, t_end = offset + (o_start - e_start) + 1, offset + (o_end - e_start) + 1
+            query_list.append(query[rep]); tid_list.append(block['tids'][exon])
+            tstart_list.append(t_start); tend_list.append(t_end)
+        
+        dtype = [('query', 'i8'), ('trans_id', self.trans_ids.dtype), ('trans_start', 'i8'), ('trans_end', 'i8')]
+        if not query_list:
+            return np.empty(0, dtype=dtype)
+        query, tid = np.concatenate(query_list), np.concatenate(tid_list)
+        t_start, t_end = np.concatenate(tstart_list), np.concatenate(tend_list)
+        order = np.lexsort((tid, query))
+        query, tid, t_start, t_end = query[order], tid[order], t_start[order], t_end[order]
+        first = np.r_[0, np.nonzero((np.diff(query)!=0) | (np.diff(tid)!=0))[0]+1]
+        result = np.empty(len(first), dtype=dtype)
+        result['query'] = query[first]
+        result['trans_id'] = self.trans_ids[tid[first]]
+        result['trans_start'] = np.minimum.reduceat(t_start, first)
+        result['trans_end'] = np.maximum.reduceat(t_end, first)
+        return result
+    
+    def genomeCoor2transCoor(self, chrID, start, end, strand):
+        """
+        Map a genome interval to transcript coordinates, same as GAP
+        
+        Return [ [chrID, start, end, trans_id, trans_start, trans_end], ... ]
+        """
+        result = self.bulk_genomeCoor2transCoor([chrID], [start], [end], [strand])
+        return [ [chrID, start, end, trans_id, trans_start, trans_end] for _, trans_id, trans_start, trans_end in result.tolist() ]
+    
+    def getTransFeature(self, trans_id):
+        """
+        Return { 'trans_id':..., 'gene_name':..., 'gene_type':... }
+        """
+        idx = self.trans_idx[trans_id]
+        return { 'trans_id': trans_id, 'gene_name': str(self.gene_name[idx]), 'gene_type': str(self.gene_type[idx]) }
+
+class SequenceIndex(object):
+    def __init__(self, seqFn, indexDir=None, depth=64, verbose=True):
+        """
+        Suffix array index over all sequences of a fasta file to locate sub-sequences.
+        Suffixes are sorted by their first depth bases with prefix doubling, longer queries 
+        are verified against the text. Arrays are saved as .npy files and memory-mapped on load.
+        
+        seqFn                   -- Fasta file, or a sequence dict (indexDir is required)
+        indexDir                -- Index directory. Loaded if newer than seqFn, otherwise built and saved.
+                                   Default: seqFn+".saindex"
+        depth                   -- Sorting depth of suffixes
+        verbose                 -- Print information
+        
+        Example:
+            index = Alignment.SequenceIndex("transcriptome.fa")
+            hits = index.find("GGACTGACGATGCAGCTAGCAGTG", mismatches=1)
+            for name, start, end, mismatch in hits:
+                print(name, start, end, mismatch)
+        """
+        import numpy as np
+        import json
+        
+        if indexDir is None:
+            if not isinstance(seqFn, str):
+                raise RuntimeError("Error: indexDir is required for a sequence dict")
+            indexDir = seqFn + ".saindex"
+        metaFn = os.path.join(indexDir, "meta.json")
+        
+        if os.path.exists(metaFn) and (not isinstance(seqFn, str) or os.path.getmtime(metaFn) >= os.path.getmtime(seqFn)):
+            if verbose: print(f"Load sequence index from {indexDir}")
+        else:
+            seq_dict = General.load_fasta(seqFn) if isinstance(seqFn, str) else seqFn
+            if verbose: print(f"Build sequence index of {len(seq_dict)} sequences, save to {indexDir}")
+            self.__build(seq_dict, indexDir, depth)
+        
+        meta = json.load(open(metaFn))
+        self.depth = meta['depth']
+        self.names = np.array(meta['names'], dtype=str)
+        self.text = np.load(os.path.join(indexDir, "text.npy"), mmap_mode='r')
+        self.sa = np.load(os.path.join(indexDir, "sa.npy"), mmap_mode='r')
+        self.offsets = np.load(os.path.join(indexDir, "offsets.npy"))
+        self.lengths = np.load(os.path.join(indexDir, "lengths.npy"))
+    
+    @staticmethod
+    def _normalize(sequence):
+        return sequence.upper().replace('U', 'T').encode()
+    
+    def __build(self, seq_dict, indexDir, depth):
+        import numpy as np
+        import json
+        
+        names = list(seq_dict.keys())
+        seq_list = [ self._normalize(seq_dict[name]) for name in names ]
+        lengths = np.array([ len(seq) for seq in seq_list ], dtype=np.int64)
+        offsets = np.r_[0, np.cumsum(lengths + 1)[:-1]].astype(np.int64)
+        text = np.frombuffer(b"$".join(seq_list) + b"$", dtype=np.uint8)
+        n = len(text)
+        
+        ### Prefix doubling: suffixes are sorted by their first sorted_depth bases
+        key = text.astype(np.int64)
+        sa = np.argsort(key, kind='stable')
+        sorted_depth = 1
+        while True:
+            sorted_key = key[sa]
+            rank = np.empty(n, dtype=np.int64)
+            rank[sa] = np.r_[0, np.cumsum(sorted_key[1:] != sorted_key[:-1])]
+            if rank[sa[-1]] == n - 1:
+                ### All suffixes are distinct, the order holds for any query length
+                sorted_depth = n
+                break
+            if sorted_depth >= depth:
+                break
+            next_rank = np.full(n, -1, dtype=np.int64)
+            next_rank[:n-sorted_depth] = rank[sorted_depth:]
+            key = rank * (n + 1) + next_rank + 1
+            sa = np.argsort(key, kind='stable')
+            sorted_depth *= 2
+        
+        os.makedirs(indexDir, exist_ok=True)
+        np.save(os.path.join(indexDir, "text.npy"), text)
+        np.save(os.path.join(indexDir, "sa.npy"), sa.astype(np.int32 if n < 2**31 else np.int64))
+        np.save(os.path.join(indexDir, "offsets.npy"), offsets)
+        np.save(os.path.join(indexDir, "lengths.npy"), lengths)
+        with open(os.path.join(indexDir, "meta.json.tmp"), 'w') as OUT:
+            json.dump({ 'depth': int(sorted_depth), 'names': names }, OUT)
+        os.replace(os.path.join(indexDir, "meta.json.tmp"), os.path.join(indexDir, "meta.json"))
+    
+    def __suffix_range(self, query):
+        """
+        Return [lo, hi) of suffix array rows starting with query (bytes, len(query) <= depth)
+        """
+        text, sa, m = self.text, self.sa, len(query)
+        lo, hi = 0, len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = int(sa[mid])
+            if text[pos:pos+m].tobytes() < query:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = lo
+        hi = len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = int(sa[mid])
+            if text[pos:pos+m].tobytes() <= query:
+                lo = mid + 1
+            else:
+                hi = mid
+        return start, lo
+    
+    def __exact_positions(self, query):
+        """
+        Return text positions of exact occurrences of query (bytes)
+        """
+        import numpy as np
+        
+        lo, hi = self.__suffix_range(query[:self.depth])
+        positions = np.sort(np.asarray(self.sa[lo:hi], dtype=np.int64))
+        if len(query) > self.depth and len(positions) > 0:
+            positions = positions[ self.__count_mismatches(positions, query) == 0 ]
+        return positions
+    
+    def __count_mismatches(self, positions, query):
+        """
+        Return the number of mismatches of query at each text position, windows beyond the text or crossing a sequence end count as len(query)+1
+        """
+        import numpy as np
+        
+        m = len(query)
+        q = np.frombuffer(query, dtype=np.uint8)
+        mismatches = np.full(len(positions), m + 1, dtype=np.int64)
+        valid = np.nonzero(positions + m <= len(self.text))[0]
+        for i in range(0, len(valid), 65536):
+            rows = valid[i:i+65536]
+            window = self.text[ positions[rows][:,None] + np.arange(m) ]
+            mismatch = (window != q).sum(1)
+            mismatch[ (window == ord('$')).any(1) ] = m + 1
+            mismatches[rows] = mismatch
+        return mismatches
+    
+    def find(self, sub_seq, mismatches=0):
+        """
+        sub_seq                 -- Query sequence (T/U are the same, case-insensitive)
+        mismatches              -- Maximum number of mismatches (substitutions only)
+        
+        Return a numpy structured array with fields name, start, end, mismatches, 0-based [start, end),
+        sorted by sequence and position
+        """
+        import numpy as np
+        
+        query = self._normalize(sub_seq)
+        m = len(query)
+        if m == 0:
+            raise RuntimeError("Error: empty query")
+        
+        if mismatches == 0:
+            positions = self.__exact_positions(query)
+            counts = np.zeros(len(positions), dtype=np.int64)
+        else:
+            if mismatches >= m:
+                positions = np.arange(max(len(self.text) - m + 1, 0), dtype=np.int64)
+            else:
+                ### Pigeonhole: one of mismatches+1 pieces matches exactly
+                pieces = mismatches + 1
+                bounds = [ m * i // pieces for i in range(pieces + 1) ]
+                candidates = [ self.__exact_positions(query[bounds[i]:bounds[i+1]]) - bounds[i] for i in range(pieces) ]
+                positions = np.unique(np.concatenate(candidates))
+                positions = positions[positions >= 0]
+            counts = self.__count_mismatches(positions, query)
+            keep = counts <= min(mismatches, m)
+            positions, counts = positions[keep], counts[keep]
+        
+        seq_idx = np.searchsorted(self.offsets, positions, side='right') - 1
+        hits = np.zeros(len(positions), dtype=[('name', self.names.dtype), ('start', np.int64), ('end', np.int64), ('mismatches', np.int64)])
+        hits['name'] = self.names[seq_idx]
+        hits['start'] = positions - self.offsets[seq_idx]
+        hits['end'] = hits['start'] + m
+        hits['mismatches'] = counts
+        return hits
+    
+    def count(self, sub_seq):
+        """
+        Return the number of exact occurrences
+        """
+        query = self._normalize(sub_seq)
+        if len(query) > self.depth:
+            return len(self.__exact_positions(query))
+        lo, hi = self.__suffix_range(query)
+        return hi - lo
+    
+    def find_batch(self, seq_list, mismatches=0):
+        """
+        Return a list of hit arrays
+        """
+        return [ self.find(sub_seq, mismatches) for sub_seq in seq_list ]
+
+class AlignProjection(object):
+    def __init__(self, aligned_seq, gap_sym="-"):
+        """
+        Project per-base tracks of a sequence into or out of alignment coordinates.
+        The gap mask and the cumulative ungapped index are computed once.
+        
+        aligned_seq             -- Aligned sequence  ATCGACG-ATAGCT-AATGCTAGC
+        gap_sym                 -- Gap symbols, can be several symbols such as "-."
+        """
+        import numpy as np
+        
+        self.aligned_seq = aligned_seq
+        self.align_len = len(aligned_seq)
+        codes = np.frombuffer(aligned_seq.encode(), dtype=np.uint8)
+        self.gap_mask = np.isin(codes, np.frombuffer(gap_sym.encode(), dtype=np.uint8))
+        ### align_pos[k]: 0-based aligned column of the k-th base
+        self.align_pos = np.nonzero(~self.gap_mask)[0]
+        self.seq_len = len(self.align_pos)
+        ### cum_len[i]: number of bases in aligned_seq[:i]
+        self.cum_len = np.r_[0, np.cumsum(~self.gap_mask)]
+    
+    def to_align(self, track, fill='-'):
+        """
+        track                   -- A per-base track with length of ungapped sequence: 
+                                   str (dot, sequence, labels), list (SHAPE, bpprob) or numpy array
+        fill                    -- Value for gap columns
+        
+        Return the aligned track with the same type as input
+        """
+        import numpy as np
+        
+        assert len(track) == self.seq_len, "Length of track should be same as ungapped sequence"
+        if isinstance(track, str):
+            aligned = np.full(self.align_len, ord(fill), dtype=np.uint8)
+            aligned[self.align_pos] = np.frombuffer(track.encode(), dtype=np.uint8)
+            return aligned.tobytes().decode()
+        if isinstance(track, np.ndarray):
+            dtype = object if isinstance(fill, str) else np.result_type(track.dtype, np.asarray(fill).dtype)
+            aligned = np.full(self.align_len, fill, dtype=dtype)
+            aligned[self.align_pos] = track
+            return aligned
+        aligned = np.full(self.align_len, fill, dtype=object)
+        aligned[self.align_pos] = np.array(track, dtype=object)
+        return aligned.tolist()
+    
+    def from_align(self, aligned_track):
+        """
+        aligned_track           -- A track with length of aligned sequence
+        
+        Return the track of ungapped sequence with the same type as input
+        """
+        import numpy as np
+        
+        assert len(aligned_track) == self.align_len, "Length of track should be same as aligned sequence"
+        if isinstance(aligned_track, str):
+            return np.frombuffer(aligned_track.encode(), dtype=np.uint8)[self.align_pos].tobytes().decode()
+        if isinstance(aligned_track, np.ndarray):
+            return aligned_track[self.align_pos]
+        return [ aligned_track[i] for i in self.align_pos.tolist() ]
+    
+    def to_align_batch(self, tracks, fill='-'):
+        """
+        Project many tracks, return a list of aligned tracks
+        """
+        return [ self.to_align(track, fill) for track in tracks ]
+    
+    def from_align_batch(self, aligned_tracks):
+        """
+        Project many aligned tracks back, return a list of tracks
+        """
+        return [ self.from_align(track) for track in aligned_tracks ]
+    
+    def alignPos2seqPos(self, alignPos):
+        """
+        alignPos                -- 1-based aligned position, int or array
+        
+        Return 1-based sequence position: number of bases in aligned_seq[:alignPos]
+        """
+        return self.cum_len[alignPos]
+    
+    def seqPos2alignPos(self, seqPos):
+        """
+        seqPos                  -- 1-based sequence position, int or array
+        
+        Return 1-based aligned position
+        """
+        import numpy as np
+        return self.align_pos[np.asarray(seqPos)-1] + 1
+    
+    def raw_range(self, align_start, align_end):
+        """
+        align_start, align_end  -- 0-based half open aligned region, as in aligned_seq[align_start:align_end]
+        
+        Return the 1-based closed region of ungapped sequence (start, end), start>end if no base in the region
+        """
+        return int(self.cum_len[align_start])+1, int(self.cum_len[align_end])
+
 class AlignedFasta(object):
     def __init__(self, afa_fn, gap_sym="-", verbose=1):
         self.gap_sym = gap_sym
@@ -176,6 +726,13 @@ class AlignedFasta(object):
         if verbose:
             print(f"Total {len(self.seq_keys)} sequences, aligned length: {self.alignLen}")
     
+    def _projection(self, seqID):
+        if not hasattr(self, '_projections'):
+            self._projections = {}
+        if seqID not in self._projections:
+            self._projections[seqID] = AlignProjection(self.fasta_dict[seqID], self.gap_sym)
+        return self._projections[seqID]
+    
     def _check_seq_num(self):
         if len(self.seq_keys) <= 1:
             return False
@@ -198,12 +755,7 @@ class AlignedFasta(object):
         """
         assert 1<=alignPos<=self.alignLen
         assert seqID in self.seq_keys
-        pos = 0
-        while alignPos != 0:
-            if self.fasta_dict[seqID][alignPos-1]!=self.gap_sym:
-                pos += 1
-            alignPos -= 1
-        return pos
+        return int(self._projection(seqID).alignPos2seqPos(alignPos))
     
     def seqPos2alignPos(self, seqPos, seqID):
         """
@@ -216,12 +768,7 @@ class AlignedFasta(object):
         """
         assert 1<=seqPos<=self.alignLen
         assert seqID in self.seq_keys
-        pos = 0
-        while seqPos != 0:
-            pos += 1
-            if self.fasta_dict[seqID][pos-1]!=self.gap_sym:
-                seqPos -= 1
-        return pos
+        return int(self._projection(seqID).seqPos2alignPos(seqPos))
     
     def seqPos2seqPos(self, seqPos, querySeqID, targetSeqID):
         """
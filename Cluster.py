@@ -43,23 +43,56 @@ job2.set_job_depends(job1) # you can use list for multiple process
 job1.submit() # job1 must be sumbit before job2
 job2.submit()
 
+########### Example 5 -- Wait many jobs with one bjobs query per interval
+
+jobs = [ new_job(command=f"sleep {i}") for i in range(100) ]
+for job in jobs:
+    job.submit()
+
+for job in iter_finished_jobs(jobs): # yield jobs as they complete
+    print(job.job_id, job.job_status())
+
+wait_jobs(jobs) # or wait all of them
+
+########### Example 6 -- Submit thousands of small tasks as one job array
+
+commands = [ f"Fold chunk_{i}.fa chunk_{i}.ct" for i in range(10000) ]
+array = new_job_array(commands, job_name="fold", logFn="log/fold.%I", max_running=200)
+array.submit()
+
+merge = new_job(command="cat chunk_*.ct > all.ct")
+merge.set_job_depends(array) # run when all elements done
+merge.submit()
+
+array.wait()
+
+########### Example 7 -- Run the same pipeline on a workstation with a local process pool
+
+set_default_backend('local', max_cpu=8) # or export IPYRSSA_BACKEND=local
+job1 = new_job(command="sleep 5", cpu=4)
+job2 = new_job(command="sleep 2", cpu=4)
+job2.set_job_depends(job1)
+job1.submit()
+job2.submit()
+job2.wait()
+
 
 """
 
 import os, sys, random, re, time
-import General, subprocess, Colors
+import General, subprocess
 
 if 'getstatusoutput' in dir(subprocess):
     from subprocess import getstatusoutput
 else:
     from commands import getstatusoutput
 
-try:
-    bkill = General.require_exec("bkill", warning="", exception=True)
-    bsub = General.require_exec("bsub", warning="", exception=True)
-    bjobs = General.require_exec("bjobs", warning="", exception=True)
-except NameError:
-    print(Colors.f("Error: bkill not found in PATH, Cluster module cannot be used",fc='red'))
+bkill = General.require_exec("bkill", exception=False)
+bsub = General.require_exec("bsub", exception=False)
+bjobs = General.require_exec("bjobs", exception=False)
+
+### The backend used by new_job when backend is not given: lsf or local
+DEFAULT_BACKEND = os.environ.get('IPYRSSA_BACKEND', 'lsf' if bsub else 'local')
 
 def host_name():
     return os.environ['HOSTNAME']
@@ -67,13 +100,15 @@ def host_name():
 def get_bsub_id(output_info):
     return int(re.findall("\\<(\\d+)\\>", output_info)[0])
 
+FINISH_STATUS = ('Not_Found', 'DONE', 'EXIT')
+
 def bjob_finish(job_id):
     """
     job_id              -- Job id
     
     Return True if the job had finished.
     """
-    if job_status(job_id) in ('Not_Found', 'DONE', 'EXIT'):
+    if job_status(job_id) in FINISH_STATUS:
         return True
     else:
         return False
@@ -87,17 +122,231 @@ def kill_job(job_id):
     CMD = bkill + " %s > /dev/null" % (job_id)
     os.system(CMD)
 
+def query_job_status(job_ids, bjobs_exec=None):
+    """
+    job_ids             -- A list of job ids
+    bjobs_exec          -- Path of bjobs, default is the bjobs in PATH
+    
+    Query the status of all jobs with a single bjobs call.
+    Elements of a job array share the job id, the array is finished only when
+    all elements are finished.
+    
+    Return { job_id: one of Not_Found, DONE, RUN, PEND, EXIT, ... }
+    """
+    if not job_ids:
+        return {}
+    if bjobs_exec is None:
+        bjobs_exec = bjobs
+    
+    job_ids = [ int(job_id) for job_id in job_ids ]
+    proc = subprocess.run([bjobs_exec, '-a'] + [ str(job_id) for job_id in job_ids ], 
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    
+    element_status = {}
+    for line in proc.stdout.split('\n'):
+        data = line.split()
+        if len(data) >= 3 and data[0].isdigit():
+            element_status.setdefault(int(data[0]), []).append(data[2])
+    
+    status = {}
+    for job_id in job_ids:
+        states = element_status.get(job_id)
+        if not states:
+            status[job_id] = 'Not_Found'
+        elif all([ state in FINISH_STATUS for state in states ]):
+            status[job_id] = 'EXIT' if 'EXIT' in states else 'DONE'
+        elif 'RUN' in states:
+            status[job_id] = 'RUN'
+        else:
+            status[job_id] = [ state for state in states if state not in FINISH_STATUS ][0]
+    return status
+
 def job_status(job_id):
     """
     job_id              -- Job id
     
     Return one of Not_Found, DONE, RUN, PEND, EXIT
     """
-    CMD = bjobs + " %s" % (job_id, )
-    out_info = getstatusoutput(CMD)[1] 
-    if "is not found" in out_info:
-        return "Not_Found"
-    return out_info.split('\n')[1].split()[2]
+    return query_job_status([job_id])[int(job_id)]
+
+class JOB_POLLER:
+    def __init__(self, interval=1, max_interval=30, backoff=1.5, bjobs_exec=None):
+        """
+        interval            -- Seconds between the first queries
+        max_interval        -- Maximum seconds between queries
+        backoff             -- The interval is multiplied by backoff after each query without new finished jobs
+        bjobs_exec          -- Path of bjobs, default is the bjobs in PATH
+        
+        Track many jobs and query all of them with one bjobs call per interval.
+        The status of each job is cached. A poller can be shared by several threads.
+        """
+        import threading
+        
+        self.lock = threading.RLock()
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.bjobs_exec = bjobs_exec
+        self.status = {}
+        self.last_poll = 0
+    
+    def track(self, job_ids):
+        """
+        job_ids             -- Job id/JOB_HANDLE object or a list of them
+        """
+        with self.lock:
+            for job_id in _job_id_list(job_ids):
+                self.status.setdefault(job_id, None)
+    
+    def untrack(self, job_ids):
+        """
+        job_ids             -- Job id/JOB_HANDLE object or a list of them
+        """
+        with self.lock:
+            for job_id in _job_id_list(job_ids):
+                self.status.pop(job_id, None)
+    
+    def poll(self):
+        """
+        Query the status of all unfinished tracked jobs
+        
+        Return the number of jobs finished in this query
+        """
+        with self.lock:
+            pending = [ job_id for job_id,status in self.status.items() if status not in FINISH_STATUS ]
+        new_status = query_job_status(pending, bjobs_exec=self.bjobs_exec)
+        with self.lock:
+            for job_id,status in new_status.items():
+                # Skip jobs untracked by another thread during the query, and never let
+                # an older concurrent query overwrite a finished status
+                if job_id in self.status and self.status[job_id] not in FINISH_STATUS:
+                    self.status[job_id] = status
+            self.last_poll = time.time()
+        return len([ status for status in new_status.values() if status in FINISH_STATUS ])
+    
+    def get_status(self, job_id, max_age=None):
+        """
+        job_id              -- Job id
+        max_age             -- Query again if the cached status is older than max_age seconds
+        
+        Return the cached status, one of Not_Found, DONE, RUN, PEND, EXIT
+        """
+        self.track(job_id)
+        job_id = _job_id_list(job_id)[0]
+        with self.lock:
+            status = self.status[job_id]
+            last_poll = self.last_poll
+        if status is None or (status not in FINISH_STATUS and (max_age is None or time.time()-last_poll > max_age)):
+            self.poll()
+        with self.lock:
+            return self.status.get(job_id, status)
+    
+    def iter_finished(self, job_ids=None, interval=None):
+        """
+        job_ids             -- Job id/JOB_HANDLE object or a list of them, default is all tracked jobs
+        interval            -- Seconds between the first queries of this call, default is self.interval
+        
+        Yield job ids as they finish
+        """
+        if job_ids is None:
+            with self.lock:
+                job_ids = list(self.status)
+        else:
+            self.track(job_ids)
+            job_ids = _job_id_list(job_ids)
+        
+        if interval is None:
+            interval = self.interval
+        start_interval = interval
+        remain = set(job_ids)
+        first = True
+        while remain:
+            if not first:
+                time.sleep(interval)
+            first = False
+            self.poll()
+            with self.lock:
+                # Jobs untracked by another thread are kept unfinished and tracked again
+                for job_id in remain:
+                    self.status.setdefault(job_id, None)
+                finished = [ job_id for job_id in job_ids if job_id in remain and self.status[job_id] in FINISH_STATUS ]
+            for job_id in finished:
+                remain.discard(job_id)
+                yield job_id
+            if finished:
+                interval = start_interval
+            else:
+                interval = min(interval*self.backoff, self.max_interval)
+    
+    def wait(self, job_ids=None, interval=None):
+        """
+        job_ids             -- Job id/JOB_HANDLE object or a list of them, default is all tracked jobs
+        interval            -- Seconds between the first queries of this call, default is self.interval
+        
+        Wait all jobs to finish
+        """
+        for job_id in self.iter_finished(job_ids, interval=interval):
+            pass
+
+__shared_poller = None
+
+def get_poller():
+    """
+    Return the poller shared by all JOB_HANDLE objects
+    """
+    global __shared_poller
+    if __shared_poller is None:
+        __shared_poller = JOB_POLLER()
+    return __shared_poller
+
+def _job_id_list(jobs):
+    """
+    jobs                -- Job id/JOB_HANDLE object or a list of them
+    """
+    if not isinstance(jobs, (list, tuple, set)):
+        jobs = [ jobs ]
+    job_ids = []
+    for job in jobs:
+        if isinstance(job, JOB_HANDLE):
+            if not job.has_submit:
+                raise NameError("Error: Please submit the job at first")
+            job_ids.append(job.job_id)
+        else:
+            job_ids.append(int(job))
+    return job_ids
+
+def wait_jobs(jobs, poller=None):
+    """
+    jobs                -- A list of JOB_HANDLE/LOCAL_JOB_HANDLE objects or job ids
+    poller              -- A JOB_POLLER object, default is the shared poller
+    
+    Wait all jobs to finish, all jobs are queried with one bjobs call per interval
+    """
+    for job in iter_finished_jobs(jobs, poller=poller):
+        pass
+
+def iter_finished_jobs(jobs, poller=None):
+    """
+    jobs                -- A list of JOB_HANDLE/LOCAL_JOB_HANDLE objects or job ids
+    poller              -- A JOB_POLLER object, default is the shared poller
+    
+    Yield the jobs (the same object as input) as they finish
+    """
+    local_jobs = [ job for job in jobs if isinstance(job, LOCAL_JOB_HANDLE) ]
+    if local_jobs:
+        if len(local_jobs) != len(jobs):
+            raise RuntimeError("Error: local and lsf jobs cannot be waited together")
+        for job in local_jobs[0].executor.iter_finished(local_jobs):
+            yield job
+        return
+    
+    if poller is None:
+        poller = get_poller()
+    id2job = {}
+    for job, job_id in zip(jobs, _job_id_list(jobs)):
+        id2job[job_id] = job
+    for job_id in poller.iter_finished(list(id2job)):
+        yield id2job[job_id]
 
 def compile_depence_string(job_depends):
     """
@@ -145,7 +394,7 @@ class JOB_HANDLE:
         """
         if type(job_depends) == list:
             self.job_depends = job_depends
-        elif type(job_depends) == JOB_HANDLE:
+        elif isinstance(job_depends, JOB_HANDLE):
             self.job_depends = [ job_depends ]
         elif type(job_depends) == int:
             self.job_depends = [ job_depends ]
@@ -168,6 +417,10 @@ class JOB_HANDLE:
         """
         Return True if the job have ready
         """
+        if bsub is None:
+            sys.stderr.writelines("bsub not found in PATH, please use the local backend\n")
+            return False
+        
         if host_name() not in ('loginview02', 'mgt01', 'loginview03', 'ZIO01'):
             sys.stderr.writelines("Please submit a job in loginview02, loginview03 or mgt01 or ZIO01\n")
             return False
@@ -227,7 +480,7 @@ class JOB_HANDLE:
         if not self.has_submit:
             raise NameError("Error: Please submit the job at first")
         
-        return bjob_finish(self.job_id)
+        return get_poller().get_status(self.job_id, max_age=1) in FINISH_STATUS
     
     def job_status(self):
         """
@@ -236,20 +489,19 @@ class JOB_HANDLE:
         if not self.has_submit:
             raise NameError("Error: Please submit the job at first")
         
-        return job_status(self.job_id)
+        return get_poller().get_status(self.job_id, max_age=1)
     
     def wait(self, interval=1):
         """
-        interval            -- Seconds for each search
+        interval            -- Seconds between the first searches, it grows up to 30 seconds
         
-        Wait the job to finish
+        Wait the job to finish. All waiting jobs share one bjobs query per interval
         """
         
         if not self.has_submit:
             raise NameError("Error: Please submit the job at first")
         
-        while not bjob_finish(self.job_id):
-            time.sleep(interval)
+        get_poller().wait(self.job_id, interval=interval)
     
     def kill(self):
         """
@@ -261,24 +513,33 @@ class JOB_HANDLE:
         if self.has_submit:
             self.kill()
 
-def new_job(command, queue="Z-ZQF", cpu=1, job_name="", logFn="", errFn=""):
+def new_job(command, queue="Z-ZQF", cpu=1, job_name="", logFn="", errFn="", backend=None):
     """
     command             -- Shell command to submit
-    queue               -- Queue name: Z-ZQF, Z-BNODE, Z-HNODE
+    queue               -- Queue name: Z-ZQF, Z-BNODE, Z-HNODE. Ignored by the local backend
     cpu                 -- CPU number
     job_name            -- Give a name for job
     logFn               -- A file to save the content from standard output
     errFn               -- A file to save the content from standard error output
+    backend             -- lsf or local, default is DEFAULT_BACKEND
     
-    Return a JOB_HANDLE object
+    Return a JOB_HANDLE object (lsf) or a LOCAL_JOB_HANDLE object (local)
     """
-    if queue not in ('Z-ZQF', 'Z-BNODE', 'Z-HNODE'):
+    if backend is None:
+        backend = DEFAULT_BACKEND
+    if backend not in ('lsf', 'local'):
+        raise NameError("Error: backend must be one of lsf/local")
+    
+    if backend == 'lsf' and queue not in ('Z-ZQF', 'Z-BNODE', 'Z-HNODE'):
         raise NameError("Error: queue must be one of Z-ZQF/Z-BNODE/Z-HNODE")
     
     if job_name == "":
         job_name = command
     
-    job = JOB_HANDLE(queue, cpu, job_name)
+    if backend == 'local':
+        job = LOCAL_JOB_HANDLE(get_local_executor(), cpu, job_name)
+    else:
+        job = JOB_HANDLE(queue, cpu, job_name)
     job.set_job_command(command)
     if logFn != "":
         job.set_log_file(logFn)
@@ -288,8 +549,372 @@ def new_job(command, queue="Z-ZQF", cpu=1, job_name="", logFn="", errFn=""):
     
     return job
 
+class JOB_ARRAY_HANDLE(JOB_HANDLE):
+    def __init__(self, queue, cpu=1, job_name="", max_running=None):
+        """
+        queue               -- Queue name: Z-ZQF, Z-BNODE, Z-HNODE
+        cpu                 -- CPU number of each element
+        job_name            -- Give a name for job array
+        max_running         -- Maximum number of elements running at the same time
+        
+        Return a handle of a new job array. All JOB_HANDLE methods act on the whole array
+        """
+        JOB_HANDLE.__init__(self, queue, cpu, job_name)
+        self.max_running = max_running
+    
+    def set_job_commands(self, commands, work_dir=None):
+        """
+        commands            -- A list of shell commands, or a manifest file with one command per line
+        work_dir            -- Directory to save the manifest and wrapper script, it must be visible 
+                               from computing nodes. Default is a new directory in $HOME
+        
+        Write the manifest and a wrapper that runs the $LSB_JOBINDEX-th command
+        """
+        import tempfile
+        
+        if work_dir is not None and not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        
+        if isinstance(commands, str):
+            manifestFn = os.path.abspath(commands)
+            with open(manifestFn) as IN:
+                size = len([ line for line in IN if line.strip() ])
+        else:
+            for command in commands:
+                if '\n' in command or not command.strip():
+                    raise RuntimeError("Error: command of job array should be a single non-empty line")
+            if work_dir is None:
+                work_dir = tempfile.mkdtemp(prefix="job_array_", dir=os.environ['HOME'])
+            handle, manifestFn = tempfile.mkstemp(prefix="job_array_", suffix=".manifest", dir=os.path.abspath(work_dir))
+            OUT = os.fdopen(handle, 'w')
+            for command in commands:
+                OUT.writelines(command+"\n")
+            OUT.close()
+            size = len(commands)
+        
+        if size == 0:
+            raise RuntimeError("Error: job array should contain at least one command")
+        
+        # A unique wrapper, so arrays sharing a directory never overwrite each other
+        handle, wrapperFn = tempfile.mkstemp(prefix="job_array_", suffix=".sh", dir=work_dir or os.path.dirname(manifestFn))
+        OUT = os.fdopen(handle, 'w')
+        OUT.writelines("#!/bin/bash\n")
+        # The $LSB_JOBINDEX-th non-empty line, blank lines are not counted in size
+        OUT.writelines("eval \"$(awk -v n=\"${LSB_JOBINDEX}\" 'NF && ++i==n {print; exit}' %s)\"\n" % (manifestFn, ))
+        OUT.close()
+        
+        self.manifest = manifestFn
+        self.size = size
+        self.command = "bash " + wrapperFn
+    
+    def get_submit_command(self):
+        """
+        Return the Shell command if it is ready
+        """
+        if not self.ready():
+            return ""
+        
+        array_spec = "%s[1-%s]" % (self.job_name, self.size)
+        if self.max_running:
+            array_spec += "%%%s" % (self.max_running, )
+        
+        CMD = bsub + " -q %s -n %s -J \"%s\"" % (self.queue, self.cpu, array_spec)
+        
+        if hasattr(self, 'logFn'):
+            CMD += " -o %s" % (self.logFn, )
+        
+        if hasattr(self, 'errFn'):
+            CMD += " -e %s" % (self.errFn, )
+        
+        if hasattr(self, 'job_depends'):
+            CMD += " -w " + compile_depence_string(self.job_depends)
+        
+        CMD += """ "%s" """ % ( self.command,  )
+        
+        return CMD
+
+def new_job_array(commands, queue="Z-ZQF", cpu=1, job_name="job_array", logFn="", errFn="", max_running=None, work_dir=None):
+    """
+    commands            -- A list of shell commands, or a manifest file with one command per line
+    queue               -- Queue name: Z-ZQF, Z-BNODE, Z-HNODE
+    cpu                 -- CPU number of each element
+    job_name            -- Give a name for job array
+    logFn               -- A file to save the content from standard output, %I is replaced by the element index
+    errFn               -- A file to save the content from standard error output, %I is replaced by the element index
+    max_running         -- Maximum number of elements running at the same time
+    work_dir            -- Directory to save the manifest and wrapper script
+    
+    Submit all commands as one LSF job array (bsub -J "name[1-N]%max_running")
+    
+    Return a JOB_ARRAY_HANDLE object
+    """
+    if queue not in ('Z-ZQF', 'Z-BNODE', 'Z-HNODE'):
+        raise NameError("Error: queue must be one of Z-ZQF/Z-BNODE/Z-HNODE")
+    if re.search(r"[\[\]\"%]", job_name):
+        raise NameError("Error: job_name of job array cannot contain [, ], \" or %")
+    
+    job = JOB_ARRAY_HANDLE(queue, cpu, job_name, max_running=max_running)
+    job.set_job_commands(commands, work_dir=work_dir)
+    if logFn != "":
+        job.set_log_file(logFn)
+    
+    if errFn != "":
+        job.set_error_file(errFn)
+    
+    return job
+
+##################################
+####    Local backend
+##################################
 
+class LOCAL_EXECUTOR:
+    def __init__(self, max_cpu=None, poll_interval=0.05):
+        """
+        max_cpu             -- Maximum number of CPUs used by running jobs, default is all cores
+        poll_interval       -- Seconds between checks of running processes
+        
+        Run submitted commands on this machine. A job starts when all jobs it
+        depends on are DONE and enough CPUs are free; it becomes EXIT if a
+        dependency fails.
+        """
+        import threading
+        
+        self.max_cpu = max_cpu if max_cpu else (os.cpu_count() or 1)
+        self.poll_interval = poll_interval
+        self.cond = threading.Condition()
+        self.queue = []
+        self.running = {}
+        self.next_id = 1
+        self.thread = None
+    
+    def __start_thread(self):
+        import threading
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.__schedule, daemon=True)
+            self.thread.start()
+    
+    def submit(self, job):
+        """
+        job                 -- A LOCAL_JOB_HANDLE object
+        
+        Return the job id
+        """
+        with self.cond:
+            job.job_id = self.next_id
+            self.next_id += 1
+            job.status = 'PEND'
+            self.queue.append(job)
+            self.__start_thread()
+            self.cond.notify_all()
+        return job.job_id
+    
+    def kill(self, job):
+        with self.cond:
+            if job in self.queue:
+                self.queue.remove(job)
+                job.status = 'EXIT'
+            elif job.job_id in self.running:
+                # The shell and everything it started share one process group
+                import signal
+                try:
+                    os.killpg(job.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            self.cond.notify_all()
+    
+    def __used_cpu(self):
+        return sum([ min(job.cpu, self.max_cpu) for job in self.running.values() ])
+    
+    def __launch(self, job):
+        out = open(job.logFn, 'a') if hasattr(job, 'logFn') else subprocess.DEVNULL
+        err = open(job.errFn, 'a') if hasattr(job, 'errFn') else subprocess.DEVNULL
+        try:
+            job.process = subprocess.Popen(job.command, shell=True, stdout=out, stderr=err, start_new_session=True)
+        finally:
+            if out is not subprocess.DEVNULL: out.close()
+            if err is not subprocess.DEVNULL: err.close()
+        job.status = 'RUN'
+        self.running[job.job_id] = job
+    
+    def __schedule(self):
+        while True:
+            with self.cond:
+                for job_id in list(self.running):
+                    job = self.running[job_id]
+                    return_code = job.process.poll()
+                    if return_code is not None:
+                        job.return_code = return_code
+                        job.status = 'DONE' if return_code == 0 else 'EXIT'
+                        del self.running[job_id]
+                        self.cond.notify_all()
+                
+                for job in list(self.queue):
+                    depends = getattr(job, 'job_depends', [])
+                    if any([ dep.status == 'EXIT' for dep in depends ]):
+                        job.status = 'EXIT'
+                        self.queue.remove(job)
+                        self.cond.notify_all()
+                    elif all([ dep.status == 'DONE' for dep in depends ]):
+                        if not self.running or self.__used_cpu() + min(job.cpu, self.max_cpu) <= self.max_cpu:
+                            self.queue.remove(job)
+                            self.__launch(job)
+                
+                if not self.queue and not self.running:
+                    self.thread = None
+                    return
+                self.cond.wait(self.poll_interval)
+    
+    def iter_finished(self, jobs):
+        """
+        jobs                -- A list of LOCAL_JOB_HANDLE objects
+        
+        Yield jobs as they finish
+        """
+        remain = list(jobs)
+        while remain:
+            with self.cond:
+                finished = [ job for job in remain if job.status in FINISH_STATUS ]
+                if not finished:
+                    self.cond.wait(1)
+            for job in finished:
+                remain.remove(job)
+                yield job
+
+class LOCAL_JOB_HANDLE:
+    def __init__(self, executor, cpu=1, job_name=""):
+        """
+        executor            -- A LOCAL_EXECUTOR object
+        cpu                 -- CPU number
+        job_name            -- Give a name for job
+        
+        Return a handle of a new local job, it has the same methods as JOB_HANDLE
+        """
+        self.executor = executor
+        self.cpu = cpu
+        self.job_name = job_name
+        self.has_submit = False
+        self.status = None
+    
+    def set_job_command(self, command):
+        """
+        command             -- Shell command to submit
+        """
+        self.command = command
+    
+    def set_job_depends(self, job_depends):
+        """
+        job_depends         -- LOCAL_JOB_HANDLE object list to wait beform running
+        """
+        if isinstance(job_depends, LOCAL_JOB_HANDLE):
+            job_depends = [ job_depends ]
+        if type(job_depends) != list or not all([ isinstance(job, LOCAL_JOB_HANDLE) for job in job_depends ]):
+            raise RuntimeError("job_depends should be LOCAL_JOB_HANDLE or a list of LOCAL_JOB_HANDLE")
+        self.job_depends = job_depends
+    
+    def set_log_file(self, logFn):
+        """
+        logFn            -- A file to save the content from standard output
+        """
+        self.logFn = os.path.expanduser(logFn)
+    
+    def set_error_file(self, errFn):
+        """
+        errFn            -- A file to save the content from standard error output
+        """
+        self.errFn = os.path.expanduser(errFn)
+    
+    def ready(self):
+        """
+        Return True if the job have ready
+        """
+        if not hasattr(self, 'command'):
+            sys.stderr.writelines("Please set command using set_job_command\n")
+            return False
+        for job in getattr(self, 'job_depends', []):
+            if not job.has_submit:
+                sys.stderr.writelines("Please submit the jobs it depends on at first\n")
+                return False
+        return True
+    
+    def get_submit_command(self):
+        """
+        Return the Shell command if it is ready
+        """
+        if not self.ready():
+            return ""
+        return self.command
+    
+    def submit(self, verbose=False):
+        """
+        Submit the command if it is ready
+        Return the job id
+        """
+        if self.has_submit:
+            raise NameError("Error: this job has submited")
+        
+        if not self.ready():
+            raise NameError("Error: JOB not ready")
+        
+        if verbose:
+            print(self.command)
+        self.executor.submit(self)
+        self.has_submit = True
+        
+        return self.job_id
+    
+    def has_finish(self):
+        """
+        Return True if the job has finished
+        """
+        return self.job_status() in FINISH_STATUS
+    
+    def job_status(self):
+        """
+        Return one of DONE, RUN, PEND, EXIT
+        """
+        if not self.has_submit:
+            raise NameError("Error: Please submit the job at first")
+        return self.status
+    
+    def wait(self, interval=1):
+        """
+        interval            -- Not used, kept for compatibility with JOB_HANDLE
+        
+        Wait the job to finish
+        """
+        if not self.has_submit:
+            raise NameError("Error: Please submit the job at first")
+        for job in self.executor.iter_finished([self]):
+            pass
+    
+    def kill(self):
+        """
+        Kill the job
+        """
+        self.executor.kill(self)
 
+__local_executor = None
 
+def get_local_executor():
+    """
+    Return the LOCAL_EXECUTOR shared by all local jobs
+    """
+    global __local_executor
+    if __local_executor is None:
+        __local_executor = LOCAL_EXECUTOR()
+    return __local_executor
 
+def set_default_backend(backend, max_cpu=None):
+    """
+    backend             -- lsf or local
+    max_cpu             -- Maximum number of CPUs used by local jobs, default is all cores
+    
+    Set the backend used by new_job
+    """
+    global DEFAULT_BACKEND
+    if backend not in ('lsf', 'local'):
+        raise NameError("Error: backend must be one of lsf/local")
+    DEFAULT_BACKEND = backend
+    if max_cpu is not None:
+        get_local_executor().max_cpu = max_cpu
 
@@ -110,30 +110,49 @@ def f(text, fc='red', bc='default', ft='normal'):
     """
     return format(text, fc=fc, bc=bc, ft=ft)
 
-def color_SHAPE(shape_list, cutoff=[0.3, 0.5, 0.7]):
+SHAPE_CLASS_BC = ['lightgray', 'blue', 'cyan', 'green', 'red']
+
+def shape_color_class(shape_list, cutoff=[0.3, 0.5, 0.7]):
     """
     shape_list              -- A list of SHAPE scores
     cutoff                  -- Cutoff of SHAPE color boundaries.
     
-    Transform SHAPE values to color blocks
+    Return a numpy array of color classes, index of SHAPE_CLASS_BC:
+        0: NULL; 1: <cutoff[0]; 2: <cutoff[1]; 3: <cutoff[2]; 4: >=cutoff[2]
+    """
+    import numpy as np
+    
+    values = np.array([ np.nan if v == 'NULL' else v for v in shape_list ], dtype=float)
+    classes = np.digitize(np.nan_to_num(values, nan=-np.inf), cutoff) + 1
+    classes[np.isnan(values)] = 0
+    return classes
+
+def __class_runs(classes):
     """
-    color_blocks = ""
+    classes                 -- Color classes produced by shape_color_class
     
-    for value in shape_list:
-        if value == 'NULL':
-            color_blocks += f(" ", bc='lightgray')
-        else:
-            shape = float(value)
-            if shape < cutoff[0]:
-                color_blocks += f(" ", bc='blue')
-            elif shape < cutoff[1]:
-                color_blocks += f(" ", bc='cyan')
-            elif shape < cutoff[2]:
-                color_blocks += f(" ", bc='green')
-            else:
-                color_blocks += f(" ", bc='red')
+    Run-length encode the color classes
+    Return [ (class, start, end), ... ]
+    """
+    import numpy as np
     
-    return color_blocks
+    if len(classes) == 0:
+        return []
+    bounds = np.flatnonzero(np.diff(classes)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(classes)]))
+    return list(zip(classes[starts].tolist(), starts.tolist(), ends.tolist()))
+
+def color_SHAPE(shape_list, cutoff=[0.3, 0.5, 0.7]):
+    """
+    shape_list              -- A list of SHAPE scores
+    cutoff                  -- Cutoff of SHAPE color boundaries.
+    
+    Transform SHAPE values to color blocks. Consecutive bases with the same
+    color share one escape sequence
+    """
+    classes = shape_color_class(shape_list, cutoff)
+    return "".join([ f(" "*(e-s), bc=SHAPE_CLASS_BC[c]) for c,s,e in __class_runs(classes) ])
 
 def color_Seq_SHAPE(sequence, shape_list, cutoff=[0.3, 0.5, 0.7]):
     """
@@ -141,30 +160,19 @@ def color_Seq_SHAPE(sequence, shape_list, cutoff=[0.3, 0.5, 0.7]):
     shape_list              -- A list of SHAPE scores
     cutoff                  -- Cutoff of SHAPE color boundaries.
     
-    Transform seuquence to colorful sequence according to their shape values
+    Transform seuquence to colorful sequence according to their shape values.
+    Consecutive bases with the same color share one escape sequence
     """
     
     assert len(sequence) == len(shape_list)
     
-    color_seq = ""
-    
-    for base, value in zip(sequence,shape_list):
-        if value == 'NULL':
-            color_seq += f(base, fc='lightgray')
-        else:
-            shape = float(value)
-            if shape < cutoff[0]:
-                color_seq += f(base, fc='blue')
-            elif shape < cutoff[1]:
-                color_seq += f(base, fc='cyan')
-            elif shape < cutoff[2]:
-                color_seq += f(base, fc='green')
-            else:
-                color_seq += f(base, fc='red')
-    
-    return color_seq
+    classes = shape_color_class(shape_list, cutoff)
+    return "".join([ f(sequence[s:e], fc=SHAPE_CLASS_BC[c]) for c,s,e in __class_runs(classes) ])
 
-def browse_shape(sequence, shape_list_list, linelen=200, dot="", shape_title_list=[], colorcutoff=[0.3, 0.5, 0.7], OUT=sys.stdout):
+def __color_class_blocks(classes):
+    return "".join([ f(" "*(e-s), bc=SHAPE_CLASS_BC[c]) for c,s,e in __class_runs(classes) ])
+
+def iter_browse_shape(sequence, shape_list_list, linelen=200, dot="", shape_title_list=[], colorcutoff=[0.3, 0.5, 0.7], show_auc=True):
     """
     sequence                -- Sequence
     shape_list_list         -- [ [shape_list1, shape_list2, shape_list3, ...], [], []... ]
@@ -172,8 +180,10 @@ def browse_shape(sequence, shape_list_list, linelen=200, dot="", shape_title_lis
     dot                     -- Dot structure
     shape_title_list        -- Title for each shape list
     colorcutoff             -- Cutoff for colorblock
+    show_auc                -- Calculate and show the AUC of each shape list when dot is provided
     
-    Print/compare shape scores in screen
+    A generator of the text blocks printed by browse_shape. The AUC of a
+    track is only calculated when its line is consumed.
     """
     
     import General
@@ -194,38 +204,56 @@ def browse_shape(sequence, shape_list_list, linelen=200, dot="", shape_title_lis
     cyan_legend = format("  ", bc="cyan")+" %s-%s " % (colorcutoff[0], colorcutoff[1])
     blue_legend = format("  ", bc="blue")+" <%s " % (colorcutoff[0], )
     null_legend = format("  ", bc="lightgray")+" NULL "
-    OUT.writelines("\n#### Legend\n")
-    OUT.writelines(" "*5 + red_legend + green_legend + cyan_legend + blue_legend + null_legend + "\n\n")
+    yield "\n#### Legend\n" + " "*5 + red_legend + green_legend + cyan_legend + blue_legend + null_legend + "\n\n"
     
     ### Calculate AUC
-    if dot:
-        OUT.writelines("#### AUC\n")
+    if dot and show_auc:
+        yield "#### AUC\n"
         for head, shape_list in zip(shape_title_list, shape_list_list):
             roc = General.calc_shape_structure_ROC(dot, shape_list, start=0.0, step=0.01, stop=1.0)
             auc = round(General.calc_AUC(roc), 3)
-            OUT.writelines("     "+head+"\t"+str(auc)+"\n")
-        OUT.writelines("\n")
+            yield "     "+head+"\t"+str(auc)+"\n"
+        yield "\n"
     
     ### Estimate min head length
     max_title_len = max([len(title) for title in shape_title_list])
     max_seqnum_len = 2*len(str(len(sequence)))+1
     min_head_len = max(max_seqnum_len, max_title_len) + 2
     
+    ### Color classes are computed once for each track
+    class_list = [ shape_color_class(shape_list, colorcutoff) for shape_list in shape_list_list ]
+    
     ### Print sequence, structure and shape
     i = 0
     while i<len(sequence):
         end = min(i+linelen, len(sequence))
         head = "%s-%s" % (i+1, end)
-        head += " "*(min_head_len-len(head))
-        OUT.writelines(head+sequence[i:end]+"\n")
+        block = [ head+" "*(min_head_len-len(head))+sequence[i:end]+"\n" ]
         if dot:
-            OUT.writelines(" "*min_head_len+dot[i:end]+"\n")
-        for head, shape_list in zip(shape_title_list, shape_list_list):
-            head += " "*(min_head_len-len(head))
-            OUT.writelines(head+color_SHAPE(shape_list[i:end], cutoff=colorcutoff)+"\n")
-        OUT.writelines("\n")
+            block.append(" "*min_head_len+dot[i:end]+"\n")
+        for head, classes in zip(shape_title_list, class_list):
+            block.append(head+" "*(min_head_len-len(head))+__color_class_blocks(classes[i:end])+"\n")
+        block.append("\n")
+        yield "".join(block)
         i += linelen
 
+def browse_shape(sequence, shape_list_list, linelen=200, dot="", shape_title_list=[], colorcutoff=[0.3, 0.5, 0.7], OUT=sys.stdout, show_auc=True):
+    """
+    sequence                -- Sequence
+    shape_list_list         -- [ [shape_list1, shape_list2, shape_list3, ...], [], []... ]
+    linelen                 -- Number of bases for each line
+    dot                     -- Dot structure
+    shape_title_list        -- Title for each shape list
+    colorcutoff             -- Cutoff for colorblock
+    OUT                     -- Output stream
+    show_auc                -- Calculate and show the AUC of each shape list when dot is provided
+    
+    Print/compare shape scores in screen
+    """
+    for block in iter_browse_shape(sequence, shape_list_list, linelen=linelen, dot=dot, 
+        shape_title_list=shape_title_list, colorcutoff=colorcutoff, show_auc=show_auc):
+        OUT.write(block)
+
 def browse_multi_shape(sequence_list, shape_list_list, linelen=200, dot="", shape_title_list=[], OUT=sys.stdout):
     """
     sequence_list           -- Sequence list
@@ -250,11 +278,14 @@ def browse_multi_shape(sequence_list, shape_list_list, linelen=200, dot="", shap
     if dot:
         assert len(sequence_list[0]) == len(dot)
     
+    import Alignment
+    
     aligned_seq_list = Structure.multi_alignment(sequence_list, clean=True, verbose=False)
-    aligned_shape_list = [ Structure.shape_to_alignSHAPE(raw_shape,aligned_seq) for raw_shape,aligned_seq in zip(shape_list_list, aligned_seq_list) ]
+    projections = [ Alignment.AlignProjection(aligned_seq) for aligned_seq in aligned_seq_list ]
+    aligned_shape_list = [ projection.to_align(list(raw_shape), fill='NULL') for raw_shape,projection in zip(shape_list_list, projections) ]
     aligned_dot = ""
     if dot:
-        aligned_dot = Structure.dot_to_alignDot(dot, aligned_seq_list[0])
+        aligned_dot = projections[0].to_align(dot, fill='-')
     
     ### Estimate min head length
     max_title_len = max([len(title) for title in shape_title_list])
@@ -276,9 +307,8 @@ def browse_multi_shape(sequence_list, shape_list_list, linelen=200, dot="", shap
     while i<aligned_seq_len:
         end = min(i+linelen, aligned_seq_len)
         index = 0
-        for title,aligned_seq,aligned_shape in zip(shape_title_list,aligned_seq_list,aligned_shape_list):
-            raw_start = len(aligned_seq[:i].replace("-",""))+1
-            raw_end = len(aligned_seq[:end].replace("-",""))
+        for title,aligned_seq,aligned_shape,projection in zip(shape_title_list,aligned_seq_list,aligned_shape_list,projections):
+            raw_start, raw_end = projection.raw_range(i, end)
             head = "%s-%s" % (raw_start, raw_end)
             head += " "*(min_head_len-len(head))
             OUT.writelines(head+aligned_seq[i:end]+"\n")
@@ -14,6 +14,12 @@ covary_bps = Covariation.call_covariation(query_seq, query_dot, "MERS_5UTR", seq
                     nohmm=True, cmsearchE=1, cpu=20, use_LSF=True, 
                     LSF_parameters={}, progress=True, clean=False)
 
+########### Example -- Resume a crashed run: finished steps are skipped
+
+covary_bps = Covariation.call_covariation(query_seq, query_dot, "MERS_5UTR", seqdbFn, workdir="~/call_covariation_1234567")
+pipeline = Covariation.PIPELINE("~/call_covariation_1234567")
+pipeline.report()
+
 """
 
 import General, Colors, os, sys
@@ -56,15 +62,15 @@ def cmbuild(inStoFn, outCMFn, verbose=False, showCMD=True):
     import shutil
     
     cmbuild_exe = General.require_exec("cmbuild", exception=True)
-    cmd = f"{cmbuild_exe} -F "
+    cmd = [ cmbuild_exe, "-F" ]
     if not verbose:
-        cmd += '-o /dev/null '
-    cmd += f"{outCMFn} {inStoFn}"
+        cmd += [ '-o', '/dev/null' ]
+    cmd += [ outCMFn, inStoFn ]
     
     if showCMD:
         import Colors
-        print( Colors.f(cmd, fc='yellow') )
-    os.system(cmd)
+        print( Colors.f(General.format_command(cmd), fc='yellow') )
+    General.run_tool(cmd, verbose=verbose)
 
 def cmcalibrate(CMFn, cpu=0, verbose=True, showCMD=True, use_LSF=False, LSF_parameters={}):
     """
@@ -74,7 +80,8 @@ def cmcalibrate(CMFn, cpu=0, verbose=True, showCMD=True, use_LSF=False, LSF_para
     verbose             -- Show command and log information
     showCMD             -- Print the command
     use_LSF             -- Submit to LSF if True
-    LSF_parameters      -- { 'queue': 'Z-ZQF', 'cpu': 20, 'job_name': 'cmcalibrate', 'logFn': '/dev/null', 'errFn': '/dev/null' }
+    LSF_parameters      -- { 'queue': 'Z-ZQF', 'cpu': 20, 'job_name': 'cmcalibrate', 'logFn': '/dev/null', 'errFn': '/dev/null', 'backend': 'lsf' }
+                           backend can be lsf or local, see Cluster.set_default_backend
     
     Return:
         Return job object if use_LSF==True
@@ -86,36 +93,36 @@ def cmcalibrate(CMFn, cpu=0, verbose=True, showCMD=True, use_LSF=False, LSF_para
     import shutil
     
     cmcalibrate_exe = General.require_exec("cmcalibrate", exception=True)
-    cmd = f"{cmcalibrate_exe} "
+    cmd = [ cmcalibrate_exe ]
     if cpu>0:
-        cmd += f"--cpu {cpu} "
+        cmd += [ "--cpu", cpu ]
     
-    cmd += CMFn
-    if not verbose:
-        cmd += " > /dev/null"
+    cmd += [ CMFn ]
     if showCMD:
         import Colors
-        print( Colors.f(cmd, fc='yellow') )
+        print( Colors.f(General.format_command(cmd), fc='yellow') )
     
     if use_LSF:
         import Cluster
-        job = Cluster.new_job(command=cmd, 
+        job = Cluster.new_job(command=General.format_command(cmd) + ("" if verbose else " > /dev/null"), 
             queue=LSF_parameters.get('queue', 'Z-ZQF'), 
             cpu=LSF_parameters.get('cpu', 20), 
             job_name=LSF_parameters.get('job_name', 'cmcalibrate'), 
             logFn=LSF_parameters.get('logFn', '/dev/null'),
-            errFn=LSF_parameters.get('errFn', '/dev/null'))
+            errFn=LSF_parameters.get('errFn', '/dev/null'),
+            backend=LSF_parameters.get('backend', None))
         job.get_submit_command()
         job.submit()
         return job
     else:
-        os.system(cmd)
+        General.run_tool(cmd, verbose=verbose)
 
 def cmsearch(CMFile, seqdbFn, outTXT, outSto, 
     cpu=0, toponly=False, nohmm=False, 
     nohmmonly=False, outputE=20, acceptE=1, 
     cut_ga=False, rfam=False, glocal=False,
-    verbose=True, showCMD=True, use_LSF=False, LSF_parameters={}):
+    verbose=True, showCMD=True, use_LSF=False, LSF_parameters={}, 
+    outTblout=None, Z=None):
     """
     Search CM model from sequence database
     CMFile              -- CM file
@@ -134,7 +141,10 @@ def cmsearch(CMFile, seqdbFn, outTXT, outSto,
     verbose             -- Show command and log information
     showCMD             -- Print the command
     use_LSF             -- Submit to LSF if True
-    LSF_parameters      -- { 'queue': 'Z-ZQF', 'cpu': 20, 'job_name': 'cmsearch', 'logFn': '/dev/null', 'errFn': '/dev/null' }
+    LSF_parameters      -- { 'queue': 'Z-ZQF', 'cpu': 20, 'job_name': 'cmsearch', 'logFn': '/dev/null', 'errFn': '/dev/null', 'backend': 'lsf' }
+                           backend can be lsf or local, see Cluster.set_default_backend
+    outTblout           -- Output tabular file of hits (--tblout)
+    Z                   -- Search space size in Mb for E-value calculations (-Z)
     
     Require: cmsearch
     """
@@ -142,42 +152,422 @@ def cmsearch(CMFile, seqdbFn, outTXT, outSto,
     import shutil
     
     cmsearch_exe = General.require_exec("cmsearch", exception=True)
-    cmd = f"{cmsearch_exe} --notextw "
+    cmd = [ cmsearch_exe, "--notextw" ]
     if cpu>0:
-        cmd += f"--cpu {cpu} "
+        cmd += [ "--cpu", cpu ]
     if toponly:
-        cmd += "--toponly "
+        cmd += [ "--toponly" ]
     if nohmm:
-        cmd += "--nohmm "
+        cmd += [ "--nohmm" ]
     if nohmmonly:
-        cmd += "--nohmmonly "
+        cmd += [ "--nohmmonly" ]
     if cut_ga:
-        cmd += "--cut_ga "
+        cmd += [ "--cut_ga" ]
     if rfam:
-        cmd += "--rfam "
+        cmd += [ "--rfam" ]
     if glocal:
-        cmd += "-g "
-    cmd += f"-E {outputE} --incE {acceptE} -o {outTXT} -A {outSto} {CMFile} {seqdbFn}"
+        cmd += [ "-g" ]
+    if outTblout:
+        cmd += [ "--tblout", outTblout ]
+    if Z:
+        cmd += [ "-Z", Z ]
+    cmd += [ "-E", outputE, "--incE", acceptE, "-o", outTXT, "-A", outSto, CMFile, seqdbFn ]
     
-    if not verbose:
-        cmd += " > /dev/null"
     if showCMD:
         import Colors
-        print( Colors.f(cmd, fc='yellow') )
+        print( Colors.f(General.format_command(cmd), fc='yellow') )
     
     if use_LSF:
         import Cluster
-        job = Cluster.new_job(command=cmd, 
+        job = Cluster.new_job(command=General.format_command(cmd) + ("" if verbose else " > /dev/null"), 
             queue=LSF_parameters.get('queue', 'Z-ZQF'), 
             cpu=LSF_parameters.get('cpu', 20), 
             job_name=LSF_parameters.get('job_name', 'cmsearch'), 
             logFn=LSF_parameters.get('logFn', '/dev/null'),
-            errFn=LSF_parameters.get('errFn', '/dev/null'))
+            errFn=LSF_parameters.get('errFn', '/dev/null'),
+            backend=LSF_parameters.get('backend', None))
         #print(job.get_submit_command())
         job.submit()
         return job
     else:
-        os.system(cmd)
+        General.run_tool(cmd, verbose=verbose)
+
+def default_shard_store():
+    """
+    Return the default directory of sequence database shards: $IPYRSSA_SHARD_STORE or ~/.IPyRSSA/seqdb_shards
+    """
+    return os.environ.get('IPYRSSA_SHARD_STORE', os.path.join(os.environ['HOME'], '.IPyRSSA', 'seqdb_shards'))
+
+def split_fasta_shards(seqdbFn, nshard, shard_store=None):
+    """
+    Split a fasta file into shards with balanced residue counts. Longest sequences are 
+    assigned first to the shard with the fewest residues. The shards are cached in shard_store 
+    and keyed by (path, size, mtime, nshard), so they are reused by later queries.
+    
+    seqdbFn             -- Fasta file of sequence database
+    nshard              -- Number of shards
+    shard_store         -- Directory to save the shards, default is default_shard_store()
+    
+    Return { 'shards': [shardFn1, shardFn2, ...], 'residues': [n1, n2, ...], 'total_residues': N }
+    """
+    import hashlib, fcntl, json, heapq, shutil, tempfile
+    
+    if shard_store is None:
+        shard_store = default_shard_store()
+    shard_store = os.path.abspath(os.path.expanduser(shard_store))
+    if not os.path.exists(shard_store):
+        os.makedirs(shard_store, exist_ok=True)
+    
+    seqdbFn = os.path.abspath(seqdbFn)
+    stat = os.stat(seqdbFn)
+    key = f"{seqdbFn}\n{stat.st_size}\n{stat.st_mtime_ns}\n{nshard}"
+    key = hashlib.sha1(key.encode()).hexdigest()
+    shard_dir = os.path.join(shard_store, key)
+    manifestFn = os.path.join(shard_dir, "manifest.json")
+    
+    with open(os.path.join(shard_store, key+".lock"), 'w') as LOCK:
+        fcntl.flock(LOCK, fcntl.LOCK_EX)
+        if os.path.exists(manifestFn):
+            return json.load(open(manifestFn))
+        
+        ### Pass 1: residues of each sequence
+        seq_len = []
+        for line in open(seqdbFn, 'rb'):
+            if line.startswith(b'>'):
+                seq_len.append(0)
+            elif seq_len:
+                seq_len[-1] += len(line.strip())
+        
+        heap = [ (0, i) for i in range(nshard) ]
+        seq2shard = [0] * len(seq_len)
+        for idx in sorted(range(len(seq_len)), key=lambda idx: seq_len[idx], reverse=True):
+            load, shard = heapq.heappop(heap)
+            seq2shard[idx] = shard
+            heapq.heappush(heap, (load+seq_len[idx], shard))
+        residues = [0] * nshard
+        for idx, shard in enumerate(seq2shard):
+            residues[shard] += seq_len[idx]
+        
+        ### Pass 2: write the sequences to shards
+        tmpdir = tempfile.mkdtemp(prefix=key+"_", dir=shard_store)
+        try:
+            shards = [ os.path.join(shard_dir, f"shard_{i}.fa") for i in range(nshard) ]
+            handles = [ open(os.path.join(tmpdir, f"shard_{i}.fa"), 'wb') for i in range(nshard) ]
+            idx = -1
+            OUT = None
+            for line in open(seqdbFn, 'rb'):
+                if line.startswith(b'>'):
+                    idx += 1
+                    OUT = handles[seq2shard[idx]]
+                if OUT is not None:
+                    OUT.write(line)
+            for OUT in handles:
+                OUT.close()
+            
+            manifest = { 'shards': shards, 'residues': residues, 'total_residues': sum(residues) }
+            json.dump(manifest, open(os.path.join(tmpdir, "manifest.json"), 'w'), indent=1)
+            if os.path.exists(shard_dir):
+                shutil.rmtree(shard_dir)
+            os.rename(tmpdir, shard_dir)
+        except:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+    
+    return manifest
+
+def merge_cm_stockholm(stoFnList, outSto):
+    """
+    Merge Stockholm alignments produced by the same CM (cmsearch -A or cmalign). 
+    The consensus columns (#=GC RF) are matched and the insert columns between 
+    them are padded with gaps to the widest insert.
+    
+    stoFnList           -- A list of Stockholm files
+    outSto              -- Output Stockholm file
+    """
+    alignments = []
+    for stoFn in stoFnList:
+        if os.path.exists(stoFn) and os.path.getsize(stoFn) > 0:
+            alignments += [ (id2seq, annot) for id2seq, refStr, refAnnot, annot in General.iter_stockholm(stoFn, annotation=True) if id2seq ]
+    
+    OUT = open(outSto, 'w')
+    print("# STOCKHOLM 1.0\n", file=OUT)
+    if not alignments:
+        print("//", file=OUT)
+        OUT.close()
+        return
+    
+    ### Split every alignment into [insert, match, insert, match, ..., insert] column blocks
+    blocks_list = []
+    for id2seq, annot in alignments:
+        RF = annot['GC'].get('RF')
+        if RF is None:
+            raise RuntimeError("Error: #=GC RF is required to merge alignments")
+        blocks = [[]]
+        for col, code in enumerate(RF):
+            if code in '.-~':
+                blocks[-1].append(col)
+            else:
+                blocks.append(col)
+                blocks.append([])
+        blocks_list.append(blocks)
+    
+    if len(set([ len(blocks) for blocks in blocks_list ])) != 1:
+        raise RuntimeError("Error: alignments are not produced by the same CM")
+    insert_width = [ max([ len(blocks[i]) for blocks in blocks_list ]) for i in range(0, len(blocks_list[0]), 2) ]
+    
+    def project(row, blocks):
+        new_row = []
+        for i, block in enumerate(blocks):
+            if i % 2 == 0:
+                new_row.append("".join([ row[col] for col in block ]).ljust(insert_width[i//2], '.'))
+            else:
+                new_row.append(row[block])
+        return "".join(new_row)
+    
+    seq_lines, gr_lines, gc_rows = [], [], {}
+    for (id2seq, annot), blocks in zip(alignments, blocks_list):
+        for name, row in id2seq.items():
+            seq_lines.append( (name, project(row, blocks)) )
+        for (name, label), row in annot['GR'].items():
+            gr_lines.append( (f"#=GR {name} {label}", project(row, blocks)) )
+        if not gc_rows:
+            gc_rows = { label: project(row, blocks) for label, row in annot['GC'].items() }
+    
+    for line in alignments[0][1]['GF']:
+        print(line, file=OUT)
+    for id2seq, annot in alignments:
+        for line in annot['GS']:
+            print(line, file=OUT)
+    gc_lines = [ (f"#=GC {label}", row) for label, row in gc_rows.items() ]
+    width = max([ len(head) for head, row in seq_lines + gr_lines + gc_lines ]) + 1
+    for head, row in seq_lines + gr_lines + gc_lines:
+        print(head.ljust(width), row, sep="", file=OUT)
+    print("//", file=OUT)
+    OUT.close()
+
+def merge_tblout(tbloutFnList, outTblout):
+    """
+    Merge cmsearch --tblout files, hits are sorted by E-value
+    
+    tbloutFnList        -- A list of tblout files
+    outTblout           -- Output tblout file
+    """
+    header, hits = None, []
+    for tbloutFn in tbloutFnList:
+        if not os.path.exists(tbloutFn):
+            continue
+        lines = open(tbloutFn).readlines()
+        if header is None:
+            header = [ line for line in lines[:2] if line.startswith('#') ]
+        hits += [ (float(line.split()[15]), line) for line in lines if not line.startswith('#') ]
+    hits.sort(key=lambda x: x[0])
+    OUT = open(outTblout, 'w')
+    OUT.writelines(header or [])
+    OUT.writelines([ line for evalue,line in hits ])
+    OUT.close()
+
+def cmsearch_sharded(CMFile, seqdbFn, outTXT, outSto, nshard=10,
+    cpu=0, toponly=False, nohmm=False, 
+    nohmmonly=False, outputE=20, acceptE=1, 
+    cut_ga=False, rfam=False, glocal=False,
+    showCMD=True, use_LSF=False, LSF_parameters={}, 
+    outTblout=None, shard_store=None):
+    """
+    Search CM model from a big sequence database in parallel. The database is split 
+    into nshard shards with balanced residues (cached, see split_fasta_shards), 
+    one cmsearch job is run per shard and the results are merged. E-values are computed 
+    with the full database size (-Z), so the hits are the same as a single cmsearch.
+    
+    CMFile              -- CM file
+    seqdbFn             -- File name of sequence database
+    outTXT              -- Output txt file, the outputs of shards are concatenated
+    outSto              -- Output Stockholm file
+    nshard              -- Number of shards
+    cpu                 -- How many threads to use for each shard
+    use_LSF             -- Submit the jobs to LSF if True, otherwise run them with the local backend
+    LSF_parameters      -- { 'queue': 'Z-ZQF', 'job_name': 'cmsearch', 'logFn': '/dev/null', 'errFn': '/dev/null', 'backend': 'lsf' }
+    outTblout           -- Output tabular file of hits
+    shard_store         -- Directory to save the shards, default is default_shard_store()
+    Other parameters are same as cmsearch
+    
+    Require: cmsearch
+    """
+    import Cluster, tempfile, shutil
+    
+    manifest = split_fasta_shards(seqdbFn, nshard, shard_store=shard_store)
+    Z = manifest['total_residues'] / 1000000
+    if not toponly:
+        Z *= 2
+    
+    job_parameters = dict(LSF_parameters)
+    job_parameters['cpu'] = max(cpu, 1)
+    if not use_LSF:
+        job_parameters['backend'] = 'local'
+    
+    tmpdir = tempfile.mkdtemp(prefix="cmsearch_", dir=os.path.dirname(os.path.abspath(outSto)))
+    jobs, txt_list, sto_list, tbl_list = [], [], [], []
+    for i, shardFn in enumerate(manifest['shards']):
+        if manifest['residues'][i] == 0:
+            continue
+        txt_list.append( os.path.join(tmpdir, f"shard_{i}.txt") )
+        sto_list.append( os.path.join(tmpdir, f"shard_{i}.sto") )
+        tbl_list.append( os.path.join(tmpdir, f"shard_{i}.tblout") )
+        job_parameters['job_name'] = LSF_parameters.get('job_name', 'cmsearch') + f"_shard_{i}"
+        job = cmsearch(CMFile, shardFn, txt_list[-1], sto_list[-1], 
+            cpu=cpu, toponly=toponly, nohmm=nohmm, 
+            nohmmonly=nohmmonly, outputE=outputE, acceptE=acceptE, 
+            cut_ga=cut_ga, rfam=rfam, glocal=glocal, 
+            verbose=False, showCMD=showCMD, use_LSF=True, LSF_parameters=job_parameters, 
+            outTblout=tbl_list[-1], Z=Z)
+        jobs.append(job)
+    
+    Cluster.wait_jobs(jobs)
+    failed = [ job.job_name for job in jobs if job.job_status() == 'EXIT' ]
+    if failed:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise RuntimeError(f"Error: cmsearch failed in {failed}")
+    
+    with open(outTXT, 'w') as OUT:
+        for txtFn in txt_list:
+            if os.path.exists(txtFn):
+                OUT.writelines(open(txtFn))
+    merge_cm_stockholm(sto_list, outSto)
+    if outTblout:
+        merge_tblout(tbl_list, outTblout)
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+def cmalign(CMFile, seqFn, outSto, cpu=0, verbose=False, showCMD=True):
+    """
+    Align sequences to CM model
+    CMFile              -- CM file
+    seqFn               -- Fasta file of sequences to align
+    outSto              -- Output Stockholm file
+    cpu                 -- How many threads to use
+    verbose             -- Show command and log information
+    showCMD             -- Print the command
+    
+    Require: cmalign
+    """
+    import General
+    
+    cmalign_exe = General.require_exec("cmalign", exception=True)
+    cmd = [ cmalign_exe ]
+    if cpu>0:
+        cmd += [ "--cpu", cpu ]
+    cmd += [ "-o", outSto, CMFile, seqFn ]
+    
+    if showCMD:
+        import Colors
+        print( Colors.f(General.format_command(cmd), fc='yellow') )
+    General.run_tool(cmd, verbose=verbose)
+
+def infernal_version():
+    """
+    Return the version of Infernal in PATH, such as 1.1.2
+    
+    Require: cmcalibrate
+    """
+    import General
+    
+    General.require_exec("cmcalibrate", exception=True)
+    return General.tool_version("cmcalibrate")
+
+def is_calibrated_cm(CMFn):
+    """
+    CMFn                -- CM file
+    
+    Return True if every model in the file has the E-value parameters written by cmcalibrate
+    """
+    if not os.path.exists(CMFn):
+        return False
+    model_tags = []
+    for line in open(CMFn):
+        if line.startswith('INFERNAL1'):
+            model_tags.append(set())
+        elif line[:5] in ('ECMLC', 'ECMGC', 'ECMLI', 'ECMGI') and model_tags:
+            model_tags[-1].add(line[:5])
+    return len(model_tags) > 0 and all([ len(tags) == 4 for tags in model_tags ])
+
+def default_cm_store():
+    """
+    Return the default directory of calibrated CM models: $IPYRSSA_CM_STORE or ~/.IPyRSSA/cm_store
+    """
+    return os.environ.get('IPYRSSA_CM_STORE', os.path.join(os.environ['HOME'], '.IPyRSSA', 'cm_store'))
+
+def get_calibrated_cm(query_seq, query_dot, model_name, cm_store=None, cpu=20, use_LSF=False, LSF_parameters={}, progress=True):
+    """
+    Return a calibrated CM file built from a single sequence and structure.
+    The models are kept in cm_store and keyed by the sha1 of (sequence, structure, model name, Infernal version),
+    so a model is calibrated only once. Concurrent callers of the same model wait for each other.
+    
+    query_seq           -- Query sequence
+    query_dot           -- Query dot-bracket structure
+    model_name          -- CM model name
+    cm_store            -- Directory of calibrated models, default is default_cm_store()
+    cpu                 -- Threads for cmcalibrate
+    use_LSF             -- Submit cmcalibrate to LSF if True
+    LSF_parameters      -- See cmcalibrate
+    progress            -- Print the progress
+    
+    Return the path of calibrated CM file
+    
+    Require: cmbuild, cmcalibrate
+    """
+    import hashlib, fcntl, shutil, tempfile
+    
+    if cm_store is None:
+        cm_store = default_cm_store()
+    cm_store = os.path.abspath(os.path.expanduser(cm_store))
+    if not os.path.exists(cm_store):
+        os.makedirs(cm_store, exist_ok=True)
+    
+    key = "\n".join([query_seq, query_dot, model_name, infernal_version()])
+    key = hashlib.sha1(key.encode()).hexdigest()
+    cm_file = os.path.join(cm_store, key+".cm")
+    
+    with open(os.path.join(cm_store, key+".lock"), 'w') as LOCK:
+        fcntl.flock(LOCK, fcntl.LOCK_EX)
+        if is_calibrated_cm(cm_file):
+            if progress:
+                print(Colors.f(f"Use calibrated CM from store: {cm_file}", fc='cyan'))
+            return cm_file
+        elif os.path.exists(cm_file):
+            if progress:
+                print(Colors.f(f"Rebuild the uncalibrated CM in store: {cm_file}", fc='yellow'))
+            os.remove(cm_file)
+        
+        tmpdir = tempfile.mkdtemp(prefix=key+"_", dir=cm_store)
+        try:
+            sto_file = os.path.join(tmpdir, "input.sto")
+            tmp_cm_file = os.path.join(tmpdir, "model.cm")
+            dot2sto({'input': [query_seq, query_dot]}, model_name, sto_file, mode='w')
+            cmbuild(sto_file, tmp_cm_file, verbose=False, showCMD=progress)
+            job = cmcalibrate(tmp_cm_file, cpu=cpu, verbose=False, showCMD=progress, use_LSF=use_LSF, LSF_parameters=LSF_parameters)
+            if job:
+                job.wait()
+                if job.job_status() == 'EXIT':
+                    raise RuntimeError(f"Error: cmcalibrate job of {model_name} failed, see the job log")
+            # cmbuild has written the file already, never put an uncalibrated model into the store
+            if not is_calibrated_cm(tmp_cm_file):
+                raise RuntimeError(f"Error: failed to calibrate CM for {model_name}")
+            os.replace(tmp_cm_file, cm_file)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    
+    return cm_file
+
+def __write_unaligned_hits(query_seq, hitStoFn, outFaFn):
+    """
+    Write the query sequence (named input) and the sequences of cmsearch hits to fasta file
+    """
+    import General
+    
+    Fasta = { 'input': query_seq }
+    if os.path.exists(hitStoFn) and os.path.getsize(hitStoFn) > 0:
+        for id2seq, refStr, refAnnot in General.iter_stockholm(hitStoFn):
+            for seq_id, aligned_seq in id2seq.items():
+                Fasta[seq_id] = aligned_seq.replace('-','').replace('.','').upper()
+    General.write_fasta(Fasta, outFaFn)
 
 def R_scape(StoFn, outDir, outname=None, maxIdentity=0.985, minIndentity=0.500, 
     F=0.5, gapthresh=0.5, two_set_test=True, fold=False, acceptE=0.05, nseqmin=5,
@@ -205,23 +595,21 @@ def R_scape(StoFn, outDir, outname=None, maxIdentity=0.985, minIndentity=0.500,
     R_scape_exe = General.require_exec("R-scape", exception=True)
     if not os.path.exists(outDir):
         os.mkdir(outDir)
-    cmd = f"{R_scape_exe} --outmsa --r2rall --outtree --roc --voutput --outnull --consensus "
-    cmd += f"--outdir {outDir} -I {maxIdentity} -i {minIndentity} -F {F} --gapthresh {gapthresh} -E {acceptE} --nseqmin {nseqmin} "
+    cmd = [ R_scape_exe, "--outmsa", "--r2rall", "--outtree", "--roc", "--voutput", "--outnull", "--consensus" ]
+    cmd += [ "--outdir", outDir, "-I", maxIdentity, "-i", minIndentity, "-F", F, "--gapthresh", gapthresh, "-E", acceptE, "--nseqmin", nseqmin ]
     if outname:
-        cmd += f"--outname {outname} "
+        cmd += [ "--outname", outname ]
     if two_set_test:
-        cmd += "-s "
+        cmd += [ "-s" ]
     if fold:
-        cmd += "--fold "
-    cmd += f" {StoFn} "
+        cmd += [ "--fold" ]
+    cmd += [ StoFn ]
     
-    if not verbose:
-        cmd += "> /dev/null"
     if showCMD:
         import Colors
-        print(Colors.f(cmd, fc='yellow'))
+        print(Colors.f(General.format_command(cmd), fc='yellow'))
     
-    os.system(cmd)
+    General.run_tool(cmd, verbose=verbose)
 
 def read_RScape_result(Rscape_cov_fn):
     """
@@ -247,7 +635,7 @@ def get_alignedPos2cleanPos_dict(aligned_seq):
     alignedPos2cleanPos = {}
     i, j = 0, 0
     while i<len(aligned_seq):
-        if aligned_seq[i]=='-':
+        if aligned_seq[i] in '-.':
             alignedPos2cleanPos[i+1] = None
         else:
             alignedPos2cleanPos[i+1] = j+1
@@ -255,9 +643,162 @@ def get_alignedPos2cleanPos_dict(aligned_seq):
         i += 1
     return alignedPos2cleanPos
 
+### File hashes shared by all PIPELINE objects in this process: { fileName: [[size, mtime], sha1] }
+_FILE_HASH_CACHE = {}
+
+class PIPELINE:
+    def __init__(self, workdir, progress=True, force=False):
+        """
+        workdir             -- Working directory, the step records are saved in workdir/pipeline.json
+        progress            -- Print the progress
+        force               -- Rerun all steps even if they have been completed
+        
+        Run a list of steps in a working directory. Each step declares input files, 
+        output files and parameters; a step is skipped when its last run finished 
+        with the same input hashes and parameters and its outputs are unchanged.
+        File hashes are cached by (size, mtime) so big inputs, such as a shared
+        sequence database, are read only once per process.
+        """
+        import json
+        
+        self.workdir = os.path.abspath(os.path.expanduser(workdir))
+        self.progress = progress
+        self.force = force
+        self.recordFn = os.path.join(self.workdir, "pipeline.json")
+        if not os.path.exists(self.workdir):
+            os.makedirs(self.workdir)
+        if os.path.exists(self.recordFn):
+            self.record = json.load(open(self.recordFn))
+        else:
+            self.record = { 'steps': {}, 'hash_cache': {} }
+    
+    def __save(self):
+        import json
+        tmpFn = self.recordFn + ".tmp"
+        json.dump(self.record, open(tmpFn, 'w'), indent=1)
+        os.replace(tmpFn, self.recordFn)
+    
+    def file_hash(self, fileName):
+        """
+        Return the sha1 of a file, or of all files in a directory. None if not exists
+        """
+        import hashlib
+        
+        fileName = os.path.abspath(fileName)
+        if os.path.isdir(fileName):
+            sha1 = hashlib.sha1()
+            for root, dirs, files in os.walk(fileName):
+                dirs.sort()
+                for name in sorted(files):
+                    full_name = os.path.join(root, name)
+                    sha1.update(os.path.relpath(full_name, fileName).encode())
+                    sha1.update(self.file_hash(full_name).encode())
+            return sha1.hexdigest()
+        if not os.path.exists(fileName):
+            return None
+        
+        stat = os.stat(fileName)
+        stamp = [ stat.st_size, stat.st_mtime_ns ]
+        cached = self.record['hash_cache'].get(fileName) or _FILE_HASH_CACHE.get(fileName)
+        if cached and cached[0] == stamp:
+            self.record['hash_cache'][fileName] = cached
+            return cached[1]
+        sha1 = hashlib.sha1()
+        with open(fileName, 'rb') as IN:
+            for chunk in iter(lambda: IN.read(1<<20), b''):
+                sha1.update(chunk)
+        self.record['hash_cache'][fileName] = _FILE_HASH_CACHE[fileName] = [ stamp, sha1.hexdigest() ]
+        return sha1.hexdigest()
+    
+    def __hash_files(self, files):
+        return { fileName: self.file_hash(fileName) for fileName in files }
+    
+    def is_complete(self, name, inputs=[], outputs=[], params={}):
+        """
+        Return True if the step has been completed with the same inputs and parameters
+        """
+        step = self.record['steps'].get(name)
+        if self.force or not step:
+            return False
+        if step['params'] != params or step['inputs'] != self.__hash_files(inputs):
+            return False
+        return step['outputs'] == self.__hash_files(outputs)
+    
+    def run_step(self, name, func, inputs=[], outputs=[], params={}, tools=[]):
+        """
+        name                -- Step name
+        func                -- A function without parameter to run the step. If it returns 
+                               a job handle (Cluster), the job will be waited
+        inputs              -- Input files/directories of the step
+        outputs             -- Output files/directories of the step
+        params              -- A dict of parameters, the step is rerun when they change. Should be JSON-serializable
+        tools               -- Names of tools the step runs outside General.run_tool, such as LSF jobs.
+                               Tools called by General.run_tool during the step are recorded automatically
+        
+        Return True if the step is run, False if skipped
+        """
+        import time, resource
+        
+        params = dict(params)
+        if self.is_complete(name, inputs, outputs, params):
+            if self.progress:
+                print(Colors.f(f"{name} (completed, skip)", fc='cyan'))
+            return False
+        
+        if self.progress:
+            print(Colors.f(name, fc='green'))
+        
+        input_hash = self.__hash_files(inputs)
+        self.record['steps'][name] = None
+        self.__save()
+        
+        start_wall = time.time()
+        start_cpu = time.process_time()
+        start_child = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with General.tool_profile(OUT=None) as profile:
+            job = func()
+            if hasattr(job, 'wait'):
+                job.wait()
+                if hasattr(job, 'job_status') and job.job_status() == 'EXIT':
+                    raise RuntimeError(f"Error: step {name} failed, see the job log")
+        end_child = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall_time = time.time() - start_wall
+        cpu_time = time.process_time() - start_cpu + \
+            (end_child.ru_utime - start_child.ru_utime) + (end_child.ru_stime - start_child.ru_stime)
+        
+        missing = [ fileName for fileName in outputs if not os.path.exists(fileName) ]
+        if missing:
+            raise RuntimeError(f"Error: step {name} did not produce {missing}")
+        
+        used_tools = sorted(set(tools) | set([ record['tool'] for record in profile.records ]))
+        self.record['steps'][name] = {
+            'inputs': input_hash,
+            'outputs': self.__hash_files(outputs),
+            'params': params,
+            'tools': { tool: General.tool_version(tool) for tool in used_tools },
+            'wall_time': round(wall_time, 3),
+            'cpu_time': round(cpu_time, 3)
+        }
+        self.__save()
+        return True
+    
+    def step_times(self):
+        """
+        Return { step_name: (wall_time, cpu_time), ... } of completed steps
+        cpu_time includes local child processes only, not jobs run on LSF nodes
+        """
+        return { name: (step['wall_time'], step['cpu_time']) for name,step in self.record['steps'].items() if step }
+    
+    def report(self, OUT=sys.stdout):
+        """
+        Print wall time and CPU time of each completed step
+        """
+        for name, (wall_time, cpu_time) in self.step_times().items():
+            print(f"{name:40s}\twall: {wall_time:10.2f}s\tcpu: {cpu_time:10.2f}s", file=OUT)
+
 def call_covariation(query_seq, query_dot, model_name, seqdbFn, workdir=None,
     nohmm=False, cmsearchE=1, cpu=20, use_LSF=True, 
-    LSF_parameters={}, progress=True, clean=False):
+    LSF_parameters={}, progress=True, clean=False, force=False, cm_store=None, nshard=1):
     """
     Call covariation has two steps: 
         1. Search homology sequence from sequence databse;
@@ -272,9 +813,14 @@ def call_covariation(query_seq, query_dot, model_name, seqdbFn, workdir=None,
     cmsearchE               -- cmsearch E-value
     cpu                     -- Threads for cmcalibrate and cmsearch
     use_LSF                 -- Submit to LSF if True
-    LSF_parameters          -- { 'queue': 'Z-ZQF', 'cpu': 20, 'job_name': 'cmsearch', 'logFn': '/dev/null', 'errFn': '/dev/null' }
+    LSF_parameters          -- { 'queue': 'Z-ZQF', 'cpu': 20, 'job_name': 'cmsearch', 'logFn': '/dev/null', 'errFn': '/dev/null', 'backend': 'lsf' }
+                               set 'backend': 'local' to run the jobs with a local process pool
     progress                -- Print the progress
     clean                   -- Clean the directory after running
+    force                   -- Rerun all steps. By default the steps completed in workdir are skipped,
+                               so a failed run can be resumed by calling again with the same workdir
+    cm_store                -- Directory of calibrated CM models shared by runs, default is default_cm_store()
+    nshard                  -- Split the database into shards and run cmsearch in parallel if nshard>1, see cmsearch_sharded
     
     Return a list of covaring base pairs: 
         [ (left, right), ... ]
@@ -282,64 +828,67 @@ def call_covariation(query_seq, query_dot, model_name, seqdbFn, workdir=None,
     import os, General, Colors, shutil
     
     if workdir is None:
-        randID = random.randint(1000000,9000000)
-        dirname = f"call_covariation_{randID}"
-        workdir = os.path.join(os.environ['HOME'], dirname)
-    if not os.path.exists(workdir):
-        os.mkdir(workdir)
-    
-    new_seqdbFn = os.path.join(workdir, "seqDB.fa")
-    sto_file = os.path.join(workdir, "input.sto")
+        import tempfile
+        workdir = tempfile.mkdtemp(prefix="call_covariation_", dir=os.environ['HOME'])
+    workdir = os.path.abspath(os.path.expanduser(workdir))
+    
+    if progress:
+        print(Colors.f(f"The work directory is: {workdir}", fc='green'))
+    pipeline = PIPELINE(workdir, progress=progress, force=force)
+    
     cm_file = os.path.join(workdir, "model.cm")
+    hits_sto = os.path.join(workdir, "hits.sto")
+    hits_txt = os.path.join(workdir, "output.txt")
+    hits_fa = os.path.join(workdir, "hits.fa")
     output_sto = os.path.join(workdir, "output.sto")
-    output_txt = os.path.join(workdir, "output.txt")
     R_scape_dir = os.path.join(workdir, "R-scape")
     
-    ### Step 0. Prepare combined Fasta file
-    if progress:
-        print(Colors.f(f"The work directory is: {workdir}", fc='green'))
-        print(Colors.f("Step 0. Prepare combined Fasta file", fc='green'))
-    General.write_fasta({'input': query_seq}, new_seqdbFn)
-    os.system(f'cat {seqdbFn} >> {new_seqdbFn}')
+    ### Step 1. Get calibrated CM from the store, build and calibrate it if not found
+    pipeline.run_step("Step 1. Get calibrated CM", 
+        lambda: shutil.copyfile(get_calibrated_cm(query_seq, query_dot, model_name, cm_store=cm_store, 
+            cpu=cpu, use_LSF=use_LSF, LSF_parameters=LSF_parameters, progress=progress), cm_file), 
+        outputs=[cm_file], params={'query_seq':query_seq, 'query_dot':query_dot, 'model_name':model_name}, 
+        tools=['cmcalibrate'] if use_LSF else [])
     
-    ### Step 1. Build stockholm file
-    if progress:
-        print(Colors.f("Step 1. Build stockholm file", fc='green'))
-    dot2sto({'input': [query_seq, query_dot]}, model_name, sto_file, mode='w')
+    ### Step 2. Search with CM, the database is searched in place
+    if nshard > 1:
+        search = lambda: cmsearch_sharded(cm_file, seqdbFn, hits_txt, hits_sto, nshard=nshard, 
+            cpu=cpu, toponly=True, nohmm=nohmm, 
+            nohmmonly=True, outputE=20, acceptE=cmsearchE, 
+            cut_ga=False, rfam=False, glocal=False,
+            showCMD=progress, use_LSF=use_LSF, LSF_parameters=LSF_parameters)
+    else:
+        search = lambda: cmsearch(cm_file, seqdbFn, hits_txt, hits_sto, 
+            cpu=cpu, toponly=True, nohmm=nohmm, 
+            nohmmonly=True, outputE=20, acceptE=cmsearchE, 
+            cut_ga=False, rfam=False, glocal=False,
+            verbose=False, showCMD=progress, use_LSF=use_LSF, LSF_parameters=LSF_parameters)
+    pipeline.run_step("Step 2. Search with CM", search, 
+        inputs=[cm_file, seqdbFn], outputs=[hits_txt, hits_sto], 
+        params={'nohmm':nohmm, 'cmsearchE':cmsearchE}, tools=['cmsearch'])
     
-    ### Step 2. Build cm file from sto file
-    if progress:
-        print(Colors.f("Step 2. Build cm file from sto file", fc='green'))
-    cmbuild(sto_file, cm_file, verbose=False, showCMD=progress)
+    ### Step 3. Align the query and the hits to CM
+    def align_hits():
+        __write_unaligned_hits(query_seq, hits_sto, hits_fa)
+        cmalign(cm_file, hits_fa, output_sto, cpu=cpu, verbose=False, showCMD=progress)
+    pipeline.run_step("Step 3. Align query with hits", align_hits, 
+        inputs=[cm_file, hits_sto], outputs=[output_sto], params={'query_seq':query_seq})
     
-    ### Step 3. Calibrate file
-    if progress:
-        print(Colors.f("Step 3. Calibrate file", fc='green'))
-    job = cmcalibrate(cm_file, cpu=cpu, verbose=False, showCMD=progress, use_LSF=use_LSF, LSF_parameters={})
-    job.wait()
+    #### Step 4. R-scape Runing
+    pipeline.run_step("Step 4. R-scape Runing", 
+        lambda: R_scape(output_sto, R_scape_dir, outname=model_name, maxIdentity=0.985, minIndentity=0.500, 
+            F=0.5, gapthresh=0.5, two_set_test=True, fold=False, acceptE=0.05, nseqmin=5, verbose=False, showCMD=progress), 
+        inputs=[output_sto], outputs=[R_scape_dir], params={'model_name':model_name})
     
-    ### Step 4. Search with CM
-    if progress:
-        print(Colors.f("Step 4. Search with CM", fc='green'))
-    job = cmsearch(cm_file, new_seqdbFn, output_txt, output_sto, 
-        cpu=cpu, toponly=True, nohmm=nohmm, 
-        nohmmonly=True, outputE=20, acceptE=cmsearchE, 
-        cut_ga=False, rfam=False, glocal=False,
-        verbose=False, showCMD=progress, use_LSF=use_LSF, LSF_parameters={})
-    job.wait()
-    
-    #### Step 5. R-scape Runing
     if progress:
-        print(Colors.f("Step 5. R-scape Runing", fc='green'))
-    R_scape(output_sto, R_scape_dir, outname=model_name, maxIdentity=0.985, minIndentity=0.500, 
-        F=0.5, gapthresh=0.5, two_set_test=True, fold=False, acceptE=0.05, nseqmin=5, verbose=False, showCMD=progress)
+        pipeline.report()
     
-    #### Step 6. Read R-scape result
+    #### Step 5. Read R-scape result
     rscape_file = os.path.join(R_scape_dir,f'{model_name}.cov')
     covary_bps = []
     if os.path.exists(rscape_file):
         rscape_list = read_RScape_result(rscape_file)
-        id2seq, refStr, refAnnot = General.load_stockholm(output_sto)[0]
+        id2seq, refStr, refAnnot = next(General.iter_stockholm(output_sto))
         input_id = [ key for key in id2seq if key.startswith('input') ][0]
         posDict = get_alignedPos2cleanPos_dict(id2seq[input_id])
         for bp in rscape_list:
@@ -354,7 +903,7 @@ def call_covariation(query_seq, query_dot, model_name, seqdbFn, workdir=None,
     
     return covary_bps
 
-def calc_MI(left_align_bases, right_align_bases, only_canonical=True, gap_mode='remove'):
+def calc_MI(left_align_bases, right_align_bases, only_canonical=True, gap_mode='remove', weights=None):
     """
     Calculate the mutual information
     left_align_bases            -- ['A', 'C', 'A', 'T', ...]
@@ -363,6 +912,7 @@ def calc_MI(left_align_bases, right_align_bases, only_canonical=True, gap_mode='
     gap_mode                    -- One of remove, penalty, ignore. [remove] mode will remove all base pairs
                                    contains at least one gap; [penalty] mode will give a negative score for base 
                                    pairs with gap; [ignore] mode will treat the gap as a kind of base
+    weights                     -- Weight of each sequence, see calc_sequence_weights. Default: all 1
     
     Return mutual information
     If return -1, it means too little bases
@@ -372,13 +922,15 @@ def calc_MI(left_align_bases, right_align_bases, only_canonical=True, gap_mode='
     
     left_align_bases = list(left_align_bases)
     right_align_bases = list(right_align_bases)
+    weights = [1]*len(left_align_bases) if weights is None else list(weights)
     assert gap_mode in ('remove', 'penalty', 'ignore'), "gap_mode should be one of remove, penalty, ignore" 
-    assert len(left_align_bases) == len(right_align_bases), "Length should be same"
+    assert len(left_align_bases) == len(right_align_bases) == len(weights), "Length should be same"
     i = 0
     while i<len(left_align_bases):
         if gap_mode=="remove" and (left_align_bases[i]=='-' or right_align_bases[i]=='-'):
             del left_align_bases[i]
             del right_align_bases[i]
+            del weights[i]
         else:
             left_align_bases[i] = left_align_bases[i].upper().replace('U','T')
             right_align_bases[i] = right_align_bases[i].upper().replace('U','T')
@@ -387,8 +939,11 @@ def calc_MI(left_align_bases, right_align_bases, only_canonical=True, gap_mode='
     if len(left_align_bases)<5:
         return -1
     
-    f1 = collections.Counter(left_align_bases)
-    f2 = collections.Counter(right_align_bases)
+    f1 = collections.Counter()
+    f2 = collections.Counter()
+    for b1,b2,w in zip(left_align_bases, right_align_bases, weights):
+        f1[b1] += w
+        f2[b2] += w
     
     sum_1 = sum(f1.values())
     sum_2 = sum(f2.values())
@@ -398,8 +953,8 @@ def calc_MI(left_align_bases, right_align_bases, only_canonical=True, gap_mode='
         f2[key] /= sum_2
     
     fcomb = {}
-    for b1,b2 in zip(left_align_bases, right_align_bases):
-        fcomb[b1+b2] = fcomb.get(b1+b2, 0) + 1
+    for b1,b2,w in zip(left_align_bases, right_align_bases, weights):
+        fcomb[b1+b2] = fcomb.get(b1+b2, 0) + w
     
     sum_comb = sum(fcomb.values())
     for key in fcomb:
@@ -420,11 +975,12 @@ def calc_MI(left_align_bases, right_align_bases, only_canonical=True, gap_mode='
     
     return MI
 
-def calc_RNAalignfold(left_align_bases, right_align_bases):
+def calc_RNAalignfold(left_align_bases, right_align_bases, weights=None):
     """
     Calculate the RNAalignfold covariation score
     left_align_bases            -- ['A', 'C', 'A', 'T', ...]
     right_align_bases           -- ['T', 'G', 'T', 'G', ...]
+    weights                     -- Weight of each sequence, see calc_sequence_weights. Default: all 1
     
     Return the RNAalignfold covariation score
     If return -1, it means too little bases
@@ -439,6 +995,8 @@ def calc_RNAalignfold(left_align_bases, right_align_bases):
     len1, len2 = len(left_align_bases), len(right_align_bases)
     assert len(left_align_bases) == len(right_align_bases), f"{len1}, {len2} Length should be same"
     Len = len(left_align_bases)
+    weights = [1]*Len if weights is None else list(weights)
+    assert len(weights) == Len, "Length of weights should be same"
     
     i = 0
     while i<len(left_align_bases):
@@ -451,9 +1009,9 @@ def calc_RNAalignfold(left_align_bases, right_align_bases):
     penalty = 0
     for i in range(Len):
         if left_align_bases[i]+right_align_bases[i] not in BPs:
-            penalty += 1
+            penalty += weights[i]
         for j in range(1, Len):
-            tCount += 1
+            tCount += weights[i]*weights[j]
             if left_align_bases[i]+right_align_bases[i] not in BPs or left_align_bases[j]+right_align_bases[j] not in BPs:
                 continue
             cscore = 2
@@ -461,17 +1019,18 @@ def calc_RNAalignfold(left_align_bases, right_align_bases):
                 cscore -= 1
             if right_align_bases[i]==right_align_bases[j]:
                 cscore -= 1
-            tScore += cscore
+            tScore += cscore*weights[i]*weights[j]
     score = tScore / tCount
     #print(penalty/Len)
-    score -= penalty/Len
+    score -= penalty/sum(weights)
     return score
 
-def calc_RNAalignfold_stack(columns, i, j, min_alignment=5):
+def calc_RNAalignfold_stack(columns, i, j, min_alignment=5, weights=None):
     """
     columns             -- [['A','T','C',...], ['A','T','C',...], ...]. Each list contains bases in alignment column
     i,j                 -- The columns to calculate the score
     min_alignment       -- Minimun alignment required
+    weights             -- Weight of each sequence, see calc_sequence_weights. Default: all 1
     
     Return RNAalignfold_stack covariation score
     If the count of alignment less than min_alignment, then return -1
@@ -479,12 +1038,12 @@ def calc_RNAalignfold_stack(columns, i, j, min_alignment=5):
     Len = len(columns)
     if len(columns[0])<min_alignment:
         return -1
-    score = calc_RNAalignfold(columns[i-1], columns[j-1])
+    score = calc_RNAalignfold(columns[i-1], columns[j-1], weights)
     if i==1 or j==Len:
-        score += calc_RNAalignfold(columns[i-1+1], columns[j-1-1])
+        score += calc_RNAalignfold(columns[i-1+1], columns[j-1-1], weights)
         score /= 2
     else:
-        score = 2*score + calc_RNAalignfold(columns[i-1+1], columns[j-1-1]) + calc_RNAalignfold(columns[i-1-1], columns[j-1+1])
+        score = 2*score + calc_RNAalignfold(columns[i-1+1], columns[j-1-1], weights) + calc_RNAalignfold(columns[i-1-1], columns[j-1+1], weights)
         score /= 4
     return score
 
@@ -520,7 +1079,7 @@ def calc_covBP_from_sto(stoFn, querySeq, allpair=False, min_score=0.4):
     Return [ [left, right, score],.... ]
     """
     import Structure
-    id2seq_dict,refStr,refSeq = General.load_stockholm(stoFn)[0]
+    id2seq_dict,refStr,refSeq = next(General.iter_stockholm(stoFn))
     columns = collect_columns([value for key,value in id2seq_dict.items()])
     alignLen = len(refSeq)
     if allpair:
@@ -560,3 +1119,392 @@ def calc_covBP_from_sto(stoFn, querySeq, allpair=False, min_score=0.4):
         else:
             del ovary_bps[i]
     return covary_bps
+
+def encode_alignment(alignment):
+    """
+    Encode the alignment as a integer matrix. A:0, C:1, G:2, T/U:3, gaps (-.~:_) and ambiguous bases (N,R,Y...):4
+    
+    alignment           -- A list of aligned sequences, a dict { id: aligned_seq }, a uint8 matrix 
+                           from General.iter_stockholm(as_array=True), or an int8 matrix returned by this function
+    
+    Return a numpy int8 matrix with shape (sequence number, alignment length)
+    Raise a RuntimeError if the alignment has other symbols
+    """
+    import numpy as np
+    
+    if isinstance(alignment, dict):
+        alignment = list(alignment.values())
+    if isinstance(alignment, np.ndarray) and alignment.dtype == np.int8:
+        if alignment.size and (alignment.min() < 0 or alignment.max() > 4):
+            raise RuntimeError("Error: encoded alignment should only have codes 0-4")
+        return alignment
+    if isinstance(alignment, np.ndarray):
+        raw = np.asarray(alignment, dtype=np.uint8)
+    else:
+        if len(set([ len(aligned_seq) for aligned_seq in alignment ])) != 1:
+            raise RuntimeError("Error: aligned sequences should have same length")
+        try:
+            raw = np.frombuffer("".join(alignment).encode('ascii'), dtype=np.uint8).reshape(len(alignment), -1)
+        except UnicodeEncodeError:
+            raise RuntimeError("Error: aligned sequences should only have ASCII symbols")
+    
+    table = np.full(256, -1, dtype=np.int8)
+    for code, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu', '-.~:_NnRrYyKkMmSsWwBbDdHhVvXx')):
+        for base in bases:
+            table[ord(base)] = code
+    codes = table[raw]
+    if (codes < 0).any():
+        row, col = [ int(idx[0]) for idx in np.nonzero(codes < 0) ]
+        raise RuntimeError(f"Error: unexpected symbol {chr(raw[row, col])!r} in aligned sequence {row+1}, column {col+1}")
+    return codes
+
+def __pair_count_matrix(codes, weights=None):
+    """
+    Return the joint base counts of all column pairs: array with shape (L, L, 4, 4)
+    Gaps are not counted, each sequence is counted with its weight
+    """
+    import numpy as np
+    
+    N, L = codes.shape
+    onehot = np.zeros((N, L, 4), dtype=np.float32)
+    mask = codes < 4
+    seq_idx, col_idx = np.nonzero(mask)
+    onehot[seq_idx, col_idx, codes[mask]] = 1
+    onehot = onehot.reshape(N, L*4)
+    if weights is None:
+        counts = onehot.T @ onehot
+    else:
+        counts = (onehot * np.asarray(weights, dtype=np.float32)[:, None]).T @ onehot
+    return counts.reshape(L, 4, L, 4).transpose(0, 2, 1, 3)
+
+def __apc(matrix):
+    """
+    Average product correction of a symmetric score matrix, diagonal is ignored
+    """
+    import numpy as np
+    
+    matrix = matrix.copy()
+    np.fill_diagonal(matrix, np.nan)
+    with np.errstate(invalid='ignore'):
+        col_mean = np.nanmean(matrix, axis=1)
+        all_mean = np.nanmean(matrix)
+        return matrix - np.outer(col_mean, col_mean) / all_mean
+
+def calc_pair_statistics(codes, stat='MIp', min_seqs=5, weights=None):
+    """
+    Calculate covariation statistics of all column pairs
+    
+    codes               -- Encoded alignment from encode_alignment
+    stat                -- One of MI, MIp, G, Gp. MI is mutual information in bits; G is the G-test 
+                           statistic (2*N*MI in nats); MIp and Gp are corrected with average product correction (APC)
+    min_seqs            -- Column pairs aligned in less than min_seqs sequences (weighted) are scored as NaN
+    weights             -- Weight of each sequence, see calc_sequence_weights. Default: all 1
+    
+    Return a numpy matrix with shape (L, L)
+    """
+    import numpy as np
+    
+    assert stat in ('MI', 'MIp', 'G', 'Gp'), "stat should be one of MI, MIp, G, Gp"
+    counts = __pair_count_matrix(codes, weights)
+    total = counts.sum(axis=(2,3))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_ab = counts / total[:, :, None, None]
+        p_a = p_ab.sum(axis=3, keepdims=True)
+        p_b = p_ab.sum(axis=2, keepdims=True)
+        terms = np.where(p_ab>0, p_ab * np.log(p_ab / (p_a * p_b)), 0)
+    MI = terms.sum(axis=(2,3))
+    MI[total<min_seqs] = np.nan
+    
+    if stat in ('MI', 'MIp'):
+        score = MI / np.log(2)
+    else:
+        score = 2 * total * MI
+    if stat in ('MIp', 'Gp'):
+        score = __apc(score)
+    return score
+
+def __shuffle_alignment(codes, null, rng):
+    """
+    Shuffle the residues in each column independently
+    null                -- column: shuffle all rows including gaps; pair: shuffle only the non-gap residues
+    """
+    import numpy as np
+    
+    codes = codes.copy()
+    N, L = codes.shape
+    if null == 'column':
+        order = np.argsort(rng.random((N, L)), axis=0)
+        return np.take_along_axis(codes, order, axis=0)
+    for col in range(L):
+        rows = np.nonzero(codes[:, col] < 4)[0]
+        codes[rows, col] = rng.permutation(codes[rows, col])
+    return codes
+
+def __null_score(codes, stat, left, right, min_seqs, weights=None):
+    """
+    Return the scores of column pairs (left[k], right[k]), 0-based
+    """
+    if stat == 'RAFS':
+        import numpy as np
+        letters = np.frombuffer(b"ACGU-", dtype=np.uint8)
+        columns = collect_columns([ row.tobytes().decode() for row in letters[codes] ])
+        return np.array([ calc_RNAalignfold_stack(columns, i+1, j+1, min_alignment=min_seqs, weights=weights) for i,j in zip(left, right) ])
+    return calc_pair_statistics(codes, stat=stat, min_seqs=min_seqs, weights=weights)[left, right]
+
+__perm_state = None
+
+def __init_perm_worker(state):
+    global __perm_state
+    __perm_state = state
+
+def __perm_worker(task):
+    """
+    Run a batch of permutations, return the number of null scores >= each sorted observed score
+    """
+    import numpy as np
+    
+    seed, n_perm = task
+    codes, stat, null, left, right, min_seqs, weights, sorted_obs = __perm_state
+    rng = np.random.default_rng(seed)
+    greater = np.zeros(len(sorted_obs), dtype=np.int64)
+    total = 0
+    for _ in range(n_perm):
+        null_scores = __null_score(__shuffle_alignment(codes, null, rng), stat, left, right, min_seqs, weights)
+        null_scores = np.sort(null_scores[~np.isnan(null_scores)])
+        greater += len(null_scores) - np.searchsorted(null_scores, sorted_obs, side='left')
+        total += len(null_scores)
+    return greater, total
+
+def covariation_significance(alignment, pairs=None, stat='MIp', null='column', n_perm=100, 
+    processes=None, seed=0, batch_size=10, min_seqs=5, min_dist=4, weights=None):
+    """
+    Estimate the significance of covariation of column pairs by permutation, without R-scape.
+    The null scores of all tested pairs in all permutations are pooled.
+    
+    alignment           -- A list of aligned sequences, a dict { id: aligned_seq }, or a uint8 matrix
+    pairs               -- Column pairs to test, [ (left, right), ... ] 1-based. Default: all pairs with right-left>=min_dist
+    stat                -- One of MI, MIp, G, Gp (see calc_pair_statistics) and RAFS (calc_RNAalignfold_stack, slow)
+    null                -- column: shuffle each column independently
+                           pair: shuffle the residues among sequences without gap in the column, 
+                                 so the number of aligned sequences of every pair is preserved
+    n_perm              -- Number of permutations
+    processes           -- Number of worker processes, default is all cores. 1 to run in this process
+    seed                -- Random seed, each batch of permutations has its own RNG derived from it, 
+                           so results do not depend on processes
+    batch_size          -- Permutations per task
+    min_seqs            -- Column pairs aligned in less than min_seqs sequences are not scored
+    min_dist            -- Minimum distance of default pairs
+    weights             -- Weight of each sequence, see calc_sequence_weights. Default: all 1
+    
+    Return [ (left, right, score, pvalue, evalue), ... ], 1-based. pvalue is the fraction of pooled 
+    null scores >= score, evalue is the expected number of null pairs >= score per alignment
+    """
+    import numpy as np
+    import multiprocessing
+    
+    assert stat in ('MI', 'MIp', 'G', 'Gp', 'RAFS'), "stat should be one of MI, MIp, G, Gp, RAFS"
+    assert null in ('column', 'pair'), "null should be one of column, pair"
+    
+    codes = encode_alignment(alignment)
+    N, L = codes.shape
+    if pairs is None:
+        left, right = np.triu_indices(L, k=min_dist)
+    else:
+        left = np.array([ i-1 for i,j in pairs ], dtype=int)
+        right = np.array([ j-1 for i,j in pairs ], dtype=int)
+    
+    observed = __null_score(codes, stat, left, right, min_seqs, weights)
+    valid = ~np.isnan(observed)
+    sorted_obs = np.sort(observed[valid])
+    
+    seeds = np.random.SeedSequence(seed).spawn((n_perm+batch_size-1)//batch_size)
+    tasks = []
+    for k, child in enumerate(seeds):
+        tasks.append( (child, min(batch_size, n_perm-k*batch_size)) )
+    
+    state = (codes, stat, null, left, right, min_seqs, weights, sorted_obs)
+    if processes == 1:
+        __init_perm_worker(state)
+        results = [ __perm_worker(task) for task in tasks ]
+    else:
+        with multiprocessing.Pool(processes, initializer=__init_perm_worker, initargs=(state,)) as pool:
+            results = pool.map(__perm_worker, tasks)
+    
+    greater = sum([ result[0] for result in results ])
+    total = sum([ result[1] for result in results ])
+    
+    rank = np.searchsorted(sorted_obs, observed[valid], side='left')
+    pvalue = np.full(len(observed), np.nan)
+    evalue = np.full(len(observed), np.nan)
+    pvalue[valid] = (greater[rank] + 1) / (total + 1)
+    evalue[valid] = greater[rank] / n_perm
+    
+    return [ (int(i)+1, int(j)+1, float(score), float(p), float(e)) for i,j,score,p,e in zip(left, right, observed, pvalue, evalue) ]
+
+def __identity_onehot(codes):
+    """
+    Return one-hot matrix (N, L*4) and the number of residues of each sequence
+    """
+    import numpy as np
+    
+    N, L = codes.shape
+    onehot = np.zeros((N, L, 4), dtype=np.float32)
+    mask = codes < 4
+    seq_idx, col_idx = np.nonzero(mask)
+    onehot[seq_idx, col_idx, codes[mask]] = 1
+    return onehot.reshape(N, L*4), mask.sum(axis=1)
+
+def __identity_block(onehot_1, len_1, onehot_2, len_2):
+    """
+    Identity between two blocks of sequences: identical residues / min(residues of two sequences)
+    """
+    import numpy as np
+    
+    matches = onehot_1 @ onehot_2.T
+    min_len = np.minimum(len_1[:, None], len_2[None, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(min_len>0, matches / min_len, 0)
+
+def iter_identity_blocks(alignment, block_size=2048):
+    """
+    Calculate pairwise identity of aligned sequences block by block, so the N x N matrix is never 
+    kept in memory. Identity is identical residues divided by the residues of the shorter sequence.
+    
+    alignment           -- A list of aligned sequences, a dict, a uint8 matrix or codes from encode_alignment
+    block_size          -- Number of sequences in each block
+    
+    Yield (row_start, col_start, identity_block) for the upper triangle blocks (row_start<=col_start)
+    """
+    import numpy as np
+    
+    codes = alignment if isinstance(alignment, np.ndarray) and alignment.dtype == np.int8 else encode_alignment(alignment)
+    onehot, seq_len = __identity_onehot(codes)
+    N = codes.shape[0]
+    for row_start in range(0, N, block_size):
+        row_end = min(row_start+block_size, N)
+        for col_start in range(row_start, N, block_size):
+            col_end = min(col_start+block_size, N)
+            yield row_start, col_start, __identity_block(onehot[row_start:row_end], seq_len[row_start:row_end], 
+                onehot[col_start:col_end], seq_len[col_start:col_end])
+
+def calc_identity_matrix(alignment, block_size=2048):
+    """
+    Return the N x N pairwise identity matrix of aligned sequences, see iter_identity_blocks
+    """
+    import numpy as np
+    
+    N = len(alignment)
+    identity = np.zeros((N, N), dtype=np.float32)
+    for row_start, col_start, block in iter_identity_blocks(alignment, block_size):
+        rows, cols = block.shape
+        identity[row_start:row_start+rows, col_start:col_start+cols] = block
+        identity[col_start:col_start+cols, row_start:row_start+rows] = block.T
+    return identity
+
+def __merge_labels(labels, left, right):
+    """
+    labels              -- Cluster label of each sequence, the smallest index in the cluster
+    left, right         -- Arrays of linked sequence pairs
+    
+    Merge the clusters of linked pairs with vectorized min-label propagation
+    Return the new labels, each one is the smallest index of its cluster
+    """
+    import numpy as np
+    
+    while len(left):
+        root_1, root_2 = labels[left], labels[right]
+        linked = root_1 != root_2
+        if not linked.any():
+            break
+        left, right = left[linked], right[linked]
+        root_1, root_2 = root_1[linked], root_2[linked]
+        # Hook the larger root to the smaller one, then compress the paths
+        np.minimum.at(labels, np.maximum(root_1, root_2), np.minimum(root_1, root_2))
+        while True:
+            parent = labels[labels]
+            if (parent == labels).all():
+                break
+            labels = parent
+    return labels
+
+def calc_sequence_weights(alignment, threshold=0.62, method='neighbor', block_size=2048):
+    """
+    Calculate position-independent sequence weights to reduce the effect of redundant sequences
+    
+    alignment           -- A list of aligned sequences, a dict, a uint8 matrix or codes from encode_alignment
+    threshold           -- Identity threshold
+    method              -- neighbor: weight is 1/(number of sequences with identity >= threshold, including itself)
+                           cluster: single-linkage clusters at threshold (BLOSUM style), weight is 1/cluster size
+    block_size          -- Number of sequences in each block
+    
+    Return a numpy array of weights, the sum is the effective number of sequences
+    """
+    import numpy as np
+    
+    assert method in ('neighbor', 'cluster'), "method should be one of neighbor, cluster"
+    N = len(alignment)
+    if method == 'neighbor':
+        neighbors = np.zeros(N, dtype=np.int64)
+        for row_start, col_start, block in iter_identity_blocks(alignment, block_size):
+            close = block >= threshold
+            if row_start == col_start:
+                np.fill_diagonal(close, True)
+                neighbors[row_start:row_start+close.shape[0]] += close.sum(axis=1)
+            else:
+                neighbors[row_start:row_start+close.shape[0]] += close.sum(axis=1)
+                neighbors[col_start:col_start+close.shape[1]] += close.sum(axis=0)
+        return 1.0 / neighbors
+    
+    labels = np.arange(N)
+    for row_start, col_start, block in iter_identity_blocks(alignment, block_size):
+        rows, cols = np.nonzero(block >= threshold)
+        labels = __merge_labels(labels, rows+row_start, cols+col_start)
+    cluster_size = np.bincount(labels, minlength=N)
+    return 1.0 / cluster_size[labels]
+
+def filter_by_identity(alignment, max_identity=0.985, min_identity=0.0, block_size=2048):
+    """
+    Remove redundant and outlier sequences, similar to R-scape -I and -i
+    
+    alignment           -- A list of aligned sequences, a dict, a uint8 matrix or codes from encode_alignment
+    max_identity        -- Sequences are scanned in order, a sequence is removed if its identity to a kept sequence > max_identity
+    min_identity        -- A sequence is removed if its identity to all other sequences < min_identity
+    block_size          -- Number of sequences in each block
+    
+    Return the indexes (0-based) of kept sequences
+    """
+    import numpy as np
+    
+    codes = alignment if isinstance(alignment, np.ndarray) and alignment.dtype == np.int8 else encode_alignment(alignment)
+    N = codes.shape[0]
+    onehot, seq_len = __identity_onehot(codes)
+    
+    candidates = np.arange(N)
+    if min_identity > 0:
+        best = np.zeros(N)
+        for row_start, col_start, block in iter_identity_blocks(codes, block_size):
+            if row_start == col_start:
+                block = block.copy()
+                np.fill_diagonal(block, 0)
+            rows, cols = block.shape
+            best[row_start:row_start+rows] = np.maximum(best[row_start:row_start+rows], block.max(axis=1))
+            best[col_start:col_start+cols] = np.maximum(best[col_start:col_start+cols], block.max(axis=0))
+        candidates = candidates[best >= min_identity]
+    
+    kept = []
+    for start in range(0, len(candidates), block_size):
+        block_idx = candidates[start:start+block_size]
+        alive = np.ones(len(block_idx), dtype=bool)
+        for kept_start in range(0, len(kept), block_size):
+            kept_idx = np.array(kept[kept_start:kept_start+block_size])
+            identity = __identity_block(onehot[block_idx], seq_len[block_idx], onehot[kept_idx], seq_len[kept_idx])
+            alive &= ~(identity > max_identity).any(axis=1)
+        block_idx = block_idx[alive]
+        identity = __identity_block(onehot[block_idx], seq_len[block_idx], onehot[block_idx], seq_len[block_idx])
+        keep = np.ones(len(block_idx), dtype=bool)
+        for i in range(len(block_idx)):
+            if keep[i]:
+                keep[i+1:] &= ~(identity[i, i+1:] > max_identity)
+        kept += block_idx[keep].tolist()
+    
+    return np.array(kept, dtype=int)
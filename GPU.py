@@ -1,11 +1,6 @@
 #-*- coding:utf-8 -*-
 
-import os, sys, subprocess, random, time, re, General
-
-if 'getstatusoutput' in dir(subprocess):
-    from subprocess import getstatusoutput
-else:
-    from commands import getstatusoutput
+import os, sys, random, time, re, General
 
 class GPUProcess(object):
     def __init__(self, gpuid, pid, ptype, pname, memo):
@@ -29,7 +24,7 @@ def get_gpu_processes():
     """
     NVIDIASMI = General.require_exec("nvidia-smi", exception=False)
     
-    lines = getstatusoutput(NVIDIASMI)[1].strip().split('\n')
+    lines = General.run_tool([NVIDIASMI], capture=True, check=False).stdout.strip().split('\n')
     sl = 0
     while "Processes" not in lines[sl]:
         sl += 1
@@ -55,7 +50,7 @@ def get_gpu_list():
     """
     NVIDIASMI = General.require_exec("nvidia-smi", exception=False)
     
-    lines = getstatusoutput(NVIDIASMI+" -L")[1].strip().split('\n')
+    lines = General.run_tool([NVIDIASMI, "-L"], capture=True, check=False).stdout.strip().split('\n')
     gpuids = [ int(line.split()[1].rstrip(':')) for line in lines ]
     return gpuids
 
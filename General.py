@@ -1,6 +1,6 @@
 #-*- coding:utf-8 -*-
 
-import sys
+import sys, os
 
 def load_fasta(seqFn, rem_tVersion=False):
     """
@@ -27,6 +27,69 @@ def load_fasta(seqFn, rem_tVersion=False):
     
     return Fasta
 
+def iter_stockholm(stoFn, as_array=False, annotation=False):
+    """
+    stoFn               -- Stockholm file
+    as_array            -- Yield the aligned sequences as a numpy uint8 matrix (nseq x alignment length)
+    annotation          -- Also yield the markup of the alignment:
+                           { 'GF':[line,...], 'GS':[line,...], 'GR':{(name,tag):str}, 'GC':{tag:str} }
+    
+    Read stockholm file and yield the alignments one by one, interleaved
+    blocks are supported. Only one alignment is kept in memory.
+    
+    Yield:
+        (id2seq_dict, "...(((...)))...", "AGCTGACG..AGCTG") or
+        ([id1, id2, ...], uint8_matrix, "...(((...)))...", "AGCTGACG..AGCTG") if as_array=True
+        The markup dict is appended to the tuple if annotation=True
+    """
+    id2frags = None
+    GC = {}
+    for lineno, line in enumerate(open(stoFn), 1):
+        if line.startswith('# STOCKHOLM'):
+            id2frags, GC = {}, {}
+            GF, GS, GR = [], [], {}
+        elif line.startswith('//'):
+            if id2frags is None:
+                continue
+            refStr = "".join(GC.get('SS_cons', []))
+            refAnnot = "".join(GC.get('RF', []))
+            if as_array:
+                import numpy as np
+                names = list(id2frags)
+                rows = [ "".join(id2frags[name]).encode() for name in names ]
+                if len(set([ len(row) for row in rows ])) > 1:
+                    raise RuntimeError(f"Error: sequences in {stoFn} have different aligned lengths")
+                matrix = np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(len(rows), -1)
+                item = (names, matrix, refStr, refAnnot)
+            else:
+                item = ({ name:"".join(frags) for name,frags in id2frags.items() }, refStr, refAnnot)
+            if annotation:
+                item += ({ 'GF': GF, 'GS': GS, 'GR': { key:"".join(frags) for key,frags in GR.items() }, 
+                    'GC': { tag:"".join(frags) for tag,frags in GC.items() } },)
+            yield item
+            id2frags = None
+        elif id2frags is None:
+            continue
+        elif line.startswith('#=GC'):
+            data = line.split()
+            if len(data) == 3:
+                GC.setdefault(data[1], []).append(data[2])
+        elif annotation and line.startswith('#=GF'):
+            GF.append(line.rstrip('\n'))
+        elif annotation and line.startswith('#=GS'):
+            GS.append(line.rstrip('\n'))
+        elif annotation and line.startswith('#=GR'):
+            data = line.split()
+            if len(data) == 4:
+                GR.setdefault((data[1], data[2]), []).append(data[3])
+        elif line[0] == '#' or not line.strip():
+            continue
+        else:
+            data = line.split()
+            if len(data) != 2:
+                raise RuntimeError(f"Error: bad sequence line {lineno} in {stoFn}: {line.strip()}")
+            id2frags.setdefault(data[0], []).append(data[1])
+
 def load_stockholm(stoFn):
     """
     Read stockholm file
@@ -34,18 +97,7 @@ def load_stockholm(stoFn):
     Return:
         [ (id2seq_dict, "...(((...)))...", "AGCTGACG..AGCTG"), ... ]
     """
-    from Bio import AlignIO
-    from Bio.Alphabet import generic_rna
-    
-    alignment_list = []
-    for record in AlignIO.parse(stoFn, "stockholm"):
-        alignObjs = list(iter(record))
-        id2seq = { alignObj.id:str(alignObj.seq) for alignObj in alignObjs }
-        refStr = record.column_annotations.get("secondary_structure", "")
-        refAnnot = record.column_annotations.get("reference_annotation", "")
-        alignment_list.append((id2seq, refStr, refAnnot))
-    
-    return alignment_list
+    return list(iter_stockholm(stoFn))
 
 def write_fasta(Fasta, seqFn):
     """
@@ -397,19 +449,102 @@ def calc_shape_gini(shape_list, min_num=10):
     
     return -1
 
-def require_exec(exec_command, warning="", exception=True):
+############################################
+#######    External tool registry
+############################################
+
+__TOOL_PATHS = {}
+__TOOL_VERSIONS = {}
+__TOOL_OVERRIDES = None
+
+def __tool_env_key(exec_command):
+    """
+    Environment variable to override the path of a tool, such as Fold-smp => IPYRSSA_TOOL_FOLD_SMP
+    """
+    import re
+    return "IPYRSSA_TOOL_" + re.sub(r"\W", "_", exec_command).upper()
+
+def __tool_override(exec_command):
+    """
+    Return the path of a tool set by set_tool_path, $IPYRSSA_TOOL_<NAME> or the config file, None if not set
+    """
+    import json
+    global __TOOL_OVERRIDES
+    
+    if __TOOL_OVERRIDES is None:
+        __TOOL_OVERRIDES = {}
+        configFn = os.environ.get('IPYRSSA_TOOLS_CONFIG', os.path.join(os.path.expanduser('~'), '.IPyRSSA', 'tools.json'))
+        if os.path.exists(configFn):
+            __TOOL_OVERRIDES.update(json.load(open(configFn)))
+    
+    if exec_command in __TOOL_OVERRIDES:
+        return __TOOL_OVERRIDES[exec_command]
+    return os.environ.get(__tool_env_key(exec_command))
+
+def set_tool_path(exec_command, exec_path):
+    """
+    exec_command            -- Tool name, such as Fold or Fold-smp
+    exec_path               -- Full path of the tool, None to remove the override
+    
+    Override the path of a tool for this process. Overrides can also be set with
+    $IPYRSSA_TOOL_<NAME> (Fold-smp => IPYRSSA_TOOL_FOLD_SMP) or a JSON file
+    { "Fold-smp": "/path/to/Fold-smp", ... } in $IPYRSSA_TOOLS_CONFIG (default ~/.IPyRSSA/tools.json)
+    """
+    __tool_override(exec_command)
+    if exec_path is None:
+        __TOOL_OVERRIDES.pop(exec_command, None)
+    else:
+        __TOOL_OVERRIDES[exec_command] = exec_path
+    clear_tool_cache()
+
+def clear_tool_cache():
+    """
+    Forget the resolved tools and versions, for example after PATH is changed
+    """
+    __TOOL_PATHS.clear()
+    __TOOL_VERSIONS.clear()
+
+def resolve_tool(exec_command, prefer_smp=False):
+    """
+    exec_command            -- Tool name
+    prefer_smp              -- Use the <exec_command>-smp variant if it is found
+    
+    Resolve the tool once per process (and PATH). Overrides are checked before PATH,
+    the -smp variant is checked before the plain tool
+    
+    Return the full path, or None if not found
+    """
+    import shutil
+    
+    key = (exec_command, prefer_smp, os.environ.get('PATH', ''))
+    if key not in __TOOL_PATHS:
+        candidates = [ exec_command+"-smp", exec_command ] if prefer_smp else [ exec_command ]
+        exec_path = None
+        for candidate in candidates:
+            exec_path = __tool_override(candidate)
+            if exec_path:
+                break
+        if not exec_path:
+            for candidate in candidates:
+                exec_path = shutil.which(candidate)
+                if exec_path:
+                    break
+        __TOOL_PATHS[key] = exec_path
+    return __TOOL_PATHS[key]
+
+def require_exec(exec_command, warning="", exception=True, prefer_smp=False):
     """
     exec_command            -- Shell command
     warning                 -- Print warning if command not found
     exception               -- Raise an exception if command not found
                                if exception is False, no warning showed
+    prefer_smp              -- Use the <exec_command>-smp variant if it is found
     
-    Test if command in the PATH
+    Test if command in the PATH, the result is cached, see resolve_tool
     
     Return full path  if command found
     """
-    import distutils.spawn
-    exec_path = distutils.spawn.find_executable(exec_command)
+    exec_path = resolve_tool(exec_command, prefer_smp=prefer_smp)
     
     if not warning:
         warning = "Error: %s not found in PATH" % (exec_command, )
@@ -420,6 +555,441 @@ def require_exec(exec_command, warning="", exception=True):
     
     return exec_path
 
+def tool_version(exec_command, prefer_smp=False):
+    """
+    exec_command            -- Tool name
+    prefer_smp              -- Use the <exec_command>-smp variant if it is found
+    
+    Probe the version of the tool once per process with --version, -version, -h or no argument
+    
+    Return a version string such as 1.1.2, "unknown" if it cannot be probed, None if the tool is not found
+    """
+    import re, subprocess
+    
+    exec_path = resolve_tool(exec_command, prefer_smp=prefer_smp)
+    if exec_path is None:
+        return None
+    
+    if exec_path not in __TOOL_VERSIONS:
+        version = "unknown"
+        for args in (["--version"], ["-version"], ["-h"], []):
+            try:
+                output = subprocess.run([exec_path]+args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, 
+                    stderr=subprocess.STDOUT, timeout=10, universal_newlines=True, errors='replace').stdout
+            except (subprocess.TimeoutExpired, OSError):
+                continue
+            match = re.search(r"(?i)(?:version|INFERNAL|R-scape|MUSCLE|blastn|kalign|FASTA|RNAforester)[\s:v]*([0-9]+(?:\.[0-9]+)+[a-z0-9]*)", output) or \
+                re.search(r"\bv?([0-9]+\.[0-9]+(?:\.[0-9]+)?[a-z]?)\b", output)
+            if match:
+                version = match.group(1)
+                break
+        __TOOL_VERSIONS[exec_path] = version
+    return __TOOL_VERSIONS[exec_path]
+
+def tool_versions(probe=True):
+    """
+    probe                   -- Probe the versions of resolved tools which are not probed yet
+    
+    Return { tool_path: version } of the tools resolved in this process, for provenance logs
+    """
+    if probe:
+        for exec_path in set(__TOOL_PATHS.values()):
+            if exec_path and exec_path not in __TOOL_VERSIONS:
+                tool_version(exec_path)
+    return dict(__TOOL_VERSIONS)
+
+############################################
+#######    External tool runner
+############################################
+
+__SCRATCH_ROOT = None
+__TOOL_SLOTS = None
+DEFAULT_TOOL_TIMEOUT = float(os.environ['IPYRSSA_TOOL_TIMEOUT']) if os.environ.get('IPYRSSA_TOOL_TIMEOUT') else None
+
+def get_scratch_root():
+    """
+    Return the base directory of scratch directories: $IPYRSSA_SCRATCH, /dev/shm if writable, or the system tmp directory
+    """
+    import tempfile
+    global __SCRATCH_ROOT
+    
+    if __SCRATCH_ROOT is None:
+        if os.environ.get('IPYRSSA_SCRATCH'):
+            __SCRATCH_ROOT = os.environ['IPYRSSA_SCRATCH']
+        elif os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            __SCRATCH_ROOT = '/dev/shm'
+        else:
+            __SCRATCH_ROOT = tempfile.gettempdir()
+    return __SCRATCH_ROOT
+
+def set_scratch_root(scratch_root):
+    """
+    scratch_root            -- Base directory of scratch directories, such as /dev/shm or a local disk
+    """
+    global __SCRATCH_ROOT
+    os.makedirs(scratch_root, exist_ok=True)
+    __SCRATCH_ROOT = scratch_root
+
+def new_scratch_dir(prefix="ipyrssa_"):
+    """
+    prefix                  -- Prefix of the directory name
+    
+    Create a collision-free scratch directory under get_scratch_root()
+    Return the path of the directory, the caller removes it
+    """
+    import tempfile
+    return tempfile.mkdtemp(prefix=prefix, dir=get_scratch_root())
+
+class scratch_dir(object):
+    def __init__(self, prefix="ipyrssa_", clean=True):
+        """
+        prefix                  -- Prefix of the directory name
+        clean                   -- Remove the directory at exit, also when an error is raised
+        
+        Context manager of new_scratch_dir, so failed tools do not leave directories in /dev/shm
+        
+        Example:
+            with General.scratch_dir("fold_") as ROOT:
+                ...
+        """
+        self.prefix = prefix
+        self.clean = clean
+    
+    def __enter__(self):
+        self.path = new_scratch_dir(self.prefix)
+        return self.path
+    
+    def __exit__(self, *exc_info):
+        import shutil
+        if self.clean:
+            shutil.rmtree(self.path, ignore_errors=True)
+        return False
+
+def set_max_tool_processes(max_processes):
+    """
+    max_processes           -- Maximum number of external tool processes run at the same time by run_tool.
+                               Default: $IPYRSSA_MAX_TOOLS or the number of CPUs
+    """
+    import threading
+    global __TOOL_SLOTS
+    __TOOL_SLOTS = threading.BoundedSemaphore(max(1, int(max_processes)))
+
+def __tool_slots():
+    if __TOOL_SLOTS is None:
+        set_max_tool_processes(os.environ.get('IPYRSSA_MAX_TOOLS') or os.cpu_count() or 1)
+    return __TOOL_SLOTS
+
+def format_command(argv):
+    """
+    Return the command line of argv for printing
+    """
+    import shlex
+    return shlex.join([ str(arg) for arg in argv ])
+
+############################################
+#######    External tool metrics
+############################################
+
+TOOL_TIME_BUCKETS = (0.01, 0.03, 0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000)
+
+__TOOL_METRICS_ON = os.environ.get('IPYRSSA_TOOL_METRICS', '') not in ('', '0')
+__TOOL_TRACE = os.environ.get('IPYRSSA_TOOL_TRACE') or None
+__TOOL_METRICS = {}
+__TOOL_PROFILES = []
+__TOOL_METRICS_LOCK = None
+__RUSAGE_POPEN = None
+
+def enable_tool_metrics(trace_file=None):
+    """
+    trace_file              -- Append one JSON line per tool call to this file
+    
+    Record wall time, child CPU time, peak RSS, input size and exit status of every run_tool call.
+    Can also be enabled with $IPYRSSA_TOOL_METRICS=1 and $IPYRSSA_TOOL_TRACE=<file>
+    """
+    global __TOOL_METRICS_ON, __TOOL_TRACE
+    __TOOL_METRICS_ON = True
+    __TOOL_TRACE = trace_file
+
+def disable_tool_metrics():
+    global __TOOL_METRICS_ON, __TOOL_TRACE
+    __TOOL_METRICS_ON = False
+    __TOOL_TRACE = None
+
+def reset_tool_metrics():
+    __TOOL_METRICS.clear()
+
+def tool_metrics():
+    """
+    Return { tool: { 'calls', 'failures', 'wall_time', 'cpu_time', 'max_rss_kb', 'input_bytes', 'wall_histogram' }, ... }
+    wall_histogram counts calls with wall time <= each bound of TOOL_TIME_BUCKETS, the last count is for longer calls
+    """
+    import copy
+    with __metrics_lock():
+        return copy.deepcopy(__TOOL_METRICS)
+
+def __metrics_lock():
+    import threading
+    global __TOOL_METRICS_LOCK
+    if __TOOL_METRICS_LOCK is None:
+        __TOOL_METRICS_LOCK = threading.Lock()
+    return __TOOL_METRICS_LOCK
+
+def __rusage_popen():
+    """
+    Return a subclass of subprocess.Popen which keeps the resource usage of the child from os.wait4.
+    
+    Popen reaps the child itself, so the rusage can only be taken in its _try_wait hook. The hook 
+    is private: if this Python has no Popen._try_wait (or no os.wait4), the plain subprocess.Popen 
+    is returned and the calls are recorded without cpu_time and max_rss_kb
+    """
+    import subprocess
+    global __RUSAGE_POPEN
+    
+    if __RUSAGE_POPEN is None:
+        if not hasattr(os, 'wait4') or not callable(getattr(subprocess.Popen, '_try_wait', None)):
+            __RUSAGE_POPEN = subprocess.Popen
+            return __RUSAGE_POPEN
+        class RusagePopen(subprocess.Popen):
+            rusage = None
+            def _try_wait(self, wait_flags):
+                try:
+                    pid, sts, rusage = os.wait4(self.pid, wait_flags)
+                except ChildProcessError:
+                    return (self.pid, 0)
+                if pid == self.pid:
+                    self.rusage = rusage
+                return (pid, sts)
+        __RUSAGE_POPEN = RusagePopen
+    return __RUSAGE_POPEN
+
+def __input_bytes(argv, stdin):
+    """
+    Size of stdin and the existing files in the arguments, measured before the tool runs
+    """
+    size = len(stdin) if stdin else 0
+    for arg in argv[1:]:
+        if os.path.isfile(arg):
+            size += os.path.getsize(arg)
+    return size
+
+def __record_tool_call(argv, input_bytes, start_time, wall_time, process, timed_out):
+    """
+    Add a tool call to the counters, the active tool_profile blocks and the trace file
+    """
+    import bisect, json
+    
+    rusage = getattr(process, 'rusage', None)
+    record = {
+        'tool': os.path.basename(argv[0]),
+        'command': format_command(argv),
+        'start': round(start_time, 3),
+        'wall_time': round(wall_time, 4),
+        'cpu_time': round(rusage.ru_utime + rusage.ru_stime, 4) if rusage else None,
+        'max_rss_kb': rusage.ru_maxrss if rusage else None,
+        'input_bytes': input_bytes,
+        'returncode': process.returncode,
+        'timed_out': timed_out
+    }
+    with __metrics_lock():
+        metric = __TOOL_METRICS.setdefault(record['tool'], { 'calls': 0, 'failures': 0, 'wall_time': 0.0, 
+            'cpu_time': 0.0, 'max_rss_kb': 0, 'input_bytes': 0, 'wall_histogram': [0]*(len(TOOL_TIME_BUCKETS)+1) })
+        metric['calls'] += 1
+        metric['failures'] += int(process.returncode != 0 or timed_out)
+        metric['wall_time'] += wall_time
+        metric['cpu_time'] += record['cpu_time'] or 0
+        metric['max_rss_kb'] = max(metric['max_rss_kb'], record['max_rss_kb'] or 0)
+        metric['input_bytes'] += record['input_bytes']
+        metric['wall_histogram'][bisect.bisect_left(TOOL_TIME_BUCKETS, wall_time)] += 1
+        for profile in __TOOL_PROFILES:
+            profile.append(record)
+        if __TOOL_TRACE:
+            with open(__TOOL_TRACE, 'a') as OUT:
+                OUT.write(json.dumps(record)+"\n")
+
+class tool_profile(object):
+    def __init__(self, OUT=sys.stdout, title="Tool profile"):
+        """
+        OUT                     -- Print the per-tool breakdown to this handle at exit, None to keep silent
+        title                   -- Title of the breakdown
+        
+        Context manager to record all run_tool calls in the block
+        
+        Example:
+            with General.tool_profile() as profile:
+                Structure.predict_structure(sequence)
+                Structure.partition(sequence)
+            profile.records     # One dict per tool call
+        """
+        self.OUT = OUT
+        self.title = title
+        self.records = []
+    
+    def __enter__(self):
+        import time
+        self.start_time = time.time()
+        _register_tool_profile(self.records)
+        return self
+    
+    def __exit__(self, *exc_info):
+        import time
+        self.wall_time = time.time() - self.start_time
+        _unregister_tool_profile(self.records)
+        if self.OUT is not None:
+            self.report(self.OUT)
+        return False
+    
+    def breakdown(self):
+        """
+        Return { tool: (calls, failures, wall_time, cpu_time, max_rss_kb, input_bytes) }
+        """
+        summary = {}
+        for record in self.records:
+            calls, failures, wall_time, cpu_time, max_rss, input_bytes = summary.get(record['tool'], (0, 0, 0.0, 0.0, 0, 0))
+            summary[record['tool']] = (calls+1, failures+int(record['returncode'] != 0 or record['timed_out']), 
+                wall_time+record['wall_time'], cpu_time+(record['cpu_time'] or 0), 
+                max(max_rss, record['max_rss_kb'] or 0), input_bytes+record['input_bytes'])
+        return summary
+    
+    def report(self, OUT=sys.stdout):
+        """
+        Print the calls, wall time, child CPU time, peak RSS and input size of each tool.
+        Time not spent in tools (Python) is the block wall time minus the tool wall time, it is negative if tools run in parallel
+        """
+        summary = self.breakdown()
+        total = getattr(self, 'wall_time', 0.0)
+        print(f"{self.title}: {total:.2f}s", file=OUT)
+        for tool, (calls, failures, wall_time, cpu_time, max_rss, input_bytes) in sorted(summary.items(), key=lambda item: -item[1][2]):
+            print(f"{tool:20s}\tcalls: {calls:6d}\tfailed: {failures:4d}\twall: {wall_time:10.2f}s\tcpu: {cpu_time:10.2f}s\tmax RSS: {max_rss/1024:8.1f}MB\tinput: {input_bytes/1024/1024:8.2f}MB", file=OUT)
+        tool_time = sum([ item[2] for item in summary.values() ])
+        print(f"{'(not in tools)':20s}\twall: {total-tool_time:10.2f}s", file=OUT)
+
+def _register_tool_profile(records):
+    with __metrics_lock():
+        __TOOL_PROFILES.append(records)
+
+def _unregister_tool_profile(records):
+    with __metrics_lock():
+        for i, profile in enumerate(__TOOL_PROFILES):
+            if profile is records:
+                del __TOOL_PROFILES[i]
+                break
+
+def run_tool(argv, stdin=None, capture=False, stdout_handler=None, timeout=None, cwd=None, env=None, verbose=False, check=True):
+    """
+    argv                    -- Command as a list of arguments, no shell is used
+    stdin                   -- Text sent to the standard input
+    capture                 -- Capture the standard output in memory
+    stdout_handler          -- A function called with the standard output stream (text), 
+                               its return value is the stdout of the result. Used to parse big outputs on the fly
+    timeout                 -- Kill the process after timeout seconds, default is DEFAULT_TOOL_TIMEOUT ($IPYRSSA_TOOL_TIMEOUT)
+    cwd                     -- Working directory
+    env                     -- Environment variables
+    verbose                 -- Show the output of the tool, otherwise it is discarded
+    check                   -- Raise a RuntimeError if the tool exits with a non-zero status
+    
+    Run an external tool. The number of concurrent tools is limited by set_max_tool_processes.
+    The call is recorded if enable_tool_metrics is on or in a tool_profile block
+    
+    Return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+    """
+    import subprocess, threading, time
+    
+    argv = [ str(arg) for arg in argv ]
+    if timeout is None:
+        timeout = DEFAULT_TOOL_TIMEOUT
+    
+    if capture or stdout_handler:
+        stdout = subprocess.PIPE
+    else:
+        stdout = None if verbose else subprocess.DEVNULL
+    if verbose:
+        stderr = None
+    else:
+        stderr = subprocess.DEVNULL if stdout_handler else subprocess.PIPE
+    
+    metrics = __TOOL_METRICS_ON or len(__TOOL_PROFILES) > 0
+    Popen = __rusage_popen() if metrics else subprocess.Popen
+    input_bytes = __input_bytes(argv, stdin) if metrics else 0
+    
+    with __tool_slots():
+        start_time = time.time()
+        process = Popen(argv, stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL, 
+            stdout=stdout, stderr=stderr, cwd=cwd, env=env, universal_newlines=True)
+        try:
+            if stdout_handler:
+                expired = []
+                def kill():
+                    expired.append(True)
+                    process.kill()
+                def feed():
+                    # Like communicate, write stdin while the handler reads stdout, a tool 
+                    # may fill the stdout pipe before it has read all of its input
+                    try:
+                        process.stdin.write(stdin)
+                    except (BrokenPipeError, OSError):
+                        pass
+                    finally:
+                        try:
+                            process.stdin.close()
+                        except (BrokenPipeError, OSError):
+                            pass
+                timer = threading.Timer(timeout, kill) if timeout else None
+                if timer: timer.start()
+                writer = threading.Thread(target=feed, daemon=True) if stdin is not None else None
+                if writer: writer.start()
+                try:
+                    out, err = stdout_handler(process.stdout), None
+                    process.stdout.read()
+                    process.wait()
+                except BaseException:
+                    # Unblock the writer before joining it
+                    process.kill()
+                    raise
+                finally:
+                    if timer: timer.cancel()
+                    if writer: writer.join()
+                timed_out = len(expired) > 0
+            else:
+                out, err = process.communicate(stdin, timeout=timeout)
+                timed_out = False
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            timed_out = True
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        wall_time = time.time() - start_time
+    
+    if metrics:
+        __record_tool_call(argv, input_bytes, start_time, wall_time, process, timed_out)
+    if timed_out:
+        raise RuntimeError(f"Error: {format_command(argv)} timed out after {timeout} seconds")
+    if check and process.returncode != 0:
+        message = f"Error: {format_command(argv)} failed with exit status {process.returncode}"
+        if err:
+            message += "\n" + err[-2000:]
+        raise RuntimeError(message)
+    return subprocess.CompletedProcess(argv, process.returncode, out, err)
+
+def run_tools(argv_list, **kwargs):
+    """
+    argv_list               -- A list of commands
+    kwargs                  -- Parameters of run_tool
+    
+    Run many external tools concurrently (still limited by set_max_tool_processes)
+    Return a list of subprocess.CompletedProcess in the same order, errors are raised after all tools finished
+    """
+    import concurrent.futures
+    
+    if len(argv_list) <= 1:
+        return [ run_tool(argv, **kwargs) for argv in argv_list ]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(argv_list)) as executor:
+        futures = [ executor.submit(run_tool, argv, **kwargs) for argv in argv_list ]
+        concurrent.futures.wait(futures)
+    return [ future.result() for future in futures ]
+
 def calc_shape_structure_positive_rate(dot, shape_list, cutoff):
     """
     dot                 -- Dotbracket structure
@@ -516,32 +1086,386 @@ def calc_AUC_v2(dot, shape_list):
     
     return AUC
 
+###########################
+####    Sequence toolkit: works on str, bytes or numpy uint8 arrays
+###########################
+
+### Complement of nucleotides and IUPAC codes, U is complemented to A
+__COMP_FROM = "ACGTUNacgtun-.RYKMSWBDHVrykmswbdhv"
+__COMP_TO   = "TGCAANtgcaan-.YRMKSWVHDByrmkswvhdb"
+__COMP_STR_TABLE = str.maketrans(__COMP_FROM, __COMP_TO)
+__COMP_BYTES_TABLE = bytes.maketrans(__COMP_FROM.encode(), __COMP_TO.encode())
+
+### IUPAC code => bases
+IUPAC_CODES = { 'A':'A', 'C':'C', 'G':'G', 'T':'T', 'U':'T', 'R':'AG', 'Y':'CT', 'S':'GC', 'W':'AT', 
+    'K':'GT', 'M':'AC', 'B':'CGT', 'D':'AGT', 'H':'ACT', 'V':'ACG', 'N':'ACGT' }
+
+def __seq_array(sequence):
+    """
+    Return a uint8 view of str/bytes/array sequence
+    """
+    import numpy as np
+    if isinstance(sequence, np.ndarray):
+        return sequence.astype(np.uint8, copy=False)
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    return np.frombuffer(sequence, dtype=np.uint8)
+
+def __base_code_table():
+    """
+    Lookup table: A:0, C:1, G:2, T/U:3, others:4
+    """
+    import numpy as np
+    table = np.full(256, 4, dtype=np.uint8)
+    for code, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+        for base in bases:
+            table[ord(base)] = code
+    return table
+
+def reverse_comp(sequence):
+    """
+    sequence                -- str or bytes, IUPAC codes are supported
+    
+    Return the reverse complementary sequence with the same type
+    """
+    if isinstance(sequence, str):
+        return sequence.translate(__COMP_STR_TABLE)[::-1]
+    return bytes(sequence).translate(__COMP_BYTES_TABLE)[::-1]
+
+def reverse_comp_batch(seq_list):
+    """
+    Return a list of reverse complementary sequences
+    """
+    return [ reverse_comp(sequence) for sequence in seq_list ]
+
+def flat_seq(sequence, lineLen=60):
+    """
+    sequence                -- Raw input sequence
+    lineLen                 -- Number of nucleotides for each line
+    
+    Flat raw long sequence to multiple lines
+    """
+    sequence = sequence.strip()
+    return "\n".join([ sequence[idx:idx+lineLen] for idx in range(0, len(sequence), lineLen) ])
+
+def encode_seq(sequence):
+    """
+    sequence                -- str, bytes or uint8 array
+    
+    Return uint8 array, A:0, C:1, G:2, T/U:3, others (N, gaps, IUPAC):4
+    """
+    return __base_code_table()[__seq_array(sequence)]
+
+def kmer_names(k):
+    """
+    Return the k-mer names in the order of count_kmers
+    """
+    import itertools
+    return [ "".join(kmer) for kmer in itertools.product('ACGT', repeat=k) ]
+
+def __kmer_index(codes, k):
+    """
+    Return the integer index of each k-mer and the mask of k-mers without non-ACGT bases
+    """
+    import numpy as np
+    
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    index = np.zeros(n, dtype=np.int64)
+    for j in range(k):
+        index = index * 4 + (codes[j:j+n] & 3)
+    invalid = np.r_[0, np.cumsum(codes == 4)]
+    valid = (invalid[k:k+n] - invalid[:n]) == 0
+    return index, valid
+
+def count_kmers(sequence, k=3):
+    """
+    sequence                -- str, bytes or uint8 array
+    k                       -- k-mer length
+    
+    Count k-mers, the k-mers with non-ACGT bases are skipped
+    Return a numpy array with 4**k counts, the names are in kmer_names(k)
+    """
+    import numpy as np
+    index, valid = __kmer_index(encode_seq(sequence), k)
+    return np.bincount(index[valid], minlength=4**k)
+
+def count_kmers_batch(seq_list, k=3):
+    """
+    Count k-mers of many sequences with one bincount
+    Return a numpy matrix with shape (len(seq_list), 4**k)
+    """
+    import numpy as np
+    
+    if len(seq_list) == 0:
+        return np.zeros((0, 4**k), dtype=np.int64)
+    codes_list = [ encode_seq(sequence) for sequence in seq_list ]
+    ### A separator (code 4) between sequences, so no k-mer crosses two sequences
+    codes = np.concatenate([ np.r_[codes, np.uint8(4)] for codes in codes_list ]).astype(np.uint8)
+    seq_idx = np.repeat(np.arange(len(codes_list)), [ len(codes)+1 for codes in codes_list ])
+    index, valid = __kmer_index(codes, k)
+    flat = seq_idx[:len(index)][valid] * 4**k + index[valid]
+    return np.bincount(flat, minlength=len(codes_list)*4**k).reshape(len(codes_list), 4**k)
+
+def __window_starts(length, window, step):
+    import numpy as np
+    return np.arange(0, max(length-window+1, 0), step)
+
+def gc_profile(sequence, window=100, step=1):
+    """
+    sequence                -- str, bytes or uint8 array
+    window                  -- Window size
+    step                    -- Step between windows
+    
+    Return (window_starts, gc_ratio). gc_ratio is (G+C)/(A+C+G+T) in each window, non-ACGT bases 
+    are not counted and windows without valid base are NaN. window_starts are 0-based
+    """
+    import numpy as np
+    
+    codes = encode_seq(sequence)
+    starts = __window_starts(len(codes), window, step)
+    gc = np.r_[0, np.cumsum((codes == 1) | (codes == 2))]
+    acgt = np.r_[0, np.cumsum(codes < 4)]
+    n_gc = gc[starts+window] - gc[starts]
+    n_acgt = acgt[starts+window] - acgt[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return starts, np.where(n_acgt>0, n_gc / n_acgt, np.nan)
+
+def gc_profile_batch(seq_list, window=100, step=1):
+    """
+    Return a list of (window_starts, gc_ratio)
+    """
+    return [ gc_profile(sequence, window, step) for sequence in seq_list ]
+
+def __dinuc_entropy(counts):
+    """
+    counts                  -- Array with shape (..., 16)
+    """
+    import numpy as np
+    total = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        prob = counts / total
+        return -np.where(prob>0, prob*np.log2(prob), 0).sum(axis=-1) + np.where(total[...,0]>0, 0, np.nan)
+
+def dinuc_entropy_profile(sequence, window=100, step=1, chunk_size=1000000):
+    """
+    sequence                -- str, bytes or uint8 array
+    window                  -- Window size
+    step                    -- Step between windows
+    chunk_size              -- Number of positions processed together, bound the memory for chromosomes
+    
+    Return (window_starts, entropy). entropy is the dinucleotide entropy (0-4) of each window, 
+    dinucleotides with non-ACGT bases are skipped. window_starts are 0-based
+    """
+    import numpy as np
+    
+    codes = encode_seq(sequence)
+    index, valid = __kmer_index(codes, 2)
+    starts = __window_starts(len(codes), window, step)
+    entropy = np.full(len(starts), np.nan)
+    per_chunk = max(1, chunk_size // step)
+    for first in range(0, len(starts), per_chunk):
+        chunk_starts = starts[first:first+per_chunk]
+        lo, hi = chunk_starts[0], chunk_starts[-1] + window - 1
+        onehot = np.zeros((hi-lo+1, 16), dtype=np.int32)
+        rows = np.nonzero(valid[lo:hi])[0]
+        onehot[rows+1, index[lo:hi][rows]] = 1
+        cumsum = np.cumsum(onehot, axis=0)
+        counts = cumsum[chunk_starts-lo+window-1] - cumsum[chunk_starts-lo]
+        entropy[first:first+len(chunk_starts)] = __dinuc_entropy(counts)
+    return starts, entropy
+
+def dinuc_entropy_profile_batch(seq_list, window=100, step=1):
+    """
+    Return a list of (window_starts, entropy)
+    """
+    return [ dinuc_entropy_profile(sequence, window, step) for sequence in seq_list ]
+
 def seq_entropy(sequence):
     """
     Give a sequence, calculate the entropy (0-4)
-    sequence        -- Sequence
+    sequence        -- Sequence, dinucleotides with N or other non-ACGT bases are skipped
+    """
+    ### The last dinucleotide is not counted, same as the original implementation
+    return float(__dinuc_entropy(count_kmers(sequence[:-1], 2)))
+
+def seq_entropy_batch(seq_list):
+    """
+    Return a numpy array of entropy of sequences
+    """
+    return __dinuc_entropy(count_kmers_batch([ sequence[:-1] for sequence in seq_list ], 2))
+
+def expand_iupac(pattern):
+    """
+    pattern                 -- Sequence with IUPAC codes, such as GGACH
+    
+    Return all ACGT sequences represented by the pattern
+    """
+    import itertools
+    pattern = pattern.upper()
+    for base in pattern:
+        if base not in IUPAC_CODES:
+            raise RuntimeError(f"Error: {base} is not a IUPAC code")
+    return [ "".join(bases) for bases in itertools.product(*[ IUPAC_CODES[base] for base in pattern ]) ]
+
+def iupac_to_regex(pattern):
+    """
+    Convert IUPAC pattern to regular expression, such as GGACH => GGAC[ACT]
+    """
+    return "".join([ "[%s]" % (IUPAC_CODES[base],) if len(IUPAC_CODES[base])>1 else IUPAC_CODES[base] for base in pattern.upper() ])
+
+def iupac_find(sequence, pattern):
+    """
+    sequence                -- str, bytes or uint8 array. IUPAC codes in sequence match all their bases
+    pattern                 -- Pattern with IUPAC codes
+    
+    Return a numpy array of 0-based start positions of all (overlapping) matches on the forward strand
     """
     import numpy as np
-    if 'N' in sequence:
-        raise RuntimeError("Error: N in sequence, not allowed")
-    
-    sequence = sequence.replace('U','T')
-    binucs = []
-    i = 0
-    while i<len(sequence)-2:
-        binucs.append( sequence[i:i+2] )
-        i+=1
-    fb = ['A','T','C','G']
-    m = {}
-    for b1 in fb:
-        for b2 in fb:
-            m[b1+b2] = 0
-    for b in binucs:
-        m[b[0]+b[1]] += 1
-    
-    m = list(m.values())
-    ms = sum(m)
-    prob = [ii/ms for ii in m]
-    entropy = sum([ -p*np.log2(p) for p in prob if p!=0 ])
-    return entropy
+    
+    bits = np.zeros(256, dtype=np.uint8)
+    for code, bases in IUPAC_CODES.items():
+        value = sum([ {'A':1, 'C':2, 'G':4, 'T':8}[base] for base in bases ])
+        bits[ord(code)] = bits[ord(code.lower())] = value
+    seq_bits = bits[__seq_array(sequence)]
+    pattern_bits = bits[__seq_array(pattern.upper())]
+    n = len(seq_bits) - len(pattern_bits) + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    match = np.ones(n, dtype=bool)
+    for j, value in enumerate(pattern_bits):
+        match &= (seq_bits[j:j+n] & value) != 0
+    return np.nonzero(match)[0]
+
+def iupac_find_batch(seq_list, pattern):
+    """
+    Return a list of start position arrays
+    """
+    return [ iupac_find(sequence, pattern) for sequence in seq_list ]
+
 
+class AhoCorasick(object):
+    def __init__(self, patterns, iupac=False, both_strands=False, max_expansions=10000):
+        """
+        patterns                -- A list of literal sequences (ACGTU), pattern_id is the index in the list
+        iupac                   -- Expand IUPAC codes in patterns into all the literal sequences
+        both_strands            -- Also search the reverse complement of the patterns, these hits are on - strand
+        max_expansions          -- Raise an error if a pattern expands into more literal sequences
+        
+        Find all the patterns in one pass over the sequence. Non-ACGT bases in the sequence never match.
+        
+        Example:
+            searcher = General.AhoCorasick(['GGACH', 'TGAGGTAG'], iupac=True, both_strands=True)
+            hits = searcher.search(sequence)
+            for pattern_id, start, end, strand in hits:
+                print(pattern_id, sequence[start:end], strand)
+        """
+        import collections
+        
+        self.patterns = list(patterns)
+        self.entries = [] # (pattern_id, length, strand)
+        
+        goto = [[-1, -1, -1, -1]]
+        outputs = [[]]
+        table = { 'A':0, 'C':1, 'G':2, 'T':3, 'U':3 }
+        
+        for pattern_id, pattern in enumerate(self.patterns):
+            pattern = pattern.upper()
+            if iupac:
+                literals = expand_iupac(pattern) if len(pattern) > 0 else []
+                if len(literals) > max_expansions:
+                    raise RuntimeError(f"Error: {pattern} expands into {len(literals)} sequences (max_expansions={max_expansions})")
+            else:
+                literals = [pattern]
+            strands = [('+', literals)]
+            if both_strands:
+                strands.append(('-', [ reverse_comp(literal) for literal in literals ]))
+            for strand, seq_list in strands:
+                entry = len(self.entries)
+                self.entries.append((pattern_id, len(pattern), strand))
+                for literal in seq_list:
+                    if len(literal) == 0:
+                        raise RuntimeError("Error: empty pattern")
+                    state = 0
+                    for base in literal:
+                        if base not in table:
+                            raise RuntimeError(f"Error: {base} in {pattern} is not A/C/G/T/U, use iupac=True for degenerate patterns")
+                        code = table[base]
+                        if goto[state][code] == -1:
+                            goto[state][code] = len(goto)
+                            goto.append([-1, -1, -1, -1])
+                            outputs.append([])
+                        state = goto[state][code]
+                    if entry not in outputs[state]:
+                        outputs[state].append(entry)
+        
+        ### Breadth-first failure links, fold them into a full transition table
+        num_states = len(goto)
+        fail = [0] * num_states
+        delta = [0] * (num_states * 5)
+        queue = collections.deque()
+        for code in range(4):
+            child = goto[0][code]
+            if child != -1:
+                delta[code] = child
+                queue.append(child)
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + [ entry for entry in outputs[fail[state]] if entry not in outputs[state] ]
+            for code in range(4):
+                child = goto[state][code]
+                if child != -1:
+                    fail[child] = delta[fail[state]*5+code]
+                    delta[state*5+code] = child
+                    queue.append(child)
+                else:
+                    delta[state*5+code] = delta[fail[state]*5+code]
+        
+        self._delta = delta
+        self._outputs = outputs
+    
+    def search(self, sequence):
+        """
+        sequence                -- str, bytes or uint8 array
+        
+        Return a numpy structured array with fields pattern_id, start, end, strand,
+        0-based [start, end) on the input sequence, sorted by end
+        """
+        import numpy as np
+        
+        delta, outputs = self._delta, self._outputs
+        hit_ends, hit_entries = [], []
+        state = 0
+        for i, code in enumerate(encode_seq(sequence).tolist()):
+            state = delta[state*5+code]
+            if outputs[state]:
+                for entry in outputs[state]:
+                    hit_ends.append(i+1)
+                    hit_entries.append(entry)
+        
+        hits = np.zeros(len(hit_ends), dtype=[('pattern_id', np.int64), ('start', np.int64), ('end', np.int64), ('strand', 'U1')])
+        if len(hit_ends) > 0:
+            entries = np.array(self.entries, dtype=[('pattern_id', np.int64), ('length', np.int64), ('strand', 'U1')])[hit_entries]
+            hits['pattern_id'] = entries['pattern_id']
+            hits['end'] = hit_ends
+            hits['start'] = hits['end'] - entries['length']
+            hits['strand'] = entries['strand']
+        return hits
+    
+    def search_batch(self, seq_list):
+        """
+        Return a list of hit arrays
+        """
+        return [ self.search(sequence) for sequence in seq_list ]
+
+def find_all_match_multi(patterns, string, iupac=False):
+    """
+    patterns           -- A list of literal sequences, or IUPAC patterns with iupac=True
+    string             -- String
+    
+    Find all position ranges and substrings of many patterns with one pass over the string
+    Return [ (pattern_id, (start, end), substring), ... ], 1-based positions like find_all_match
+    """
+    hits = AhoCorasick(patterns, iupac=iupac).search(string)
+    return [ (int(pattern_id), (int(s)+1, int(e)), string[s:e]) for pattern_id, s, e, _ in hits ]
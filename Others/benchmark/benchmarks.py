@@ -0,0 +1,260 @@
+#-*- coding:utf-8 -*-
+"""
+
+Benchmarks for the pure-Python hot paths
+
+The suites follow the asv layout (params, param_names, setup, time_*), so
+they can be collected by asv; running this file directly uses the small
+timeit-based runner at the bottom:
+
+    python Others/benchmark/benchmarks.py
+    python Others/benchmark/benchmarks.py -k Dot -o new.json --compare old.json
+
+"""
+
+import os, sys, io, shutil, tempfile, contextlib
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(os.path.dirname(_HERE))
+for _path in (_ROOT, _HERE):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+import Structure, Covariation, General, Colors
+import generators
+from generators import SIZES
+
+class DotSuite:
+    params = [SIZES]
+    param_names = ['length']
+
+    def setup(self, length):
+        self.dot = generators.random_nested_dot(length, seed=length)
+
+    def time_dot2ct(self, length):
+        Structure.dot2ct(self.dot)
+
+    def time_dot2bpmap(self, length):
+        Structure.dot2bpmap(self.dot)
+
+    def time_find_stem(self, length):
+        Structure.find_stem(self.dot)
+
+    def time_parse_structure(self, length):
+        Structure.parse_structure(self.dot)
+
+class PseudoknotSuite:
+    params = [SIZES]
+    param_names = ['length']
+
+    def setup(self, length):
+        self.dot = generators.random_pseudoknot_dot(length, seed=length)
+        self.ctList = Structure.dot2ct(self.dot)
+
+    def time_dot2ct(self, length):
+        Structure.dot2ct(self.dot)
+
+    def time_parse_pseudoknot(self, length):
+        Structure.parse_pseudoknot(self.ctList[:])
+
+    def time_ct2dot(self, length):
+        # ct2dot warns on stdout when there are more than 3 pseudoknot types
+        with contextlib.redirect_stdout(io.StringIO()):
+            Structure.ct2dot(self.ctList, length)
+
+    def time_parse_structure(self, length):
+        Structure.parse_structure(self.dot)
+
+class SHAPEScoreSuite:
+    params = [SIZES]
+    param_names = ['length']
+
+    def setup(self, length):
+        self.dot = generators.random_nested_dot(length, seed=length)
+        self.shape = generators.random_shape(self.dot, seed=length)
+        # Trimmed stem loops, as sliding_score_stemloop_shape feeds them
+        stem_loops = Structure.find_stem_loop(self.dot, max_loop_len=10, max_stem_gap=3, min_stem_len=5)
+        self.stems = [ Structure.trim_stem(self.dot, sl, min_fix_stem_len=3) for sl in stem_loops ]
+        self.stems = [ stem for stem in self.stems if stem ]
+        if not self.stems:
+            raise NotImplementedError("no stem in the synthetic structure")
+
+    def time_calcSHAPEStructureScore(self, length):
+        for stem in self.stems:
+            Structure.calcSHAPEStructureScore(self.dot, self.shape, stem)
+
+class CovariationSuite:
+    # calc_RNAalignfold compares all sequence pairs, so keep n_seqs moderate
+    params = [[10, 100, 400]]
+    param_names = ['n_seqs']
+
+    def setup(self, n_seqs):
+        dot = generators.random_nested_dot(100, seed=1)
+        alignment = generators.random_alignment(dot, n_seqs, seed=n_seqs)
+        self.columns = [ generators.alignment_columns(alignment, bp) for bp in Structure.dot2ct(dot) ]
+        self.weights = [ 1.0/(1+i%3) for i in range(n_seqs) ]
+
+    def time_calc_MI(self, n_seqs):
+        for left,right in self.columns:
+            Covariation.calc_MI(left, right)
+
+    def time_calc_MI_penalty_weighted(self, n_seqs):
+        for left,right in self.columns:
+            Covariation.calc_MI(left, right, gap_mode='penalty', weights=self.weights)
+
+    def time_calc_RNAalignfold(self, n_seqs):
+        for left,right in self.columns:
+            Covariation.calc_RNAalignfold(left, right)
+
+class ROCSuite:
+    params = [SIZES]
+    param_names = ['length']
+
+    def setup(self, length):
+        self.dot = generators.random_nested_dot(length, seed=length)
+        self.shape = generators.random_shape(self.dot, seed=length, null_frac=0.05)
+
+    def time_calc_shape_structure_ROC(self, length):
+        General.calc_shape_structure_ROC(self.dot, self.shape)
+
+class AUCSuite:
+    params = [SIZES]
+    param_names = ['length']
+
+    def setup(self, length):
+        try:
+            import sklearn
+        except ImportError:
+            raise NotImplementedError("sklearn is not installed")
+        self.dot = generators.random_nested_dot(length, seed=length)
+        self.shape = generators.random_shape(self.dot, seed=length, null_frac=0.05)
+        self.roc = General.calc_shape_structure_ROC(self.dot, self.shape)
+
+    def time_calc_AUC(self, length):
+        General.calc_AUC(self.roc)
+
+    def time_calc_AUC_v2(self, length):
+        General.calc_AUC_v2(self.dot, self.shape)
+
+class LoaderSuite:
+    params = [[10, 100, 1000]]
+    param_names = ['n_records']
+
+    def setup(self, n_records):
+        self.tmpdir = tempfile.mkdtemp(prefix="ipyrssa_bench_")
+        self.seqFn, self.shapeFn, self.ctFn = generators.make_dataset(self.tmpdir, n_records, 1000, seed=n_records)
+
+    def teardown(self, n_records):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def time_load_fasta(self, n_records):
+        General.load_fasta(self.seqFn)
+
+    def time_load_shape(self, n_records):
+        General.load_shape(self.shapeFn)
+
+    def time_load_ct(self, n_records):
+        General.load_ct(self.ctFn, load_all=True)
+
+class BrowseShapeSuite:
+    params = [SIZES]
+    param_names = ['length']
+
+    def setup(self, length):
+        self.dot = generators.random_nested_dot(length, seed=length)
+        self.seq = generators.paired_sequence(self.dot, seed=length)
+        self.shapes = [ generators.random_shape(self.dot, seed=length+i, null_frac=0.05) for i in range(3) ]
+
+    def time_browse_shape(self, length):
+        Colors.browse_shape(self.seq, self.shapes, dot=self.dot, OUT=io.StringIO(), show_auc=False)
+
+SUITES = [DotSuite, PseudoknotSuite, SHAPEScoreSuite, CovariationSuite, ROCSuite, AUCSuite, LoaderSuite, BrowseShapeSuite]
+
+############################################
+####### Standalone runner
+############################################
+
+def run_suites(pattern="", repeat=5, min_time=0.2, OUT=sys.stdout):
+    """
+    pattern             -- Only run benchmarks whose Suite.time_name contains this string
+    repeat              -- Number of timing repeats, the best one is reported
+    min_time            -- Minimum time (seconds) of each repeat; the call number is scaled up to reach it
+    OUT                 -- Output stream
+
+    Return { "Suite.time_name": {param_str: seconds_per_call} }
+    """
+    import itertools, timeit
+
+    results = {}
+    for suite in SUITES:
+        names = sorted([ name for name in dir(suite) if name.startswith('time_') ])
+        names = [ name for name in names if pattern in suite.__name__+"."+name ]
+        if not names:
+            continue
+        for param in itertools.product(*suite.params):
+            param_str = ",".join([ "%s=%s" % (k, v) for k,v in zip(suite.param_names, param) ])
+            obj = suite()
+            try:
+                obj.setup(*param)
+            except NotImplementedError as e:
+                for name in names:
+                    OUT.writelines("%-50s %-18s skipped: %s\n" % (suite.__name__+"."+name, param_str, e))
+                continue
+            try:
+                for name in names:
+                    func = getattr(obj, name)
+                    timer = timeit.Timer(lambda: func(*param))
+                    number = 1
+                    while timer.timeit(number) < min_time and number < 1000000:
+                        number *= 10
+                    best = min(timer.repeat(repeat=repeat, number=number)) / number
+                    key = suite.__name__+"."+name
+                    results.setdefault(key, {})[param_str] = best
+                    OUT.writelines("%-50s %-18s %12.3f us\n" % (key, param_str, best*1e6))
+            finally:
+                if hasattr(obj, 'teardown'):
+                    obj.teardown(*param)
+    return results
+
+def compare_results(old, new, threshold=1.2, OUT=sys.stdout):
+    """
+    old, new            -- Results returned by run_suites (or loaded from JSON)
+    threshold           -- Ratio above which a benchmark is flagged as a regression
+    OUT                 -- Output stream
+
+    Return the number of regressions
+    """
+    regressions = 0
+    for key in sorted(new):
+        for param_str in new[key]:
+            if param_str not in old.get(key, {}):
+                continue
+            ratio = new[key][param_str] / old[key][param_str]
+            flag = "  REGRESSION" if ratio > threshold else ""
+            if ratio > threshold:
+                regressions += 1
+            OUT.writelines("%-50s %-18s %7.2fx%s\n" % (key, param_str, ratio, flag))
+    return regressions
+
+def main():
+    import argparse, json
+
+    parser = argparse.ArgumentParser(description="Run the IPyRSSA benchmark suite without asv")
+    parser.add_argument('-k', dest='pattern', default="", help="Only run benchmarks matching this substring")
+    parser.add_argument('-r', dest='repeat', type=int, default=5, help="Number of repeats [5]")
+    parser.add_argument('-o', dest='output', default=None, help="Save results to this JSON file")
+    parser.add_argument('--compare', default=None, help="Compare with a JSON file saved by -o")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio reported as regression [1.2]")
+    args = parser.parse_args()
+
+    results = run_suites(args.pattern, repeat=args.repeat)
+    if args.output:
+        json.dump(results, open(args.output, 'w'), indent=1)
+    if args.compare:
+        old = json.load(open(args.compare))
+        sys.stdout.writelines("\n")
+        if compare_results(old, results, threshold=args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
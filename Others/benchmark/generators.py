@@ -0,0 +1,242 @@
+#-*- coding:utf-8 -*-
+"""
+
+Seeded synthetic data generators for the benchmark suite
+
+Every generator takes a seed, so the same size and seed always produce the
+same sequence, structure, SHAPE track or alignment.
+
+"""
+
+import os, random
+
+SIZES = [100, 1000, 5000]
+
+def _rng(seed):
+    return seed if isinstance(seed, random.Random) else random.Random(seed)
+
+def random_sequence(length, seed=0, alphabet='ACGU', gc=None):
+    """
+    length              -- Sequence length
+    seed                -- Random seed or random.Random object
+    alphabet            -- Bases to draw from
+    gc                  -- GC fraction, only used when alphabet is ACGU/ACGT. Default: uniform
+
+    Return a random sequence
+    """
+    rng = _rng(seed)
+    if gc is None:
+        return "".join([ rng.choice(alphabet) for i in range(length) ])
+    at = alphabet.replace('G','').replace('C','')
+    weights = [ gc/2.0 if b in 'GC' else (1.0-gc)/len(at) for b in alphabet ]
+    return "".join(rng.choices(alphabet, weights=weights, k=length))
+
+def random_nested_dot(length, seed=0, pair_prob=0.6, min_loop=3, stem_len=(3, 9)):
+    """
+    length              -- Structure length
+    seed                -- Random seed or random.Random object
+    pair_prob           -- Probability to open a stem at each free position
+    min_loop            -- Minimum hairpin loop length
+    stem_len            -- (min, max) stem length
+
+    Return a valid nested dot-bracket structure with stems, bulges, interior loops and multiloops
+    """
+    rng = _rng(seed)
+    dot = ['.']*length
+    # Intervals [i, j] still to be filled; iterative to handle long structures
+    stack = [ (0, length-1) ]
+    while stack:
+        i, j = stack.pop()
+        while j-i+1 >= 2*stem_len[0]+min_loop:
+            if rng.random() > pair_prob:
+                i += rng.randint(1, 4)
+                continue
+            max_stem = min(stem_len[1], (j-i+1-min_loop)//2)
+            slen = rng.randint(stem_len[0], max_stem)
+            # Right end of the outer pair, so that the helix and a minimum loop fit
+            min_right = i+2*slen+min_loop-1
+            right = rng.randint(min_right, min(j, min_right+rng.choice([0, 10, 40, 200])))
+            for k in range(slen):
+                dot[i+k] = '('
+                dot[right-k] = ')'
+            stack.append( (i+slen, right-slen) )
+            i = right+1+rng.randint(0, 3)
+    return "".join(dot)
+
+def random_pseudoknot_dot(length, seed=0, n_knots=None, knot_len=(3, 7), **kwargs):
+    """
+    length              -- Structure length
+    seed                -- Random seed or random.Random object
+    n_knots             -- Number of pseudoknot helices. Default: one per 200 nt (at least 1)
+    knot_len            -- (min, max) pseudoknot helix length
+    kwargs              -- Passed to random_nested_dot
+
+    Return a valid dot-bracket structure whose pseudoknot helices use []
+    """
+    rng = _rng(seed)
+    dot = list(random_nested_dot(length, rng, **kwargs))
+    if n_knots is None:
+        n_knots = max(1, length//200)
+
+    knots = []
+    for trial in range(n_knots*20):
+        if len(knots) >= n_knots:
+            break
+        klen = rng.randint(knot_len[0], knot_len[1])
+        if length < 2*klen+6:
+            break
+        ls = rng.randint(0, length-2*klen-4)
+        rs = rng.randint(ls+klen+3, length-klen)
+        le, re = ls+klen-1, rs+klen-1
+        if any(dot[k]!='.' for k in list(range(ls,le+1))+list(range(rs,re+1))):
+            continue
+        # Keep [] helices nested with each other
+        if any(a<ls<b<rs or ls<a<rs<b for a,b in knots):
+            continue
+        for k in range(klen):
+            dot[ls+k] = '['
+            dot[re-k] = ']'
+        knots.append( (ls, rs) )
+    return "".join(dot)
+
+def paired_sequence(dot, seed=0, gu_prob=0.1):
+    """
+    dot                 -- Dot-bracket structure
+    seed                -- Random seed or random.Random object
+    gu_prob             -- Probability of a GU pair
+
+    Return a sequence whose paired positions form canonical or GU pairs
+    """
+    import Structure
+    rng = _rng(seed)
+    seq = list(random_sequence(len(dot), rng))
+    for l, r in Structure.dot2ct(dot):
+        pair = rng.choice(['GU','UG']) if rng.random()<gu_prob else rng.choice(['AU','UA','GC','CG'])
+        seq[l-1], seq[r-1] = pair[0], pair[1]
+    return "".join(seq)
+
+def random_shape(dot, seed=0, null_frac=0.0, null_head=0):
+    """
+    dot                 -- Dot-bracket structure
+    seed                -- Random seed or random.Random object
+    null_frac           -- Fraction of positions set to NULL at random
+    null_head           -- Number of leading positions set to NULL
+
+    Return a SHAPE track as a list of strings, like General.load_shape; paired bases get lower scores
+    """
+    rng = _rng(seed)
+    shape = []
+    for i,symbol in enumerate(dot):
+        if i < null_head or (null_frac and rng.random() < null_frac):
+            shape.append('NULL')
+        elif symbol == '.':
+            shape.append( "%.3f" % rng.betavariate(2, 2) )
+        else:
+            shape.append( "%.3f" % rng.betavariate(1, 5) )
+    return shape
+
+def random_alignment(dot, n_seqs, seed=0, mutation_rate=0.3, gap_rate=0.05):
+    """
+    dot                 -- Dot-bracket structure of the consensus
+    n_seqs              -- Number of aligned sequences
+    seed                -- Random seed or random.Random object
+    mutation_rate       -- Probability to mutate each base/pair in each sequence
+    gap_rate            -- Probability of a gap at each position
+
+    Return a list of aligned sequences; paired columns mostly covary
+    """
+    import Structure
+    rng = _rng(seed)
+    root = list(paired_sequence(dot, rng))
+    ctList = Structure.dot2ct(dot)
+    paired = set([ l for l,r in ctList ]+[ r for l,r in ctList ])
+    pairs = ['AU','UA','GC','CG','GU','UG']
+
+    alignment = []
+    for s in range(n_seqs):
+        seq = root[:]
+        for i in range(len(seq)):
+            if i+1 not in paired and rng.random() < mutation_rate:
+                seq[i] = rng.choice('ACGU')
+        for l,r in ctList:
+            if rng.random() < mutation_rate:
+                # Mostly compensatory changes, a few broken pairs
+                pair = rng.choice(pairs) if rng.random() < 0.9 else rng.choice('ACGU')+rng.choice('ACGU')
+                seq[l-1], seq[r-1] = pair[0], pair[1]
+        for i in range(len(seq)):
+            if rng.random() < gap_rate:
+                seq[i] = '-'
+        alignment.append("".join(seq))
+    return alignment
+
+def alignment_columns(alignment, bp):
+    """
+    alignment           -- A list of aligned sequences
+    bp                  -- (left, right), 1-based
+
+    Return left_align_bases, right_align_bases for Covariation.calc_MI/calc_RNAalignfold
+    """
+    left = [ seq[bp[0]-1] for seq in alignment ]
+    right = [ seq[bp[1]-1] for seq in alignment ]
+    return left, right
+
+def write_fasta(Fasta, seqFn, linelen=60):
+    """
+    Fasta               -- {tid: seq}
+    seqFn               -- Output file
+    linelen             -- Bases per line
+    """
+    with open(seqFn, 'w') as OUT:
+        for tid,seq in Fasta.items():
+            OUT.writelines(">%s\n" % (tid, ))
+            for i in range(0, len(seq), linelen):
+                OUT.writelines(seq[i:i+linelen]+"\n")
+
+def write_shape(Shape, shapeFn):
+    """
+    Shape               -- {tid: shape_list}
+    shapeFn             -- Output file in icSHAPE .out format
+    """
+    with open(shapeFn, 'w') as OUT:
+        for tid,shape_list in Shape.items():
+            OUT.writelines("%s\t%d\t%.4f\t%s\n" % (tid, len(shape_list), 10.0, "\t".join(shape_list)))
+
+def write_ct(Structure_dict, ctFn):
+    """
+    Structure_dict      -- {tid: (seq, dot)}
+    ctFn                -- Output ct file, one record per transcript
+    """
+    import Structure
+    with open(ctFn, 'w') as OUT:
+        for tid,(seq,dot) in Structure_dict.items():
+            bpmap = Structure.dot2bpmap(dot)
+            Len = len(seq)
+            OUT.writelines("%5d  ENERGY = 0.0  %s\n" % (Len, tid))
+            for i in range(1, Len+1):
+                OUT.writelines("%5d %s %7d %4d %4d %4d\n" % (i, seq[i-1], i-1, i+1 if i<Len else 0, bpmap.get(i, 0), i))
+
+def make_dataset(dirname, n_records, length, seed=0):
+    """
+    dirname             -- Output directory
+    n_records           -- Number of transcripts
+    length              -- Length of each transcript
+    seed                -- Random seed
+
+    Write bench.fa, bench.out and bench.ct into dirname
+    Return (seqFn, shapeFn, ctFn)
+    """
+    rng = _rng(seed)
+    Fasta, Shape, Struct = {}, {}, {}
+    for i in range(n_records):
+        dot = random_nested_dot(length, rng)
+        tid = "T%06d.1" % (i+1, )
+        Fasta[tid] = paired_sequence(dot, rng)
+        Shape[tid] = random_shape(dot, rng, null_frac=0.05, null_head=min(30, length//10))
+        Struct[tid] = (Fasta[tid], dot)
+    seqFn = os.path.join(dirname, "bench.fa")
+    shapeFn = os.path.join(dirname, "bench.out")
+    ctFn = os.path.join(dirname, "bench.ct")
+    write_fasta(Fasta, seqFn)
+    write_shape(Shape, shapeFn)
+    write_ct(Struct, ctFn)
+    return seqFn, shapeFn, ctFn
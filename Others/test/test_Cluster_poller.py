@@ -0,0 +1,106 @@
+#########
+#########   Test JOB_POLLER/wait_jobs/iter_finished_jobs with a fake bjobs
+#########
+#########   python test_Cluster_poller.py  (or collect it with pytest)
+#########
+
+import os, sys, tempfile, shutil, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+import Cluster
+
+### Status of each job at the n-th bjobs call; the last one is kept afterwards
+TIMELINE = {
+    101: ['PEND', 'RUN', 'DONE'],
+    102: ['PEND', 'PEND', 'RUN', 'RUN', 'EXIT'],
+    103: ['RUN', 'DONE'],
+}
+
+FAKE_BJOBS = r'''#!%(python)s
+import sys, os, json, fcntl
+counterFn = %(counter)r
+timeline = json.loads(%(timeline)r)
+# Several threads may call bjobs at the same time
+with open(counterFn, 'a+') as handle:
+    fcntl.flock(handle, fcntl.LOCK_EX)
+    handle.seek(0)
+    n = int(handle.read() or 0)
+    handle.seek(0)
+    handle.truncate()
+    handle.write(str(n+1))
+print("JOBID   USER    STAT  QUEUE      FROM_HOST   EXEC_HOST   JOB_NAME   SUBMIT_TIME")
+for job_id in sys.argv[1:]:
+    if job_id.startswith('-'): continue
+    states = timeline.get(job_id)
+    if states is None:
+        print("Job <%%s> is not found" %% job_id)
+        continue
+    print("%%s  test  %%s  Z-ZQF  login  node01  job%%s  Jan 1 00:00" %% (job_id, states[min(n, len(states)-1)], job_id))
+'''
+
+def make_fake_bjobs(tmpdir):
+    import json
+    counterFn = os.path.join(tmpdir, "counter")
+    bjobsFn = os.path.join(tmpdir, "bjobs")
+    timeline = json.dumps({ str(k): v for k,v in TIMELINE.items() })
+    open(bjobsFn, 'w').write(FAKE_BJOBS % {'python': sys.executable, 'counter': counterFn, 'timeline': timeline})
+    os.chmod(bjobsFn, 0o755)
+    return bjobsFn, counterFn
+
+def bjobs_calls(counterFn):
+    return int(open(counterFn).read())
+
+def test_query_job_status():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bjobsFn, counterFn = make_fake_bjobs(tmpdir)
+        status = Cluster.query_job_status([101, 102, 999], bjobs_exec=bjobsFn)
+        assert status == {101: 'PEND', 102: 'PEND', 999: 'Not_Found'}
+        assert bjobs_calls(counterFn) == 1
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_iter_finished_jobs():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bjobsFn, counterFn = make_fake_bjobs(tmpdir)
+        poller = Cluster.JOB_POLLER(interval=0.01, max_interval=0.05, bjobs_exec=bjobsFn)
+        order = list(Cluster.iter_finished_jobs([102, 101, 103], poller=poller))
+        # 103 is DONE at the 2nd call, 101 at the 3rd, 102 is EXIT at the 5th
+        assert order == [103, 101, 102]
+        assert poller.get_status(101) == 'DONE'
+        assert poller.get_status(102) == 'EXIT'
+        # One bjobs call per round, finished jobs are not queried again
+        assert bjobs_calls(counterFn) == 5
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_wait_jobs_from_threads():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bjobsFn, counterFn = make_fake_bjobs(tmpdir)
+        poller = Cluster.JOB_POLLER(interval=0.01, max_interval=0.05, bjobs_exec=bjobsFn)
+        errors = []
+        def waiter(jobs):
+            try:
+                Cluster.wait_jobs(jobs, poller=poller)
+            except Exception as e:
+                errors.append(e)
+        threads = [ threading.Thread(target=waiter, args=(jobs,)) for jobs in ([101], [102], [101, 103]) ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join(30)
+        assert not errors
+        assert not any([ thread.is_alive() for thread in threads ])
+        assert poller.status == {101: 'DONE', 102: 'EXIT', 103: 'DONE'}
+        # The per-call interval does not change the poller
+        poller.wait([101], interval=5)
+        assert poller.interval == 0.01
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    for name,func in list(globals().items()):
+        if name.startswith('test_'):
+            func()
+            print(name, "ok")
@@ -0,0 +1,109 @@
+#########
+#########   Test seqClass.fetch_many with an in-memory genome
+#########
+#########   python test_Seq_fetch_many.py  (or collect it with pytest)
+#########
+
+import os, sys, random, time, types, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+try:
+    import Seq
+except ImportError:
+    Seq = None
+
+class StubGenome(object):
+    """
+    The part of pysam.Fastafile used by seqClass, backed by strings
+    """
+    def __init__(self, chroms):
+        self.chroms = chroms
+        self.references = list(chroms)
+        self.lengths = [ len(chroms[chrID]) for chrID in self.references ]
+        self.calls = 0
+
+    def fetch(self, chrID, start, end):
+        self.calls += 1
+        return self.chroms[chrID][start:end]
+
+def make_seqer(chroms, **kwargs):
+    if Seq is None:
+        raise unittest.SkipTest("Seq cannot be imported (pyliftover is missing)")
+    genome = StubGenome(chroms)
+    stub = types.ModuleType("pysam")
+    stub.Fastafile = lambda seqFn: genome
+    old = sys.modules.get('pysam')
+    sys.modules['pysam'] = stub
+    try:
+        seqer = Seq.seqClass("stub.fa", **kwargs)
+    finally:
+        if old is None:
+            del sys.modules['pysam']
+        else:
+            sys.modules['pysam'] = old
+    return seqer, genome
+
+def random_chroms(n_chrom, length, seed=0):
+    rng = random.Random(seed)
+    return { f"chr{i+1}": "".join(rng.choices("ACGTacgtN", k=length)) for i in range(n_chrom) }
+
+def random_intervals(chroms, n, max_len=200, seed=0):
+    rng = random.Random(seed)
+    names = sorted(chroms)
+    intervals = []
+    for i in range(n):
+        chrID = rng.choice(names)
+        start = rng.randint(0, len(chroms[chrID])-max_len)
+        intervals.append( (chrID, start, start+rng.randint(0, max_len), rng.choice('+-')) )
+    return intervals
+
+def test_fetch_many_matches_fetch():
+    chroms = random_chroms(3, 200000)
+    seqer, genome = make_seqer(chroms, cache_bytes=50000)
+    intervals = random_intervals(chroms, 2000, seed=1)
+    for merge_gap in (0, 1000, 100000):
+        for output in ('str', 'bytes', 'memoryview'):
+            result = seqer.fetch_many(intervals, merge_gap=merge_gap, max_chunk=20000, output=output)
+            expect = [ seqer.fetch(*interval) for interval in intervals ]
+            assert [ bytes(subseq).decode() if output != 'str' else subseq for subseq in result ] == expect
+    # Fetched again from the cache, which never exceeds its size
+    genome.calls = 0
+    seqer.fetch_many(intervals[:50], merge_gap=0)
+    assert seqer._cached_bytes <= seqer.cache_bytes
+    assert seqer._cached_bytes == sum([ len(chunk) for chunk in seqer._chunk_cache.values() ])
+
+def test_cache_covers_sub_chunks():
+    chroms = random_chroms(1, 100000)
+    seqer, genome = make_seqer(chroms)
+    seqer.fetch_many([ ('chr1', 1000, 2000), ('chr1', 5000, 6000) ], merge_gap=10000)
+    calls = genome.calls
+    # Inside the cached chunk [1000, 6000)
+    assert seqer.fetch_many([ ('chr1', 1500, 1600), ('chr1', 3000, 5500, '-') ], merge_gap=0) == \
+        [ chroms['chr1'][1500:1600], Seq.reverse_comp(chroms['chr1'][3000:5500]) ]
+    assert genome.calls == calls
+    # A bigger chunk replaces the chunks it contains
+    seqer.fetch_many([ ('chr1', 0, 10) , ('chr1', 9000, 9010) ], merge_gap=10000)
+    assert list(seqer._chunk_cache) == [ ('chr1', 0, 9010) ]
+
+def test_fetch_many_scales_linearly():
+    chroms = random_chroms(4, 2000000)
+    def run(n):
+        seqer, genome = make_seqer(chroms)
+        intervals = random_intervals(chroms, n, max_len=50, seed=n)
+        start = time.time()
+        seqer.fetch_many(intervals, merge_gap=0)
+        return time.time() - start
+    run(1000)
+    small, large = min([ run(2000) for i in range(3) ]), min([ run(16000) for i in range(3) ])
+    # 8x more sparse intervals, a cache scan per chunk would be ~64x
+    assert large < small * 24, (small, large)
+
+if __name__ == '__main__':
+    for name,func in list(globals().items()):
+        if name.startswith('test_'):
+            try:
+                func()
+                print(name, "ok")
+            except unittest.SkipTest as e:
+                print(name, "skipped:", e)
@@ -17,19 +17,12 @@ import sys
 
 def reverse_comp(sequence):
     """
-    sequence                -- Raw input sequence
+    sequence                -- Raw input sequence, str or bytes
     
     Return the reverse complimentary sequence
     """
-    RC_Map = {'A':'T', 'C':'G', 'T':'A', 'G':'C', 'N':'N',
-               'a':'t', 'c':'g', 't':'a', 'g':'c', '-':'-'}
-    
-    rc_seq = []
-    for i in range(len(sequence)-1, -1, -1):
-        rc_seq.append( RC_Map[ sequence[i] ] )
-    rc_seq = ''.join(rc_seq)
-    
-    return rc_seq
+    import General
+    return General.reverse_comp(sequence)
 
 def flat_seq(sequence, lineLen=60):
     """
@@ -38,15 +31,8 @@ def flat_seq(sequence, lineLen=60):
     
     Flat raw long sequence to multiple lines
     """
-    flatted_seq = ''
-    sequence = sequence.strip()
-    
-    idx = 0
-    while idx < len(sequence):
-        flatted_seq += sequence[idx:idx+lineLen]+'\n'
-        idx += lineLen
-    
-    return flatted_seq[:-1]
+    import General
+    return General.flat_seq(sequence, lineLen)
 
 def format_gene_type(gene_type):
     """
@@ -72,10 +58,19 @@ def format_gene_type(gene_type):
     return 'other'
 
 class seqClass(object):
-    def __init__(self, seqFn):
+    def __init__(self, seqFn, cache_bytes=256*1024*1024):
+        """
+        seqFn           -- Indexed genome fasta file
+        cache_bytes     -- Maximum bytes of chromosome chunks kept by fetch_many (LRU)
+        """
         import pysam
+        import collections
         
         self.genome = pysam.Fastafile(seqFn)
+        self.cache_bytes = cache_bytes
+        self._chunk_cache = collections.OrderedDict()
+        self._chunk_index = {}
+        self._cached_bytes = 0
         sys.stdout.writelines("seqClass: input 0-based coordinate -- [start, end)\n")
     
     def fetch(self, chrID, chrStart, chrEnd, chrStrand="+"):
@@ -91,6 +86,111 @@ class seqClass(object):
         if chrStrand == '-':
             return reverse_comp(self.genome.fetch(chrID, chrStart, chrEnd))
     
+    def _fetch_chunk(self, chrID, chunkStart, chunkEnd):
+        """
+        Return (chunk_start, chunk_bytes) covering [chunkStart, chunkEnd), read from the LRU cache if possible
+        
+        No cached chunk contains another one, so the cached chunks of a chromosome are sorted by both 
+        start and end, and only the last chunk starting before chunkStart can cover the interval
+        """
+        import bisect
+        
+        starts, ends = self._chunk_index.get(chrID, ([], []))
+        idx = bisect.bisect_right(starts, chunkStart) - 1
+        if idx >= 0 and chunkEnd <= ends[idx]:
+            key = (chrID, starts[idx], ends[idx])
+            self._chunk_cache.move_to_end(key)
+            return starts[idx], self._chunk_cache[key]
+        
+        chunk = self.genome.fetch(chrID, chunkStart, chunkEnd).encode()
+        if len(chunk) <= self.cache_bytes:
+            starts, ends = self._chunk_index.setdefault(chrID, ([], []))
+            # Cached chunks inside the new one are redundant
+            idx = bisect.bisect_left(starts, chunkStart)
+            while idx < len(starts) and ends[idx] <= chunkEnd:
+                self.__drop_chunk((chrID, starts[idx], ends[idx]))
+            starts.insert(idx, chunkStart)
+            ends.insert(idx, chunkEnd)
+            self._chunk_cache[(chrID, chunkStart, chunkEnd)] = chunk
+            self._cached_bytes += len(chunk)
+            while self._cached_bytes > self.cache_bytes:
+                self.__drop_chunk(next(iter(self._chunk_cache)))
+        return chunkStart, chunk
+    
+    def __drop_chunk(self, key):
+        import bisect
+        
+        chrID, chunkStart, chunkEnd = key
+        self._cached_bytes -= len(self._chunk_cache.pop(key))
+        starts, ends = self._chunk_index[chrID]
+        idx = bisect.bisect_left(starts, chunkStart)
+        del starts[idx]
+        del ends[idx]
+    
+    def clear_cache(self):
+        self._chunk_cache.clear()
+        self._chunk_index.clear()
+        self._cached_bytes = 0
+    
+    def fetch_many(self, intervals, merge_gap=10000, max_chunk=10000000, output='str'):
+        """
+        intervals       -- [ (chrID, chrStart, chrEnd, chrStrand), ... ], strand is optional (default +)
+        merge_gap       -- Intervals closer than merge_gap are read in the same chunk
+        max_chunk       -- Maximum length of a merged chunk
+        output          -- str, bytes or memoryview. memoryview gives zero-copy slices for + strand intervals
+        
+        Intervals are sorted by chromosome and position and merged into chunks, each chunk 
+        is read once (or taken from the LRU chunk cache) and all - strand sequences are 
+        reverse complemented in one pass
+        
+        Return a list of sequences in the input order
+        """
+        import General
+        
+        if output not in ('str', 'bytes', 'memoryview'):
+            raise RuntimeError("Error: output must be str, bytes or memoryview")
+        
+        intervals = [ tuple(interval) for interval in intervals ]
+        order = sorted(range(len(intervals)), key=lambda i: (intervals[i][0], intervals[i][1], intervals[i][2]))
+        results = [None] * len(intervals)
+        
+        ### Group sorted intervals into chunks
+        chunks = []
+        for i in order:
+            chrID, chrStart, chrEnd = intervals[i][:3]
+            if chrStart > chrEnd:
+                raise RuntimeError(f"Error: {chrID}:{chrStart}-{chrEnd} start > end")
+            if chunks and chunks[-1][0] == chrID and chrStart <= chunks[-1][2] + merge_gap and max(chrEnd, chunks[-1][2]) - chunks[-1][1] <= max_chunk:
+                chunks[-1][2] = max(chunks[-1][2], chrEnd)
+                chunks[-1][3].append(i)
+            else:
+                chunks.append([chrID, chrStart, chrEnd, [i]])
+        
+        minus = []
+        for chrID, chunkStart, chunkEnd, members in chunks:
+            c_start, chunk = self._fetch_chunk(chrID, chunkStart, chunkEnd)
+            view = memoryview(chunk)
+            for i in members:
+                chrStart, chrEnd = intervals[i][1:3]
+                results[i] = view[chrStart-c_start:chrEnd-c_start]
+                strand = intervals[i][3] if len(intervals[i]) > 3 else '+'
+                if strand == '-':
+                    minus.append(i)
+                elif strand != '+':
+                    raise RuntimeError(f"Error: unknown strand {strand}")
+        
+        ### Reverse complement all - strand sequences at once
+        if minus:
+            joined = General.reverse_comp(b"\n".join([ results[i] for i in minus ]))
+            for i, subseq in zip(reversed(minus), joined.split(b"\n")):
+                results[i] = subseq
+        
+        if output == 'str':
+            return [ bytes(subseq).decode() for subseq in results ]
+        if output == 'bytes':
+            return [ bytes(subseq) for subseq in results ]
+        return [ memoryview(subseq) for subseq in results ]
+    
     def has(self, chrID):
         return chrID in self.genome.references
     
@@ -160,6 +260,180 @@ def lift_genome(lifter, chrID, chrStart, chrEnd, chrStrand, verbose=False):
     
     return (s_chrID, s_chrPos, e_chrPos, s_chrStrand)
 
+LIFT_OK = 0
+LIFT_NO_CHROM = 1
+LIFT_NO_MAP = 2
+LIFT_DIFF_START_END = 3
+LIFT_CHANGED = 4
+LIFT_REASONS = {
+    LIFT_OK: 'success',
+    LIFT_NO_CHROM: 'chromosome not found',
+    LIFT_NO_MAP: 'not appropriate map position',
+    LIFT_DIFF_START_END: 'different start/end chromosome or strand',
+    LIFT_CHANGED: 'chromosome or strand changed'
+}
+
+class chainLiftClass(object):
+    def __init__(self, chainFn):
+        """
+        chainFn         -- Local UCSC chain file (.chain or .chain.gz), e.g. hg19ToHg38.over.chain.gz
+        
+        Load the chain blocks into sorted per-chromosome numpy arrays. Where chains overlap,
+        the highest scoring chain wins, the same choice lift_genome makes with pyliftover
+        """
+        import numpy as np
+        import gzip
+        
+        opener = gzip.open if chainFn.endswith('.gz') else open
+        
+        block_src = {}
+        chain_info = [] # (score, target_chr, target_strand, target_size)
+        with opener(chainFn, 'rt') as IN:
+            blocks = None
+            for line in IN:
+                data = line.split()
+                if len(data) == 0:
+                    continue
+                if data[0] == 'chain':
+                    score = float(data[1])
+                    src_chr, src_start = data[2], int(data[5])
+                    tgt_chr, tgt_size, tgt_strand, tgt_start = data[7], int(data[8]), data[9], int(data[10])
+                    chain_id = len(chain_info)
+                    chain_info.append((score, tgt_chr, tgt_strand, tgt_size))
+                    blocks = block_src.setdefault(src_chr, [])
+                    continue
+                size = int(data[0])
+                blocks.append((src_start, src_start+size, tgt_start, chain_id))
+                if len(data) == 3:
+                    src_start += size + int(data[1])
+                    tgt_start += size + int(data[2])
+        
+        self.chain_score = np.array([ info[0] for info in chain_info ], dtype=np.float64)
+        self.chain_chr = np.array([ info[1] for info in chain_info ], dtype=str)
+        self.chain_strand = np.array([ info[2] for info in chain_info ], dtype=str)
+        self.chain_size = np.array([ info[3] for info in chain_info ], dtype=np.int64)
+        
+        self.blocks = {}
+        for src_chr, blocks in block_src.items():
+            blocks = np.array(blocks, dtype=np.int64).reshape(-1, 4)
+            self.blocks[src_chr] = self.__flatten_blocks(blocks, self.chain_score)
+    
+    @staticmethod
+    def __flatten_blocks(blocks, chain_score):
+        """
+        Split overlapping blocks into disjoint segments, each one keeps the block of the best chain
+        
+        Return (seg_start, seg_end, src_start, tgt_start, chain_id), sorted by seg_start
+        """
+        import numpy as np
+        
+        bounds = np.unique(np.concatenate([blocks[:,0], blocks[:,1]]))
+        lo = np.searchsorted(bounds, blocks[:,0])
+        hi = np.searchsorted(bounds, blocks[:,1])
+        counts = hi - lo
+        block_idx = np.repeat(np.arange(len(blocks)), counts)
+        offsets = np.arange(len(block_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+        seg_idx = lo[block_idx] + offsets
+        
+        ### Best score first, then the earlier chain in the file
+        order = np.lexsort((block_idx, -chain_score[blocks[block_idx,3]], seg_idx))
+        seg_idx, block_idx = seg_idx[order], block_idx[order]
+        first = np.ones(len(seg_idx), dtype=bool)
+        first[1:] = seg_idx[1:] != seg_idx[:-1]
+        seg_idx, block_idx = seg_idx[first], block_idx[first]
+        
+        return bounds[seg_idx], bounds[seg_idx+1], blocks[block_idx,0], blocks[block_idx,2], blocks[block_idx,3]
+    
+    def convert_positions(self, chrID, positions, strand='+'):
+        """
+        chrID           -- Chromosome ID
+        positions       -- Array of 0-based positions
+        strand          -- + or -, a single strand or an array
+        
+        Return (found, chrIDs, positions, strands), found is False when no block covers the position
+        """
+        import numpy as np
+        
+        positions = np.asarray(positions, dtype=np.int64)
+        n = len(positions)
+        if chrID not in self.blocks:
+            return np.zeros(n, dtype=bool), np.full(n, '', dtype=self.chain_chr.dtype), np.full(n, -1, dtype=np.int64), np.full(n, '', dtype='<U1')
+        
+        seg_start, seg_end, src_start, tgt_start, chain_id = self.blocks[chrID]
+        idx = np.searchsorted(seg_start, positions, side='right') - 1
+        found = idx >= 0
+        found[found] = positions[found] < seg_end[idx[found]]
+        idx = np.where(found, idx, 0)
+        
+        cid = chain_id[idx]
+        new_pos = tgt_start[idx] + positions - src_start[idx]
+        minus = self.chain_strand[cid] == '-'
+        new_pos = np.where(minus, self.chain_size[cid] - 1 - new_pos, new_pos)
+        query_minus = np.broadcast_to(np.asarray(strand) == '-', (n,))
+        new_strand = np.where(minus != query_minus, '-', '+')
+        
+        new_chr = np.where(found, self.chain_chr[cid], '')
+        new_pos = np.where(found, new_pos, -1)
+        new_strand = np.where(found, new_strand, '')
+        return found, new_chr, new_pos, new_strand
+
+def lift_genome_bulk(lifter, chrIDs, chrStarts, chrEnds, chrStrands, verbose=False):
+    """
+    lifter          -- An object of Seq.chainLiftClass
+    chrIDs          -- Array of chromosome IDs
+    chrStarts       -- Array of chromosome start positions
+    chrEnds         -- Array of chromosome end positions
+    chrStrands      -- Array of + or -
+    verbose         -- Show a summary of failure reasons
+    
+    Convert many genome intervals at once with the same rules as lift_genome
+    
+    Return (chrIDs, chrStarts, chrEnds, chrStrands, reasons)
+    Failed intervals get -1/'' and a reason code in Seq.LIFT_REASONS
+    """
+    import numpy as np
+    
+    chrIDs = np.asarray(chrIDs, dtype=str)
+    chrStarts = np.asarray(chrStarts, dtype=np.int64)
+    chrEnds = np.asarray(chrEnds, dtype=np.int64)
+    chrStrands = np.broadcast_to(np.asarray(chrStrands, dtype=str), chrIDs.shape)
+    n = len(chrIDs)
+    
+    out_chr = np.full(n, '', dtype=lifter.chain_chr.dtype if n else str)
+    out_start = np.full(n, -1, dtype=np.int64)
+    out_end = np.full(n, -1, dtype=np.int64)
+    out_strand = np.full(n, '', dtype='<U1')
+    reasons = np.full(n, LIFT_OK, dtype=np.int8)
+    
+    uniq_chr, inverse = np.unique(chrIDs, return_inverse=True)
+    for i, chrID in enumerate(uniq_chr):
+        rows = np.nonzero(inverse == i)[0]
+        if chrID not in lifter.blocks:
+            reasons[rows] = LIFT_NO_CHROM
+            continue
+        strands = chrStrands[rows]
+        s_found, s_chr, s_pos, s_strand = lifter.convert_positions(chrID, chrStarts[rows], strands)
+        e_found, e_chr, e_pos, e_strand = lifter.convert_positions(chrID, chrEnds[rows], strands)
+        
+        reason = np.full(len(rows), LIFT_OK, dtype=np.int8)
+        reason[ (s_chr != chrID) | (s_strand != strands) ] = LIFT_CHANGED
+        reason[ (s_chr != e_chr) | (s_strand != e_strand) ] = LIFT_DIFF_START_END
+        reason[ ~(s_found & e_found) ] = LIFT_NO_MAP
+        reasons[rows] = reason
+        
+        ok = reason == LIFT_OK
+        out_chr[rows[ok]] = s_chr[ok]
+        out_start[rows[ok]] = s_pos[ok]
+        out_end[rows[ok]] = e_pos[ok]
+        out_strand[rows[ok]] = s_strand[ok]
+    
+    if verbose:
+        for code, count in zip(*np.unique(reasons, return_counts=True)):
+            if code != LIFT_OK:
+                sys.stderr.writelines("Warning: %s intervals cannot convert -- %s\n" % (count, LIFT_REASONS[code]))
+    
+    return out_chr, out_start, out_end, out_strand, reasons
+
 def search_subseq_from_genome(Seqer, chrID, start, end, strand, pattern, caller='first', check=False):
     """
     Parameters:
@@ -198,8 +472,8 @@ def search_subseq_from_genome(Seqer, chrID, start, end, strand, pattern, caller=
     if check:
         if len(hits)>0:
             print(f"Check {chrID}:{start}-{end}({strand}) {pattern}")
-        for hit in hits:
-            new_subseq = Seqer.fetch(chrID, hit[0], hit[1], strand)
+        new_subseqs = Seqer.fetch_many([ (chrID, hit[0], hit[1], strand) for hit in hits ])
+        for new_subseq in new_subseqs:
             pass_ = not (re.match(pattern, new_subseq) is None)
             print(f"{new_subseq} pass {pass_}")
     
@@ -207,3 +481,50 @@ def search_subseq_from_genome(Seqer, chrID, start, end, strand, pattern, caller=
         hits = hits[0]
     
     return hits
+
+def search_patterns_from_genome(Seqer, intervals, patterns, iupac=False, both_strands=False):
+    """
+    Parameters:
+        Seqer: Object of Seq.seqClass()
+        intervals: [ (chrID, start, end, strand), ... ], [start, end)
+        patterns: A list of literal sequences, or an object of General.AhoCorasick
+        iupac: Expand IUPAC codes in patterns
+        both_strands: Also report the pattern hits on the other strand of each region
+    Return:
+        A numpy structured array with fields region, pattern_id, start, end, strand.
+        region is the index in intervals, start/end are genome positions [start, end)
+        and strand is the genome strand of the hit
+    
+    All patterns are searched in one pass over each region, the regions are fetched with Seqer.fetch_many
+    """
+    import numpy as np
+    import General
+    
+    if isinstance(patterns, General.AhoCorasick):
+        searcher = patterns
+    else:
+        searcher = General.AhoCorasick(patterns, iupac=iupac, both_strands=both_strands)
+    
+    intervals = [ tuple(interval) for interval in intervals ]
+    hit_list = []
+    for region, subseq in enumerate(Seqer.fetch_many(intervals, output='memoryview')):
+        chrID, start, end, strand = intervals[region]
+        hits = searcher.search(subseq)
+        if len(hits) == 0:
+            continue
+        genome_hits = np.zeros(len(hits), dtype=[('region', np.int64), ('pattern_id', np.int64), ('start', np.int64), ('end', np.int64), ('strand', 'U1')])
+        genome_hits['region'] = region
+        genome_hits['pattern_id'] = hits['pattern_id']
+        if strand == '+':
+            genome_hits['start'] = start + hits['start']
+            genome_hits['end'] = start + hits['end']
+            genome_hits['strand'] = hits['strand']
+        else:
+            genome_hits['start'] = end - hits['end']
+            genome_hits['end'] = end - hits['start']
+            genome_hits['strand'] = np.where(hits['strand'] == '+', '-', '+')
+        hit_list.append(genome_hits)
+    
+    if len(hit_list) == 0:
+        return np.zeros(0, dtype=[('region', np.int64), ('pattern_id', np.int64), ('start', np.int64), ('end', np.int64), ('strand', 'U1')])
+    return np.concatenate(hit_list)
@@ -1,11 +1,6 @@
 #-*- coding:utf-8 -*-
 
-import os, sys, subprocess, random, time, re, Colors
-
-if 'getstatusoutput' in dir(subprocess):
-    from subprocess import getstatusoutput
-else:
-    from commands import getstatusoutput
+import os, sys, time, re, Colors
 
 ############################################
 #######    Internal function
@@ -79,6 +74,23 @@ def __build_single_dot_file(sequence, dot, outFn, title='test_seq'):
     assert len(sequence) == len(dot)
     open(outFn, 'w').writelines(">%s\n%s\n%s\n\n" % (title, sequence, dot))
 
+def __ct2dot_text(ctFn, number):
+    """
+    ctFn                    -- .ct file
+    number                  -- The structure id
+    
+    Return the ct2dot output of a structure, read from stdout
+    """
+    import General
+    ct2dot = General.require_exec("ct2dot")
+    return General.run_tool([ct2dot, ctFn, number, "/dev/stdout"], capture=True).stdout.strip()
+
+def __count_ct_structures(ctFn):
+    """
+    Return the number of structures in a .ct file
+    """
+    return sum([ 1 for line in open(ctFn) if "ENERGY" in line ])
+
 ############################################
 #######    Structure prediction
 ############################################
@@ -100,69 +112,52 @@ def predict_structure(sequence, shape_list=[], bp_constraint=[], mfe=True, clean
     Require: Fold or Fold-smp, ct2dot
     """
     import General
-    import shutil
-    
-    Fold = General.require_exec("Fold-smp", exception=False)
-    if not Fold:
-        Fold = General.require_exec("Fold")
-    
-    ct2dot = General.require_exec("ct2dot")
-    
-    randID = random.randint(1000000,9000000)
-    
-    ROOT = "/tmp/predict_structure_%s/" % (randID, )
-    os.mkdir(ROOT)
-    fa_file = ROOT + "input.fa"
-    shape_file = ROOT + "input.shape"
-    constrain_file = ROOT + "input.const"
-    ct_file = ROOT + "output.ct"
     
-    Fold_CMD = Fold + " %s %s -si %s -sm %s" % (fa_file, ct_file, si, sm)
+    Fold = General.require_exec("Fold", prefer_smp=True)
     
-    __build_single_seq_fasta(sequence, fa_file)
-    
-    if shape_list:
-        assert len(sequence) == len(shape_list)
-        __build_SHAPE_constraint(shape_list, shape_file)
-        Fold_CMD += " --SHAPE " + shape_file
-    
-    if bp_constraint:
-        __build_bp_constraint(bp_constraint, constrain_file)
-        Fold_CMD += " --constraint " + constrain_file
-    
-    if mfe:
-        Fold_CMD += " -mfe"
-    
-    if md:
-        Fold_CMD += " --maxdistance " + str(md)
-    
-    Fold_CMD += ' > /dev/null'
-    
-    if verbose: 
-        print(Fold_CMD)
-    
-    os.system(Fold_CMD)
-    
-    ct2dot_cmd = ct2dot + " %s %d /dev/stdout"
-    
-    if not mfe:
-        return_code, return_string = getstatusoutput( "grep \"ENERGY\" %s | wc -l" % (ct_file, ) )
-        structure_number = int( return_string.strip() )
-        structure_list = []
-        regex_cap_free_energy = re.compile("=\s*(\-+[\d\.]+)")
-        for idx in range(structure_number):
-            return_code, return_string = getstatusoutput( ct2dot_cmd % (ct_file, idx+1) )
-            energy = float(regex_cap_free_energy.findall(return_string.split('\n')[0])[0])
+    with General.scratch_dir("predict_structure_", clean=clean) as ROOT:
+        fa_file = os.path.join(ROOT, "input.fa")
+        shape_file = os.path.join(ROOT, "input.shape")
+        constrain_file = os.path.join(ROOT, "input.const")
+        ct_file = os.path.join(ROOT, "output.ct")
+        
+        Fold_CMD = [ Fold, fa_file, ct_file, "-si", si, "-sm", sm ]
+        
+        __build_single_seq_fasta(sequence, fa_file)
+        
+        if shape_list:
+            assert len(sequence) == len(shape_list)
+            __build_SHAPE_constraint(shape_list, shape_file)
+            Fold_CMD += [ "--SHAPE", shape_file ]
+        
+        if bp_constraint:
+            __build_bp_constraint(bp_constraint, constrain_file)
+            Fold_CMD += [ "--constraint", constrain_file ]
+        
+        if mfe:
+            Fold_CMD += [ "-mfe" ]
+        
+        if md:
+            Fold_CMD += [ "--maxdistance", md ]
+        
+        if verbose: 
+            print(General.format_command(Fold_CMD))
+        
+        General.run_tool(Fold_CMD)
+        
+        if not mfe:
+            structure_number = __count_ct_structures(ct_file)
+            structure_list = []
+            regex_cap_free_energy = re.compile("=\s*(\-+[\d\.]+)")
+            for idx in range(structure_number):
+                return_string = __ct2dot_text(ct_file, idx+1)
+                energy = float(regex_cap_free_energy.findall(return_string.split('\n')[0])[0])
+                structure = return_string.split('\n')[2]
+                structure_list.append( (energy, structure) )
+        else:
+            return_string = __ct2dot_text(ct_file, 1)
             structure = return_string.split('\n')[2]
-            structure_list.append( (energy, structure) )
-    else:
-        return_code, return_string = getstatusoutput( ct2dot_cmd % (ct_file, 1) )
-        structure = return_string.split('\n')[2]
-        structure_list = structure
-    
-    # clean
-    if clean:
-        shutil.rmtree(ROOT)
+            structure_list = structure
     
     return structure_list
 
@@ -180,57 +175,43 @@ def bi_fold(seq_1, seq_2, local_pairing=False, mfe=True, clean=True, is_dna=Fals
     Require: bifold or bifold-smp, ct2dot
     """
     import General
-    import shutil
-    
-    bifold = General.require_exec("bifold-smp", exception=False)
-    if not bifold:
-        bifold = General.require_exec("bifold")
-    
-    ct2dot = General.require_exec("ct2dot")
     
-    randID = random.randint(1000000,9000000)
-    ROOT = "/tmp/bi_fold_%s/" % (randID, )
-    os.mkdir(ROOT)
-    seq_1_fn = ROOT + "input_1.fa"
-    seq_2_fn = ROOT + "input_2.fa"
-    ct_fn = ROOT + "output.ct"
+    bifold = General.require_exec("bifold", prefer_smp=True)
     
-    __build_single_seq_fasta(seq_1, seq_1_fn)
-    __build_single_seq_fasta(seq_2, seq_2_fn)
-    
-    CMD = bifold + " %s %s %s" % (seq_1_fn, seq_2_fn, ct_fn)
-    
-    if not local_pairing:
-        CMD += " --intramolecular"
-    
-    if is_dna:
-        CMD += " --DNA"
-    
-    CMD += " > /dev/null"
-    
-    if verbose:
-        print(CMD)
-    
-    os.system(CMD)
-    
-    return_code, return_string = getstatusoutput( "grep ENERGY %s | wc -l" % (ct_fn, ) )
-    structure_number = int( return_string.strip() )
-    structure_list = []
-    ct2dot_cmd = ct2dot + " %s %d /dev/stdout"
-    
-    for idx in range(structure_number):
-        if mfe and idx == 1:
-            break
-        return_code, return_string = getstatusoutput( ct2dot_cmd % (ct_fn, idx+1) )
-        lines = return_string.split('\n')
-        energy = float(lines[0].strip().split()[-2])
-        structure = return_string.split()[8]
-        structure_list.append( (energy, lines[2]) )
-    
-    cur_seq = seq_1 + "III" + seq_2
-    
-    if clean:
-        shutil.rmtree(ROOT)
+    with General.scratch_dir("bi_fold_", clean=clean) as ROOT:
+        seq_1_fn = os.path.join(ROOT, "input_1.fa")
+        seq_2_fn = os.path.join(ROOT, "input_2.fa")
+        ct_fn = os.path.join(ROOT, "output.ct")
+        
+        __build_single_seq_fasta(seq_1, seq_1_fn)
+        __build_single_seq_fasta(seq_2, seq_2_fn)
+        
+        CMD = [ bifold, seq_1_fn, seq_2_fn, ct_fn ]
+        
+        if not local_pairing:
+            CMD += [ "--intramolecular" ]
+        
+        if is_dna:
+            CMD += [ "--DNA" ]
+        
+        if verbose:
+            print(General.format_command(CMD))
+        
+        General.run_tool(CMD)
+        
+        structure_number = __count_ct_structures(ct_fn)
+        structure_list = []
+        
+        for idx in range(structure_number):
+            if mfe and idx == 1:
+                break
+            return_string = __ct2dot_text(ct_fn, idx+1)
+            lines = return_string.split('\n')
+            energy = float(lines[0].strip().split()[-2])
+            structure = return_string.split()[8]
+            structure_list.append( (energy, lines[2]) )
+        
+        cur_seq = seq_1 + "III" + seq_2
     
     if mfe:
         return structure_list[0][1]
@@ -359,54 +340,43 @@ def dyalign(seq_1, seq_2, shape_list_1=[], shape_list_2=[], clean=True, thread_n
         assert len(seq_2) == len(shape_list_2)
     
     import General
-    import random, os, sys
-    import shutil
-
-    dynalign = General.require_exec("dynalign_ii-smp", exception=False)
-    if not dynalign:
-        dynalign = General.require_exec("dynalign_ii")
-    
-    randID = random.randint(1000000,9000000)
-    ROOT = "/tmp/dyalign_%s/" % (randID, )
-    os.mkdir(ROOT)
-    fa_file = ROOT + "input.fa"
-    afa_file = ROOT + "output.afa"
-    
-    conf_file = ROOT + "configure.conf"
-    seq1_file = ROOT + "seq_1.seq"
-    seq2_file = ROOT + "seq_2.seq"
-    shape1_file = ROOT + "shape_1.shape"
-    shape2_file = ROOT + "shape_2.shape"
-    ct1_file = ROOT + "ct_1.ct"
-    ct2_file = ROOT + "ct_2.ct"
-    align_file = ROOT + "align.txt"
-    
-    CONF = get_a_dyalign_conf_model() % (seq1_file, seq2_file, ct1_file, ct2_file, align_file, thread_nums)
-    
-    __build_single_seq_file(seq_1, seq1_file)
-    __build_single_seq_file(seq_2, seq2_file)
-    if shape_list_1:
-        __build_SHAPE_constraint(shape_list_1, hape1_file)
-        CONF += "\nshape_1_file = "+hape1_file
-    if shape_list_2:
-        __build_SHAPE_constraint(shape_list_2, shape2_file)
-        CONF += "\nshape_2_file = "+shape2_file
-    
-    open(conf_file, 'w').writelines(CONF+"\n")
-    
-    CMD = dynalign + " " + conf_file + " > /dev/null"
-    if verbose:
-        print(CMD)
-    os.system(CMD)
-    
-    dot_1 = dot_from_ctFile(ct1_file, number=1)[1]
-    dot_2 = dot_from_ctFile(ct2_file, number=1)[1]
-    align_seq_1, align_seq_2 = read_DYA_alignment(align_file)
-    align_dot_1 = dot_to_alignDot(dot_1, align_seq_1)
-    align_dot_2 = dot_to_alignDot(dot_2, align_seq_2)
-    
-    if clean:
-        shutil.rmtree(ROOT)
+    import os, sys
+
+    dynalign = General.require_exec("dynalign_ii", prefer_smp=True)
+    
+    with General.scratch_dir("dyalign_", clean=clean) as ROOT:
+        conf_file = os.path.join(ROOT, "configure.conf")
+        seq1_file = os.path.join(ROOT, "seq_1.seq")
+        seq2_file = os.path.join(ROOT, "seq_2.seq")
+        shape1_file = os.path.join(ROOT, "shape_1.shape")
+        shape2_file = os.path.join(ROOT, "shape_2.shape")
+        ct1_file = os.path.join(ROOT, "ct_1.ct")
+        ct2_file = os.path.join(ROOT, "ct_2.ct")
+        align_file = os.path.join(ROOT, "align.txt")
+        
+        CONF = get_a_dyalign_conf_model() % (seq1_file, seq2_file, ct1_file, ct2_file, align_file, thread_nums)
+        
+        __build_single_seq_file(seq_1, seq1_file)
+        __build_single_seq_file(seq_2, seq2_file)
+        if shape_list_1:
+            __build_SHAPE_constraint(shape_list_1, shape1_file)
+            CONF += "\nshape_1_file = "+shape1_file
+        if shape_list_2:
+            __build_SHAPE_constraint(shape_list_2, shape2_file)
+            CONF += "\nshape_2_file = "+shape2_file
+        
+        open(conf_file, 'w').writelines(CONF+"\n")
+        
+        CMD = [ dynalign, conf_file ]
+        if verbose:
+            print(General.format_command(CMD))
+        General.run_tool(CMD)
+        
+        dot_1 = dot_from_ctFile(ct1_file, number=1)[1]
+        dot_2 = dot_from_ctFile(ct2_file, number=1)[1]
+        align_seq_1, align_seq_2 = read_DYA_alignment(align_file)
+        align_dot_1 = dot_to_alignDot(dot_1, align_seq_1)
+        align_dot_2 = dot_to_alignDot(dot_2, align_seq_2)
     
     return (dot_1, dot_2, align_seq_1, align_seq_2, align_dot_1, align_dot_2)
 
@@ -468,67 +438,56 @@ def multialign(seq_list, shape_list_list=[], si=-0.6, sm=1.8, thread_nums=1, cle
         assert len(shape_list_list[i]) == len(seq_list[i])
 
     import General
-    import random, os, sys
-    import shutil
-    
-    multilign = General.require_exec("multilign-smp", exception=False)
-    if not multilign:
-        multilign = General.require_exec("multilign")
+    import os, sys
     
-    randID = random.randint(1000000,9000000)
-    ROOT = "/tmp/multialign_%s/" % (randID, )
-    os.mkdir(ROOT)
-    fa_file = ROOT + "input.fa"
-    afa_file = ROOT + "output.afa"
+    multilign = General.require_exec("multilign", prefer_smp=True)
     
-    conf_file = ROOT + "configure.conf"
-    align_file = ROOT + "align.txt"
-    
-    seq_files = ""
-    ct_files = ""
-    for i in range(len(seq_list)):
-        seq_files += ROOT+"seq_%s.seq;" % (i, )
-        ct_files += ROOT+"structure_%s.ct;" % (i, )
-    
-    CONF = get_a_multialign_conf_model() % (seq_files, ct_files, align_file, len(seq_list), si, sm, thread_nums)
-    
-    shape_files = ""
-    for i in range(len(shape_list_list)):
-        shapeF = ROOT+"shape_%s.shape" % (i, )
-        shape_files += shapeF + ";"
-        CONF += "\nSHAPE%s = %s" % (i, shapeF)
-    
-    seq_file_list = seq_files.strip(";").split(";")
-    ct_file_list = ct_files.strip(";").split(";")
-    shape_file_list = shape_files.strip(';').split(';')
-    
-    for i,seq_file in enumerate(seq_file_list):
-        __build_single_seq_file(seq_list[i].upper(), seq_file)
-    
-    for i,shape_file in enumerate(shape_file_list):
-        if shape_file:
-            __build_SHAPE_constraint(shape_list_list[i], shape_file)
-    
-    open(conf_file, 'w').writelines(CONF+"\n")
-    
-    CMD = multilign + " "+conf_file + " > /dev/null"
-    if verbose:
-        print(CMD)
-    os.system(CMD)
-    
-    dot_list = []
-    for i,ct_file in enumerate(ct_file_list):
-        dot = dot_from_ctFile(ct_file, number=1)[1]
-        dot_list.append(dot)
-    
-    aligned_seq_list = read_MULTI_alignment(align_file)
-    align_dot_list = []
-    for seq, dot, align_seq in zip(seq_list, dot_list, aligned_seq_list):
-        aligned_dot = dot_to_alignDot(dot, align_seq)
-        align_dot_list.append(aligned_dot)
-    
-    if clean:
-        shutil.rmtree(ROOT) 
+    with General.scratch_dir("multialign_", clean=clean) as ROOT:
+        conf_file = os.path.join(ROOT, "configure.conf")
+        align_file = os.path.join(ROOT, "align.txt")
+        
+        seq_files = ""
+        ct_files = ""
+        for i in range(len(seq_list)):
+            seq_files += os.path.join(ROOT, "seq_%s.seq;" % (i, ))
+            ct_files += os.path.join(ROOT, "structure_%s.ct;" % (i, ))
+        
+        CONF = get_a_multialign_conf_model() % (seq_files, ct_files, align_file, len(seq_list), si, sm, thread_nums)
+        
+        shape_files = ""
+        for i in range(len(shape_list_list)):
+            shapeF = os.path.join(ROOT, "shape_%s.shape" % (i, ))
+            shape_files += shapeF + ";"
+            CONF += "\nSHAPE%s = %s" % (i, shapeF)
+        
+        seq_file_list = seq_files.strip(";").split(";")
+        ct_file_list = ct_files.strip(";").split(";")
+        shape_file_list = shape_files.strip(';').split(';')
+        
+        for i,seq_file in enumerate(seq_file_list):
+            __build_single_seq_file(seq_list[i].upper(), seq_file)
+        
+        for i,shape_file in enumerate(shape_file_list):
+            if shape_file:
+                __build_SHAPE_constraint(shape_list_list[i], shape_file)
+        
+        open(conf_file, 'w').writelines(CONF+"\n")
+        
+        CMD = [ multilign, conf_file ]
+        if verbose:
+            print(General.format_command(CMD))
+        General.run_tool(CMD)
+        
+        dot_list = []
+        for i,ct_file in enumerate(ct_file_list):
+            dot = dot_from_ctFile(ct_file, number=1)[1]
+            dot_list.append(dot)
+        
+        aligned_seq_list = read_MULTI_alignment(align_file)
+        align_dot_list = []
+        for seq, dot, align_seq in zip(seq_list, dot_list, aligned_seq_list):
+            aligned_dot = dot_to_alignDot(dot, align_seq)
+            align_dot_list.append(aligned_dot)
     
     return dot_list, aligned_seq_list, align_dot_list
 
@@ -548,49 +507,37 @@ def estimate_energy(sequence, dot, shape_list=[], simple=True, si=-0.6, sm=1.8,
     Require: efn2 or efn2-smp
     """
     import General
-    import shutil
     
     assert len(sequence) == len(dot)
     
-    efn2 = General.require_exec("efn2-smp", exception=False)
-    if not efn2:
-        efn2 = General.require_exec("efn2")
-    
-    randID = random.randint(1000000,9000000)
-    
-    ROOT = "/tmp/estimate_energy_%s/" % (randID, )
-    os.mkdir(ROOT)
-    shape_file = ROOT + "input.shape"
-    energy_file = ROOT + "energy.txt"
-    ct_file = ROOT + "input.ct"
-    
-    efn2_CMD = efn2 + " %s %s -si %s -sm %s" % (ct_file, energy_file, si, sm)
-    
-    write_ctFn({"test": sequence}, {"test": dot}, ct_file)
-    
-    if shape_list:
-        assert len(sequence) == len(shape_list)
-        __build_SHAPE_constraint(shape_list, shape_file)
-        efn2_CMD += " --SHAPE " + shape_file
-    
-    if simple:
-        efn2_CMD += " --simple"
-    
-    if is_dna:
-        efn2_CMD += " --DNA"
-    
-    efn2_CMD += ' > /dev/null'
-    
-    if verbose: 
-        print(efn2_CMD)
-    
-    os.system(efn2_CMD)
-    
-    energy = float(open(energy_file).readline().strip().split()[-1])
+    efn2 = General.require_exec("efn2", prefer_smp=True)
     
-    # clean
-    if clean:
-        shutil.rmtree(ROOT)
+    with General.scratch_dir("estimate_energy_", clean=clean) as ROOT:
+        shape_file = os.path.join(ROOT, "input.shape")
+        energy_file = os.path.join(ROOT, "energy.txt")
+        ct_file = os.path.join(ROOT, "input.ct")
+        
+        efn2_CMD = [ efn2, ct_file, energy_file, "-si", si, "-sm", sm ]
+        
+        write_ctFn({"test": sequence}, {"test": dot}, ct_file)
+        
+        if shape_list:
+            assert len(sequence) == len(shape_list)
+            __build_SHAPE_constraint(shape_list, shape_file)
+            efn2_CMD += [ "--SHAPE", shape_file ]
+        
+        if simple:
+            efn2_CMD += [ "--simple" ]
+        
+        if is_dna:
+            efn2_CMD += [ "--DNA" ]
+        
+        if verbose: 
+            print(General.format_command(efn2_CMD))
+        
+        General.run_tool(efn2_CMD)
+        
+        energy = float(open(energy_file).readline().strip().split()[-1])
     
     return energy
 
@@ -615,64 +562,55 @@ def partition(sequence, shape_list=[], bp_constraint=[], clean=True, si=-0.6, sm
     Require: partition or partition-smp, ProbabilityPlot
     """
     import General
-    import shutil
+    import shutil, tempfile
     
-    partition = General.require_exec("partition-smp", exception=False)
-    if not partition:
-        partition = General.require_exec("partition")
+    partition = General.require_exec("partition", prefer_smp=True)
     
     ProbabilityPlot = General.require_exec("ProbabilityPlot")
     
-    randID = random.randint(1000000,9000000)
-    
-    ROOT = "/tmp/partition_%s/" % (randID, )
-    os.mkdir(ROOT)
-    fa_file = ROOT + "input.fa"
-    shape_file = ROOT + "input.shape"
-    constrain_file = ROOT + "input.const"
-    pfs_file = ROOT + "output.pfs"
-    pairingProb_file = ROOT + "pairingprob.txt"
-    
-    partition_CMD = partition + " %s %s -si %s -sm %s" % (fa_file, pfs_file, si, sm)
-    
-    __build_single_seq_fasta(sequence, fa_file)
-    
-    if shape_list:
-        assert len(sequence) == len(shape_list)
-        __build_SHAPE_constraint(shape_list, shape_file)
-        partition_CMD += " --SHAPE " + shape_file
-    
-    if bp_constraint:
-        __build_bp_constraint(bp_constraint, constrain_file)
-        partition_CMD += " --constraint " + constrain_file
-    
-    if md:
-        partition_CMD += " --maxdistance " + str(md)
-    
-    partition_CMD += ' -q > /dev/null'
-    
-    if verbose: 
-        print(partition_CMD)
-    
-    os.system(partition_CMD)
-    
-    ProbabilityPlot_cmd = ProbabilityPlot + " %s %s -t > /dev/null" % (pfs_file, pairingProb_file)
-    os.system(ProbabilityPlot_cmd)
-    
-    pairingProb = []
-    for lc,line in enumerate(open(pairingProb_file)):
-        if lc>1:
-            nc1,nc2,log10Prob = line.strip().split()
-            pairingProb.append( (int(nc1),int(nc2),10**(-float(log10Prob))) )
-    
-    if return_pfs:
-        new_pfs = os.path.join("/tmp/", f"{randID}.pfs")
-        pfs_file = ROOT + "output.pfs"
-        shutil.copyfile(pfs_file, new_pfs)
-    
-    # clean
-    if clean:
-        shutil.rmtree(ROOT)
+    with General.scratch_dir("partition_", clean=clean) as ROOT:
+        fa_file = os.path.join(ROOT, "input.fa")
+        shape_file = os.path.join(ROOT, "input.shape")
+        constrain_file = os.path.join(ROOT, "input.const")
+        pfs_file = os.path.join(ROOT, "output.pfs")
+        pairingProb_file = os.path.join(ROOT, "pairingprob.txt")
+        
+        partition_CMD = [ partition, fa_file, pfs_file, "-si", si, "-sm", sm ]
+        
+        __build_single_seq_fasta(sequence, fa_file)
+        
+        if shape_list:
+            assert len(sequence) == len(shape_list)
+            __build_SHAPE_constraint(shape_list, shape_file)
+            partition_CMD += [ "--SHAPE", shape_file ]
+        
+        if bp_constraint:
+            __build_bp_constraint(bp_constraint, constrain_file)
+            partition_CMD += [ "--constraint", constrain_file ]
+        
+        if md:
+            partition_CMD += [ "--maxdistance", md ]
+        
+        partition_CMD += [ "-q" ]
+        
+        if verbose: 
+            print(General.format_command(partition_CMD))
+        
+        General.run_tool(partition_CMD)
+        
+        ProbabilityPlot_cmd = [ ProbabilityPlot, pfs_file, pairingProb_file, "-t" ]
+        General.run_tool(ProbabilityPlot_cmd)
+        
+        pairingProb = []
+        for lc,line in enumerate(open(pairingProb_file)):
+            if lc>1:
+                nc1,nc2,log10Prob = line.strip().split()
+                pairingProb.append( (int(nc1),int(nc2),10**(-float(log10Prob))) )
+        
+        if return_pfs:
+            handle, new_pfs = tempfile.mkstemp(suffix=".pfs", prefix="partition_")
+            os.close(handle)
+            shutil.copyfile(pfs_file, new_pfs)
     
     if return_pfs:
         return pairingProb, new_pfs
@@ -697,15 +635,10 @@ def maxExpect(input_pfs_file=None, input_sequence=None, percent=50, structures=1
     verbose                 -- Print command
     delete_pfs              -- Delete the pfs file after finished
     """
-    import tempfile
-    import shutil
     import General
     
     MaxExpect = General.require_exec("MaxExpect", exception=False)
     
-    randID = random.randint(1000000,9000000)
-    temproot = os.path.join(tempfile.gettempdir(), "MaxExpect_"+str(randID))
-    
     if input_pfs_file is None and input_sequence is None:
         print( Colors.f("Error: input_pfs_file or input_sequence should be specified", fc='red') )
         return -1
@@ -713,40 +646,35 @@ def maxExpect(input_pfs_file=None, input_sequence=None, percent=50, structures=1
         print( Colors.f("Error: input_pfs_file and input_sequence cannot be specified together", fc='red') )
         return -1
     
-    os.mkdir(temproot)
-    fa_file = os.path.join(temproot, "input.fa")
-    ct_file = os.path.join(temproot, "output.ct")
-    
-    if input_pfs_file is None:
-        __build_single_seq_fasta(input_sequence, fa_file)
-        input_file = fa_file
-    else:
-        input_file = input_pfs_file
-        if not os.path.exists(input_file):
-            print( Colors.f("Error: input_pfs_file does not exist", fc='red') )
-            shutil.rmtree(temproot)
-            return -1
-    
-    maxexpect_CMD = MaxExpect + " %s %s --percent %s --structures %s --window %s" % (input_file, ct_file, percent, structures, window)
-    if input_pfs_file is None:
-        maxexpect_CMD += " --sequence"
-    maxexpect_CMD += ' > /dev/null'
-    
-    if verbose: 
-        print(maxexpect_CMD)
-    os.system(maxexpect_CMD)
-    
-    dict_content = General.load_ct(ct_file, load_all=True)
-    if len(dict_content)>0:
-        Len = len(dict_content[1][0])
-        ct_list = [ dict_content[key][1] for key in dict_content ]
-        dot_list = [ ct2dot(ct, Len) for ct in ct_list ]
-    else:
-        dot_list = []
+    if input_pfs_file is not None and not os.path.exists(input_pfs_file):
+        print( Colors.f("Error: input_pfs_file does not exist", fc='red') )
+        return -1
     
-    # clean
-    if clean:
-        shutil.rmtree(temproot)
+    with General.scratch_dir("MaxExpect_", clean=clean) as temproot:
+        fa_file = os.path.join(temproot, "input.fa")
+        ct_file = os.path.join(temproot, "output.ct")
+        
+        if input_pfs_file is None:
+            __build_single_seq_fasta(input_sequence, fa_file)
+            input_file = fa_file
+        else:
+            input_file = input_pfs_file
+        
+        maxexpect_CMD = [ MaxExpect, input_file, ct_file, "--percent", percent, "--structures", structures, "--window", window ]
+        if input_pfs_file is None:
+            maxexpect_CMD += [ "--sequence" ]
+        
+        if verbose: 
+            print(General.format_command(maxexpect_CMD))
+        General.run_tool(maxexpect_CMD)
+        
+        dict_content = General.load_ct(ct_file, load_all=True)
+        if len(dict_content)>0:
+            Len = len(dict_content[1][0])
+            ct_list = [ dict_content[key][1] for key in dict_content ]
+            dot_list = [ ct2dot(ct, Len) for ct in ct_list ]
+        else:
+            dot_list = []
     
     if delete_pfs and input_pfs_file is not None:
         os.remove(input_pfs_file)
@@ -815,43 +743,41 @@ def calc_structure_similarity(seqdot1, seqdot2, pm=10, pd=-5, bm=1, br=0, bd=-10
             Int if mode='distance' or 'similarity'
             [aligned_seq1, aligned_seq2], [aligned_dot1, aligned_dot2] if mode='fasta'
     """
-    import tempfile, General, os
+    import General, os, io
     RNAforester = General.require_exec("RNAforester", exception=True)
     
     if mode not in ('score','distance','similarity','fasta'):
         raise RuntimeError("mode should be one of score,distance,similarity,fasta")
     
-    randName = "RNAforester_" + str(random.randint(1000000,9000000))
-    input_dot_fn = os.path.join(tempfile.tempdir, randName+".dot")
-    output_fn = os.path.join(tempfile.tempdir, randName+".out")
-    
-    General.write_dot({'input1': seqdot1, 'input2': seqdot2}, input_dot_fn)
-    
-    cmd = f"RNAforester -f {input_dot_fn} -pm={pm} -pd={pd} -bm={bm} -br={br} -bd={bd} "
-    if mode != 'fasta':
-        cmd += '--score '
-        if mode == 'score':
-            cmd += '-r '
-        elif mode == 'distance':
-            cmd += '-d '
-        elif mode == 'similarity':
-            pass
-    else:
-        cmd += '--fasta '
-    
-    cmd += f"> {output_fn}"
-    if verbose:
-        print(cmd)
-    
-    os.system(cmd)
+    with General.scratch_dir("RNAforester_") as ROOT:
+        input_dot_fn = os.path.join(ROOT, "input.dot")
+        
+        General.write_dot({'input1': seqdot1, 'input2': seqdot2}, input_dot_fn)
+        
+        cmd = [ RNAforester, "-f", input_dot_fn, f"-pm={pm}", f"-pd={pd}", f"-bm={bm}", f"-br={br}", f"-bd={bd}" ]
+        if mode != 'fasta':
+            cmd += [ '--score' ]
+            if mode == 'score':
+                cmd += [ '-r' ]
+            elif mode == 'distance':
+                cmd += [ '-d' ]
+            elif mode == 'similarity':
+                pass
+        else:
+            cmd += [ '--fasta' ]
+        
+        if verbose:
+            print(General.format_command(cmd))
+        
+        output = General.run_tool(cmd, capture=True, cwd=ROOT).stdout
     
     return_value = None
     if mode == 'score':
-        return_value = float(open(output_fn).readlines()[1].strip())
+        return_value = float(output.splitlines()[1].strip())
     elif mode == 'distance' or mode == 'similarity':
-        return_value = float(open(output_fn).readlines()[0].strip())
+        return_value = float(output.splitlines()[0].strip())
     else:
-        IN = open(output_fn)
+        IN = io.StringIO(output)
         line = IN.readline()
         while line:
             if line.startswith('input1'):
@@ -862,8 +788,6 @@ def calc_structure_similarity(seqdot1, seqdot2, pm=10, pd=-5, bm=1, br=0, bd=-10
                 break
             line = IN.readline()
     
-    os.remove(input_dot_fn)
-    os.remove(output_fn)
     return return_value
 
 ############################################
@@ -1128,12 +1052,7 @@ def dot_from_ctFile(ctFn, number=1):
 
     Require: ct2dot
     """
-    import General
-    ct2dot = General.require_exec("ct2dot")
-    
-    CMD = ct2dot + " %s %s /dev/stdout" % (ctFn, number)
-    return_code, information = getstatusoutput(CMD)
-    return information.strip().split('\n')[1:3]
+    return __ct2dot_text(ctFn, number).split('\n')[1:3]
 
 def read_DYA_alignment(inFn):
     """
@@ -1600,36 +1519,30 @@ def multi_alignment(seq_list, clean=True, verbose=False):
     Require: muscle
     """
     import General
-    import random, os, sys
-    import shutil
+    import os, sys
     
     muscle = General.require_exec("muscle")
     
-    randID = random.randint(1000000,9000000)
-    ROOT = "/tmp/multi_alignment_%s/" % (randID, )
-    os.mkdir(ROOT)
-    fa_file = ROOT + "input.fa"
-    afa_file = ROOT + "output.afa"
-    
-    OUT = open(fa_file, 'w')
-    for i, sequence in enumerate(seq_list):
-        OUT.writelines(">seq_%s\n%s\n" % (i+1, sequence))
-    OUT.close()
-    
-    CMD = muscle+" -in %s -out %s" % (fa_file, afa_file)
-    if verbose:
-        print(CMD)
-    else:
-        CMD += " -quiet"
-    os.system(CMD)
-    
-    aligned_list = []
-    afa = General.load_fasta(afa_file)
-    for i in range(1, len(seq_list)+1):
-        aligned_list.append( afa["seq_"+str(i)] )
-    
-    if clean:
-        shutil.rmtree(ROOT)
+    with General.scratch_dir("multi_alignment_", clean=clean) as ROOT:
+        fa_file = os.path.join(ROOT, "input.fa")
+        afa_file = os.path.join(ROOT, "output.afa")
+        
+        OUT = open(fa_file, 'w')
+        for i, sequence in enumerate(seq_list):
+            OUT.writelines(">seq_%s\n%s\n" % (i+1, sequence))
+        OUT.close()
+        
+        CMD = [ muscle, "-in", fa_file, "-out", afa_file ]
+        if verbose:
+            print(General.format_command(CMD))
+        else:
+            CMD += [ "-quiet" ]
+        General.run_tool(CMD, verbose=verbose)
+        
+        aligned_list = []
+        afa = General.load_fasta(afa_file)
+        for i in range(1, len(seq_list)+1):
+            aligned_list.append( afa["seq_"+str(i)] )
     
     return aligned_list
 
@@ -1644,36 +1557,30 @@ def kalign_alignment(seq_list, clean=True, verbose=False):
     Require kalign
     """
     import General
-    import random, os, sys
-    import shutil
+    import os, sys
     
     kalign = General.require_exec("kalign")
     
-    randID = random.randint(1000000,9000000)
-    ROOT = "/tmp/kalign_alignment_%s/" % (randID, )
-    os.mkdir(ROOT)
-    fa_file = ROOT + "input.fa"
-    afa_file = ROOT + "output.afa"
+    with General.scratch_dir("kalign_alignment_", clean=clean) as ROOT:
+        fa_file = os.path.join(ROOT, "input.fa")
+        afa_file = os.path.join(ROOT, "output.afa")
+            
+        OUT = open(fa_file, 'w')
+        for i, sequence in enumerate(seq_list):
+            OUT.writelines(">seq_%s\n%s\n" % (i+1, sequence))
+        OUT.close()
         
-    OUT = open(fa_file, 'w')
-    for i, sequence in enumerate(seq_list):
-        OUT.writelines(">seq_%s\n%s\n" % (i+1, sequence))
-    OUT.close()
-    
-    CMD = kalign + " -in %s -out %s -format fasta" % (fa_file, afa_file)
-    if verbose: 
-        print(CMD)
-    else:
-        CMD += " -quiet"
-    os.system(CMD)
-    
-    aligned_list = []
-    afa = General.load_fasta(afa_file)
-    for i in range(1, len(seq_list)+1):
-        aligned_list.append( afa["seq_"+str(i)] )
-    
-    if clean:
-        shutil.rmtree(ROOT)
+        CMD = [ kalign, "-in", fa_file, "-out", afa_file, "-format", "fasta" ]
+        if verbose: 
+            print(General.format_command(CMD))
+        else:
+            CMD += [ "-quiet" ]
+        General.run_tool(CMD, verbose=verbose)
+        
+        aligned_list = []
+        afa = General.load_fasta(afa_file)
+        for i in range(1, len(seq_list)+1):
+            aligned_list.append( afa["seq_"+str(i)] )
     
     return aligned_list
 
@@ -1682,49 +1589,61 @@ def __split_cigar_forGS(cigar_code):
     cigar_code          -- Cigar code
     
     Split cigar for global_search
+    Return [ (Len, code), ... ]
     """
     import re, sys
     
-    cigar_list = re.split("(M|I|D)", cigar_code)[:-1]
+    cigar_pairs = re.findall(r"(\d+)([MID])", cigar_code)
     
-    if len(cigar_list) % 2 != 0:
+    if sum([ len(Len)+1 for Len,code in cigar_pairs ]) != len(cigar_code):
         warning = "Error: %s is not a valid cigar code" % (cigar_code, )
         sys.stderr.writelines(warning+"\n")
         raise NameError(warning)
     
-    cigar_pairs = []
-    i = 0
-    while i < len(cigar_list):
-        cigar_pairs.append( (int(cigar_list[i]),  cigar_list[i+1]) )
-        i += 2
-    
-    return cigar_pairs
+    return [ (int(Len), code) for Len,code in cigar_pairs ]
 
-def __format_ref_forGS(full_ref_seq, position, cigar_pairs):
+def __expand_cigar_forGS(full_query_seq, full_ref_seq, position, cigar_pairs):
     """
+    full_query_seq      -- Raw query sequence
     full_ref_seq        -- Raw reference sequence
-    position            -- Start position
+    position            -- Start position in reference
     cigar_pairs         -- Split cigar pairs
     
-    Convert raw sequence to aligned sequence for reference sequence
+    Convert raw sequences to aligned sequences, each string is built with one join
+    Return formated_query, formated_ref
     """
-    formated_ref = ""
-    
-    current_pos = position
+    query_parts, ref_parts = [], []
+    query_pos, ref_pos = 0, position-1
     for Len,code in cigar_pairs:
         if code == 'M':
-            formated_ref += full_ref_seq[ current_pos-1:current_pos+Len-1 ]
-            current_pos += Len
+            query_parts.append( full_query_seq[query_pos:query_pos+Len] )
+            ref_parts.append( full_ref_seq[ref_pos:ref_pos+Len] )
+            query_pos += Len
+            ref_pos += Len
         elif code == 'I':
-            formated_ref += full_ref_seq[ current_pos-1:current_pos+Len-1 ]
-            current_pos += Len
+            query_parts.append( "-"*Len )
+            ref_parts.append( full_ref_seq[ref_pos:ref_pos+Len] )
+            ref_pos += Len
         elif code == 'D':
-            formated_ref += "-"*Len
+            query_parts.append( full_query_seq[query_pos:query_pos+Len] )
+            ref_parts.append( "-"*Len )
+            query_pos += Len
         else:
             sys.stderr.writelines("Error: Unexpected cigar code\n")
             raise NameError("Error: Unexpected cigar code")
     
-    return formated_ref
+    return "".join(query_parts), "".join(ref_parts)
+
+def __format_ref_forGS(full_ref_seq, position, cigar_pairs):
+    """
+    full_ref_seq        -- Raw reference sequence
+    position            -- Start position
+    cigar_pairs         -- Split cigar pairs
+    
+    Convert raw sequence to aligned sequence for reference sequence
+    """
+    query_len = sum([ Len for Len,code in cigar_pairs if code in 'MD' ])
+    return __expand_cigar_forGS("N"*query_len, full_ref_seq, position, cigar_pairs)[1]
 
 def __format_query_forGS(full_query_seq, cigar_pairs):
     """
@@ -1733,83 +1652,90 @@ def __format_query_forGS(full_query_seq, cigar_pairs):
     
     Convert raw sequence to aligned sequence for query sequence
     """
-    formated_query = ""
-    
-    current_pos = 1
-    for Len,code in cigar_pairs:
-        if code == 'M':
-            formated_query += full_query_seq[ current_pos-1:current_pos+Len-1 ]
-            current_pos += Len
-        elif code == 'I':
-            formated_query += "-"*Len
-        elif code == 'D':
-            formated_query += full_query_seq[ current_pos-1:current_pos+Len-1 ]
-            current_pos += Len
-        else:
-            sys.stderr.writelines("Error: Unexpected cigar code\n")
-            raise NameError("Error: Unexpected cigar code")
-    
-    return formated_query
+    ref_len = sum([ Len for Len,code in cigar_pairs if code in 'MI' ])
+    return __expand_cigar_forGS(full_query_seq, "N"*ref_len, 1, cigar_pairs)[0]
+
+def __read_glsearch_hits(handle, min_identity, hits):
+    """
+    Read glsearch36 -m 8CC output and append (query_id, ref_id, map_pos, cigar, evalue, bitscore) of hits passed min_identity
+    Return hits
+    """
+    for line in handle:
+        if line[0] == '#':
+            continue
+        data = line.rstrip("\n").split("\t")
+        if float(data[2]) < min_identity*100:
+            continue
+        hits.append( (data[0], data[1], int(data[8]), data[12], float(data[10]), float(data[11])) )
+    return hits
 
-def global_search(query_dict, ref_dict, thread_nums=1, min_identity=0.6, evalue=10, clean=True, verbose=False):
+def global_search(query_dict, ref_dict, thread_nums=1, min_identity=0.6, evalue=10, clean=True, verbose=False, shards=1):
     """
     query_seq_dict              -- {seqID1:seq1, seqID2:seq2, seqID3:seq3,...}
     ref_seq_dict                -- {seqID1:seq1, seqID2:seq2, seqID3:seq3,...}
     min_identity                -- Minimum sequence identity
     evalue                      -- Evalue for search
-    thread_nums                 -- Treads number
+    thread_nums                 -- Treads number, shared by all shards
     clean                       -- Delete all tmp files
     verbose                     -- Print command
+    shards                      -- Split the reference sequences into shards and run glsearch36 concurrently,
+                                   no more than thread_nums. E-values are computed with the size of the whole reference set
     
     Align short sequences to multiple long sequences.
-    Return { query_id => [ (aligned_query_seq, ref_id, aligned_ref_seq, map_pos), ... ] }
+    Return { query_id => [ (aligned_query_seq, ref_id, aligned_ref_seq, map_pos), ... ] }, hits of each query
+    are sorted by E-value (then bit score), the best hit comes first
     
     Require glsearch36
     """
     import General
-    import random, os, sys
-    import shutil
+    import os, sys, heapq
     
     glsearch36 = General.require_exec("glsearch36")
     
-    randID = random.randint(1000000,9000000)
-    ROOT = "/tmp/global_search_%s/" % (randID, )
-    os.mkdir(ROOT)
-    query_fa_file = ROOT + "query.fa"
-    ref_fa_file = ROOT + "reference.afa"
-    
-    General.write_fasta(query_dict, query_fa_file)
-    General.write_fasta(ref_dict, ref_fa_file)
-    
-    global_matches = {}
-    
-    ## -U mode permit U-C match
-    CMD = glsearch36 + " -3 -m 8CC -n %s %s -T %s -E %s | grep -v \"^#\" | cut -f 1,2,3,9,13" % (query_fa_file, ref_fa_file, thread_nums, evalue)
-    
-    if verbose:
-        print(CMD)
-    
-    for line in os.popen(CMD):
-        query_id, ref_id, identity, map_pos, cigar = line.rstrip("\n").split()
-        if float(identity) < min_identity*100: 
-            continue
+    with General.scratch_dir("global_search_", clean=clean) as ROOT:
+        query_fa_file = os.path.join(ROOT, "query.fa")
+        General.write_fasta(query_dict, query_fa_file)
+        
+        ### Split reference sequences into shards with balanced length
+        ### At most one shard per thread, so that the shards do not oversubscribe the CPUs
+        shards = max(1, min(shards, thread_nums, len(ref_dict)))
+        heap = [ (0, i) for i in range(shards) ]
+        ref_shards = [ {} for i in range(shards) ]
+        for ref_id in sorted(ref_dict, key=lambda ref_id: len(ref_dict[ref_id]), reverse=True):
+            load, idx = heapq.heappop(heap)
+            ref_shards[idx][ref_id] = ref_dict[ref_id]
+            heapq.heappush(heap, (load+len(ref_dict[ref_id]), idx))
         
-        cigar_pairs = __split_cigar_forGS(cigar)
-        ref_seq = ref_dict[ref_id]
-        query_seq = query_dict[query_id]
+        ## -U mode permit U-C match
+        CMD_list = []
+        for idx, ref_shard in enumerate(ref_shards):
+            ref_fa_file = os.path.join(ROOT, f"reference_{idx}.afa")
+            General.write_fasta(ref_shard, ref_fa_file)
+            CMD = [ glsearch36, "-3", "-m", "8CC", "-n", query_fa_file, ref_fa_file, 
+                "-T", max(1, thread_nums//shards), "-E", evalue, "-Z", len(ref_dict) ]
+            if verbose:
+                print(General.format_command(CMD))
+            CMD_list.append(CMD)
         
-        map_pos = int(map_pos)
+        ### Hits are parsed from stdout while glsearch36 is running
+        read_hits = lambda stream: __read_glsearch_hits(stream, min_identity, [])
+        results = General.run_tools(CMD_list, stdout_handler=read_hits)
         
-        formated_ref = __format_ref_forGS(ref_seq, map_pos, cigar_pairs)
-        formated_query = __format_query_forGS(query_seq, cigar_pairs)
+        global_matches = {}
+        for shard_hits in [ result.stdout for result in results ]:
+            for query_id, ref_id, map_pos, cigar, hit_evalue, bitscore in shard_hits:
+                cigar_pairs = __split_cigar_forGS(cigar)
+                formated_query, formated_ref = __expand_cigar_forGS(query_dict[query_id], ref_dict[ref_id], map_pos, cigar_pairs)
+                match = [formated_query, ref_id, formated_ref, map_pos]
+                try:
+                    global_matches[query_id].append( (hit_evalue, -bitscore, match) )
+                except KeyError:
+                    global_matches[query_id] =  [ (hit_evalue, -bitscore, match) ]
         
-        try:
-            global_matches[query_id].append( [formated_query, ref_id, formated_ref, map_pos] )
-        except KeyError:
-            global_matches[query_id] =  [ [formated_query, ref_id, formated_ref, map_pos] ]
-    
-    if clean:
-        shutil.rmtree(ROOT)
+        ### Hits of each shard are best-first, merge them back into one best-first list
+        for query_id in global_matches:
+            global_matches[query_id].sort(key=lambda hit: hit[:2])
+            global_matches[query_id] = [ hit[2] for hit in global_matches[query_id] ]
     
     return global_matches
 
@@ -1820,6 +1746,7 @@ def align_find(aligned_seq, sub_seq):
     
     Find (start, end) in aligned sequence. Return (-1, -1) if not found
     """
+    import Alignment
     
     clean_seq = aligned_seq.replace("-", "")
     
@@ -1827,18 +1754,11 @@ def align_find(aligned_seq, sub_seq):
     pos_end = pos_start + len(sub_seq)
     if pos_start == -1:
         return (-1, -1)
+    if pos_start == pos_end:
+        return (0, 0)
     
-    global_start = -1
-    global_pos = 0
-    alpha_pos = 0
-    while alpha_pos != pos_end:
-        if alpha_pos == pos_start:
-            global_start = global_pos
-        if aligned_seq[global_pos] != '-':
-            alpha_pos += 1
-        global_pos += 1
-    
-    return global_start+1, global_pos
+    projection = Alignment.AlignProjection(aligned_seq)
+    return int(projection.align_pos[pos_start])+1, int(projection.align_pos[pos_end-1])+1
 
 def locate_homoseq(seq_dict, main_id, align_func, main_region=None, sub_seq=None):
     """
@@ -1885,17 +1805,10 @@ def dot_to_alignDot(dot, aligned_seq):
     
     Convert dotbracket structure to aligned dotbracket structure
     """
+    import Alignment
     assert len(dot) == len(aligned_seq) - aligned_seq.count('-')
     
-    alignedSS = ""
-    i = 0
-    for base in list(aligned_seq):
-        if base == '-':
-            alignedSS +=  '-'
-        else:
-            alignedSS += dot[i]
-            i += 1
-    return alignedSS
+    return Alignment.AlignProjection(aligned_seq).to_align(dot, fill='-')
 
 def shape_to_alignSHAPE(shape_list, aligned_seq):
     """
@@ -1904,17 +1817,10 @@ def shape_to_alignSHAPE(shape_list, aligned_seq):
     
     Convert shape list structure to aligned shape list
     """
+    import Alignment
     assert len(shape_list) == len(aligned_seq) - aligned_seq.count('-')
     
-    alignedSHAPE = []
-    i = 0
-    for base in list(aligned_seq):
-        if base == '-':
-            alignedSHAPE.append('NULL')
-        else:
-            alignedSHAPE.append(shape_list[i])
-            i += 1
-    return alignedSHAPE
+    return Alignment.AlignProjection(aligned_seq).to_align(list(shape_list), fill='NULL')
 
 def annotate_covariation(ref_aligned_seq, input_aligned_seq, ref_aligned_dot, anno_loop=False):
     """
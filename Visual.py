@@ -37,28 +37,28 @@ def __base_color_shape_cmd(shape_list, cutofflist=[0.3,0.5,0.7]):
     
     assert len(cutofflist)==3
     
-    Level1 = ""
-    Level2 = ""
-    Level3 = ""
-    Level4 = ""
-    NoData = ""
+    Level1 = []
+    Level2 = []
+    Level3 = []
+    Level4 = []
+    NoData = []
     for idx in range(len(shape_list)):
         if shape_list[idx] == 'NULL':
-            NoData += str(idx+1) if NoData == "" else ','+str(idx+1)
+            NoData.append(str(idx+1))
         elif float(shape_list[idx]) > cutofflist[2]:
-            Level1 += str(idx+1) if Level1 == "" else ','+str(idx+1)
+            Level1.append(str(idx+1))
         elif float(shape_list[idx]) > cutofflist[1]:
-            Level2 += str(idx+1) if Level2 == "" else ','+str(idx+1)
+            Level2.append(str(idx+1))
         elif float(shape_list[idx]) > cutofflist[0]:
-            Level3 += str(idx+1) if Level3 == "" else ','+str(idx+1)
+            Level3.append(str(idx+1))
         else:
-            Level4 += str(idx+1) if Level4 == "" else ','+str(idx+1)
+            Level4.append(str(idx+1))
     CMD = ""
-    if Level1: CMD += "-applyBasesStyle1on \"%s\" " % (Level1, )
-    if Level2: CMD += "-applyBasesStyle2on \"%s\" " % (Level2, )
-    if Level3: CMD += "-applyBasesStyle3on \"%s\" " % (Level3, )
-    if Level4: CMD += "-applyBasesStyle4on \"%s\" " % (Level4, )
-    if NoData: CMD += "-applyBasesStyle5on \"%s\" " % (NoData, )
+    if Level1: CMD += "-applyBasesStyle1on \"%s\" " % (",".join(Level1), )
+    if Level2: CMD += "-applyBasesStyle2on \"%s\" " % (",".join(Level2), )
+    if Level3: CMD += "-applyBasesStyle3on \"%s\" " % (",".join(Level3), )
+    if Level4: CMD += "-applyBasesStyle4on \"%s\" " % (",".join(Level4), )
+    if NoData: CMD += "-applyBasesStyle5on \"%s\" " % (",".join(NoData), )
     return CMD
 
 def __dot_match_bpprob(dot, bpprob, warning=True):
@@ -179,18 +179,18 @@ def __manual_period(seqlen, first_base_pos, period, peroid_color='#ff5722'):
     return cmd
 
 def __base_color_heatmap_cmd(shape_list):
-    shape_str = ""
+    shape_str = []
     null_base_idx = []
     for idx,shape in enumerate(shape_list):
         if shape == 'NULL':
-            shape_str += '0.0;'
+            shape_str.append('0.0')
             null_base_idx.append(str(idx+1))
         else:
-            shape_str += '%s;' % (shape, )
+            shape_str.append('%s' % (shape, ))
     CMD = ""
     if null_base_idx:
         CMD += "-basesStyle1 \"label=#828282\" -applyBasesStyle1on \"%s\" " % ( ",".join(null_base_idx), )
-    CMD += "-colorMap \"%s\" " % (shape_str[:-1], )
+    CMD += "-colorMap \"%s\" " % (";".join(shape_str), )
     return CMD
 
 def __annotation_cmd(annotation_list):
@@ -276,24 +276,24 @@ def Plot_RNAStructure_Shape(sequence, dot, shape_list,
     return CMD
 
 def __base_color_base_cmd(seq):
-    A = ""
-    T = ""
-    C = ""
-    G = ""
+    A = []
+    T = []
+    C = []
+    G = []
     for idx in range(len(seq)):
         if seq[idx] == 'A':
-            A += str(idx+1) if A == "" else ','+str(idx+1)
+            A.append(str(idx+1))
         if seq[idx] == 'C':
-            C += str(idx+1) if C == "" else ','+str(idx+1)
+            C.append(str(idx+1))
         if seq[idx] == 'T' or seq[idx] == 'U':
-            T += str(idx+1) if T == "" else ','+str(idx+1)
+            T.append(str(idx+1))
         if seq[idx] == 'G':
-            G += str(idx+1) if G == "" else ','+str(idx+1)
+            G.append(str(idx+1))
     CMD = ""
-    if A: CMD += "-applyBasesStyle1on \"%s\" " % (A, )
-    if T: CMD += "-applyBasesStyle2on \"%s\" " % (T, )
-    if C: CMD += "-applyBasesStyle3on \"%s\" " % (C, )
-    if G: CMD += "-applyBasesStyle4on \"%s\" " % (G, )
+    if A: CMD += "-applyBasesStyle1on \"%s\" " % (",".join(A), )
+    if T: CMD += "-applyBasesStyle2on \"%s\" " % (",".join(T), )
+    if C: CMD += "-applyBasesStyle3on \"%s\" " % (",".join(C), )
+    if G: CMD += "-applyBasesStyle4on \"%s\" " % (",".join(G), )
     return CMD
 
 def Plot_RNAStructure_Base(sequence, dot, mode='fill', correctT=True, scaling=0.8, 
@@ -431,6 +431,408 @@ def Plot_RNAStructure_highlight(sequence, dot, hg_base_list=[], mode='fill', cor
     return CMD
 
 
+##################################
+####    Native SVG/PDF renderer
+##################################
+
+__LAYOUT_CACHE = {}
+__LAYOUT_CACHE_SIZE = 256
+
+SHAPE_LABEL_COLORS = ['#B61D22', '#ED9616', '#194399', '#040000', '#828282']
+BPPROB_COLORS = ['#2306f7', '#7167f9', '#b7b2f7', '#e4e3fc', '#aeaeaf']
+BPPROB_THICKNESS = [4, 3, 2, 1, 1]
+
+def __nested_pair_table(dot):
+    """
+    dot                 -- Dotbracket structure
+    
+    Build a 1-based pair table (pt[0]=length) without pseudoknots
+    Return pair_table, pseudoknot_pairs
+    """
+    import Structure
+    
+    Len = len(dot)
+    ctList = Structure.dot2ct(dot)
+    pseudo_pairs = []
+    if ctList:
+        for duplex in Structure.parse_pseudoknot(list(ctList)):
+            pseudo_pairs += duplex
+    pseudo_set = set(pseudo_pairs)
+    
+    pair_table = [0] * (Len+2)
+    pair_table[0] = Len
+    for l,r in ctList:
+        if (l,r) not in pseudo_set:
+            pair_table[l] = r
+            pair_table[r] = l
+    return pair_table, pseudo_pairs
+
+def __radial_layout(pair_table, spacing=15.0):
+    """
+    pair_table          -- Pair table produced by __nested_pair_table
+    spacing             -- Distance between adjacent bases
+    
+    Compute the radial (RNAplot simple) layout of a nested structure.
+    Loops are drawn as regular polygons and helices as ladders.
+    
+    Return X, Y
+    """
+    import math
+    
+    Len = pair_table[0]
+    angle = [0.0] * (Len+5)
+    PI, PIHALF = math.pi, math.pi/2
+    
+    def loop(i, j):
+        count = 2
+        remember = []
+        i_old = i-1
+        j += 1
+        while i != j:
+            partner = pair_table[i]
+            if not partner or i == 0:
+                i += 1
+                count += 1
+            else:
+                count += 2
+                k, l = i, partner
+                remember += [k, l]
+                i = partner+1
+                start_k, start_l = k, l
+                ladder = 0
+                while True:
+                    k, l, ladder = k+1, l-1, ladder+1
+                    if not (pair_table[k] == l and pair_table[k] > k):
+                        break
+                fill = ladder-2
+                if ladder >= 2:
+                    angle[start_k+1+fill] += PIHALF
+                    angle[start_l-1-fill] += PIHALF
+                    angle[start_k] += PIHALF
+                    angle[start_l] += PIHALF
+                    for f in range(fill, 0, -1):
+                        angle[start_k+f] = PI
+                        angle[start_l-f] = PI
+                if k <= l:
+                    loop(k, l)
+        polygon = PI*(count-2)/count
+        remember.append(j)
+        begin = max(i_old, 0)
+        v = 0
+        while v < len(remember):
+            for f in range(remember[v]-begin+1):
+                angle[begin+f] += polygon
+            v += 1
+            if v < len(remember):
+                begin = remember[v]
+                v += 1
+    
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, Len+100))
+    try:
+        loop(0, Len+1)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    
+    X = [0.0] * Len
+    Y = [0.0] * Len
+    alpha = 0.0
+    for i in range(1, Len):
+        X[i] = X[i-1] + spacing*math.cos(alpha)
+        Y[i] = Y[i-1] + spacing*math.sin(alpha)
+        alpha += PI - angle[i+1]
+    return X, Y
+
+def layout_structure(dot, spacing=15.0):
+    """
+    dot                 -- Dotbracket structure
+    spacing             -- Distance between adjacent bases
+    
+    Compute 2D coordinates of each base with a radial layout. Pseudoknotted
+    pairs are excluded from the layout and drawn as extra lines. The layout
+    is cached by dot string, so re-drawing the same structure is cheap.
+    
+    Return { 'X':[...], 'Y':[...], 'pairs':[(l,r),...], 'pseudo_pairs':[(l,r),...] }
+    """
+    key = (dot, spacing)
+    if key in __LAYOUT_CACHE:
+        return __LAYOUT_CACHE[key]
+    
+    pair_table, pseudo_pairs = __nested_pair_table(dot)
+    X, Y = __radial_layout(pair_table, spacing=spacing)
+    pairs = [ (i, pair_table[i]) for i in range(1, len(dot)+1) if i < pair_table[i] ]
+    layout = { 'X':X, 'Y':Y, 'pairs':pairs, 'pseudo_pairs':sorted(pseudo_pairs) }
+    
+    if len(__LAYOUT_CACHE) >= __LAYOUT_CACHE_SIZE:
+        del __LAYOUT_CACHE[next(iter(__LAYOUT_CACHE))]
+    __LAYOUT_CACHE[key] = layout
+    return layout
+
+def clear_layout_cache():
+    """
+    Remove all cached layouts
+    """
+    __LAYOUT_CACHE.clear()
+
+def __shape_level(shape, cutofflist):
+    """
+    Return the index of SHAPE_LABEL_COLORS for a SHAPE score
+    """
+    if shape == 'NULL':
+        return 4
+    shape = float(shape)
+    if shape > cutofflist[2]:
+        return 0
+    elif shape > cutofflist[1]:
+        return 1
+    elif shape > cutofflist[0]:
+        return 2
+    return 3
+
+def __heatmap_rgb(shape):
+    """
+    Interpolate a SHAPE score (0-1) from white to dark red
+    
+    Return (r, g, b) in 0-1
+    """
+    v = min(max(float(shape), 0.0), 1.0)
+    return ( 1-v*(1-0xB6/255), 1-v*(1-0x1D/255), 1-v*(1-0x22/255) )
+
+def __heatmap_color(shape):
+    """
+    Hex color of a SHAPE score in heatmap mode
+    """
+    if shape == 'NULL':
+        return SHAPE_LABEL_COLORS[4]
+    return "#%02X%02X%02X" % tuple( int(round(c*255)) for c in __heatmap_rgb(shape) )
+
+def __outward_vector(X, Y, idx):
+    """
+    Unit vector pointing away from the backbone at base idx (0-based)
+    """
+    import math
+    
+    Len = len(X)
+    prev_i, next_i = max(idx-1, 0), min(idx+1, Len-1)
+    mx, my = (X[prev_i]+X[next_i])/2, (Y[prev_i]+Y[next_i])/2
+    dx, dy = X[idx]-mx, Y[idx]-my
+    norm = math.hypot(dx, dy)
+    if norm < 1e-6:
+        dx, dy = -(Y[next_i]-Y[prev_i]), X[next_i]-X[prev_i]
+        norm = math.hypot(dx, dy) or 1.0
+    return dx/norm, dy/norm
+
+def __structure_primitives(layout, sequence, base_fill, base_label, pair_style, 
+    highlight_region, annotation, period, first_base_pos, peroid_color, spacing):
+    """
+    Build the drawing primitives. Coordinates are in layout space.
+    
+    Return [ ('line',x1,y1,x2,y2,color,width), ('circle',x,y,r,fill), ('text',x,y,text,color,size), ... ]
+    """
+    X, Y = layout['X'], layout['Y']
+    radius = spacing*0.45
+    prims = []
+    
+    for region in highlight_region:
+        color = region[2] if len(region) > 2 else "#00FF00"
+        for i in range(region[0]-1, region[1]):
+            prims.append( ('circle', X[i], Y[i], spacing*0.8, color) )
+    
+    for i in range(1, len(X)):
+        prims.append( ('line', X[i-1], Y[i-1], X[i], Y[i], '#9E9E9E', 1) )
+    for (l, r) in layout['pairs'] + layout['pseudo_pairs']:
+        color, width = pair_style.get((l, r), ('#616161', 1))
+        prims.append( ('line', X[l-1], Y[l-1], X[r-1], Y[r-1], color, width) )
+    
+    for i in range(len(X)):
+        if base_fill[i]:
+            prims.append( ('circle', X[i], Y[i], radius, base_fill[i]) )
+        prims.append( ('text', X[i], Y[i], sequence[i], base_label[i], spacing*0.6) )
+    
+    if period:
+        for i in range(len(X)):
+            if (i+first_base_pos) % period == 0:
+                dx, dy = __outward_vector(X, Y, i)
+                prims.append( ('text', X[i]+dx*spacing*1.3, Y[i]+dy*spacing*1.3, str(i+first_base_pos), peroid_color, spacing*0.5) )
+    
+    for annot in annotation:
+        assert 'text' in annot
+        assert 'anchor' in annot
+        i = annot['anchor']-1
+        dx, dy = __outward_vector(X, Y, i)
+        prims.append( ('text', X[i]+dx*spacing*2, Y[i]+dy*spacing*2, annot['text'], annot.get('color','#000000'), annot.get('size',7)*spacing/10) )
+    
+    return prims
+
+def __escape_xml(text):
+    return text.replace("&","&amp;").replace("<","&lt;").replace(">","&gt;").replace('"',"&quot;")
+
+def __write_svg(prims, outFn, width, height, shift_x, shift_y, title=""):
+    """
+    Write primitives to a SVG file
+    """
+    OUT = open(outFn, 'w')
+    OUT.writelines('<svg xmlns="http://www.w3.org/2000/svg" width="%.1f" height="%.1f" viewBox="0 0 %.1f %.1f">\n' % (width, height, width, height))
+    OUT.writelines('<rect width="100%" height="100%" fill="#FFFFFF"/>\n')
+    lines = []
+    for p in prims:
+        if p[0] == 'line':
+            lines.append('<line x1="%.2f" y1="%.2f" x2="%.2f" y2="%.2f" stroke="%s" stroke-width="%s"/>' % (p[1]+shift_x, p[2]+shift_y, p[3]+shift_x, p[4]+shift_y, p[5], p[6]))
+        elif p[0] == 'circle':
+            lines.append('<circle cx="%.2f" cy="%.2f" r="%.2f" fill="%s"/>' % (p[1]+shift_x, p[2]+shift_y, p[3], p[4]))
+        else:
+            lines.append('<text x="%.2f" y="%.2f" fill="%s" font-size="%.1f" font-family="Helvetica,Arial,sans-serif" text-anchor="middle" dominant-baseline="central">%s</text>' % (p[1]+shift_x, p[2]+shift_y, p[4], p[5], __escape_xml(str(p[3]))))
+    if title:
+        lines.append('<text x="%.2f" y="20" font-size="14" font-family="Helvetica,Arial,sans-serif" text-anchor="middle">%s</text>' % (width/2, __escape_xml(title)))
+    OUT.writelines("\n".join(lines)+"\n</svg>\n")
+    OUT.close()
+
+def __hex2rgb(color):
+    color = color.lstrip('#')
+    return tuple( int(color[i:i+2],16)/255 for i in (0,2,4) )
+
+def __write_pdf(prims, outFn, width, height, shift_x, shift_y, title=""):
+    """
+    Write primitives to a single-page PDF file with the built-in Helvetica font
+    """
+    kappa = 0.5523
+    ops = ["1 J 1 j"]
+    for p in prims:
+        if p[0] == 'line':
+            ops.append("%.3f %.3f %.3f RG %s w %.2f %.2f m %.2f %.2f l S" % (__hex2rgb(p[5]) + (p[6], p[1]+shift_x, height-p[2]-shift_y, p[3]+shift_x, height-p[4]-shift_y)))
+        elif p[0] == 'circle':
+            x, y, r = p[1]+shift_x, height-p[2]-shift_y, p[3]
+            c = r*kappa
+            ops.append("%.3f %.3f %.3f rg %.2f %.2f m " % (__hex2rgb(p[4]) + (x+r, y)) +
+                "%.2f %.2f %.2f %.2f %.2f %.2f c " % (x+r, y+c, x+c, y+r, x, y+r) +
+                "%.2f %.2f %.2f %.2f %.2f %.2f c " % (x-c, y+r, x-r, y+c, x-r, y) +
+                "%.2f %.2f %.2f %.2f %.2f %.2f c " % (x-r, y-c, x-c, y-r, x, y-r) +
+                "%.2f %.2f %.2f %.2f %.2f %.2f c f" % (x+c, y-r, x+r, y-c, x+r, y))
+        else:
+            text = str(p[3]).replace("\\","\\\\").replace("(","\\(").replace(")","\\)")
+            size = p[5]
+            x = p[1]+shift_x - 0.28*size*len(text)
+            y = height-p[2]-shift_y - 0.35*size
+            ops.append("%.3f %.3f %.3f rg BT /F1 %.1f Tf %.2f %.2f Td (%s) Tj ET" % (__hex2rgb(p[4]) + (size, x, y, text)))
+    if title:
+        text = title.replace("\\","\\\\").replace("(","\\(").replace(")","\\)")
+        ops.append("0 0 0 rg BT /F1 14 Tf %.2f %.2f Td (%s) Tj ET" % (width/2-3.9*len(text), height-24, text))
+    content = "\n".join(ops).encode('latin-1', 'replace')
+    
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        ("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.1f %.1f] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>" % (width, height)).encode(),
+        b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += ("%d 0 obj\n" % (i+1, )).encode() + obj + b"\nendobj\n"
+    xref_pos = len(data)
+    data += ("xref\n0 %d\n0000000000 65535 f \n" % (len(objects)+1, )).encode()
+    for offset in offsets:
+        data += ("%010d 00000 n \n" % (offset, )).encode()
+    data += ("trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects)+1, xref_pos)).encode()
+    open(outFn, 'wb').write(data)
+
+def __render_primitives(prims, outFn, title="", margin=40):
+    """
+    Compute the canvas and write primitives to outFn (.svg or .pdf)
+    """
+    xs, ys = [], []
+    for p in prims:
+        xs.append(p[1])
+        ys.append(p[2])
+        if p[0] == 'line':
+            xs.append(p[3])
+            ys.append(p[4])
+    min_x, max_x = min(xs), max(xs)
+    min_y, max_y = min(ys), max(ys)
+    top = margin + (30 if title else 0)
+    width = max_x - min_x + 2*margin
+    height = max_y - min_y + margin + top
+    shift_x, shift_y = margin - min_x, top - min_y
+    
+    if outFn.lower().endswith('.pdf'):
+        __write_pdf(prims, outFn, width, height, shift_x, shift_y, title)
+    elif outFn.lower().endswith('.svg'):
+        __write_svg(prims, outFn, width, height, shift_x, shift_y, title)
+    else:
+        raise RuntimeError("Error: outFn should end with .svg or .pdf")
+
+def Draw_RNAStructure_Shape(sequence, dot, shape_list, outFn, 
+    mode='label', correctT=True, spacing=15.0, 
+    highlight_region=[], annotation=[], cutofflist=[0.3,0.5,0.7], 
+    bpprob=[], bpprob_cutofflist=[0.6,0.8,0.95], bpprob_mode='color', bpwarning=True,
+    period=10, first_base_pos=1, peroid_color='#828282', title=""):
+    """
+    sequence            -- Raw sequence
+    dot                 -- Dotbracket structure
+    shape_list          -- A list of SHAPE scores
+    outFn               -- Output file, .svg or .pdf
+    mode                -- Color mode: [label|fill|heatmap]
+    correctT            -- Covert T to U
+    spacing             -- Distance between adjacent bases
+    highlight_region    -- Regions to highlight
+    cutofflist          -- The color cutoff
+    bpprob              -- Base pairing probability, only provide base pairs in the structure
+    bpprob_cutofflist   -- Base pairing color/thickness cutoff
+    bpprob_mode         -- color/thickness/both
+    bpwarning           -- Base pairing warning when provide base pairs not in the structure
+    period              -- Numbering the base for how many bases as period
+    first_base_pos      -- The number of first base
+    peroid_color        -- The period color
+    title               -- Title of plot
+    
+    annotation_list    -- [ {'text': 'loop1', 'anchor':10, 'color': '#ff9800', 'size': 10, 'type':'B'},... ]
+    
+    Draw the RNA structure combine with SHAPE scores without VARNA/java.
+    The layout is cached by dot, only the color pass is recomputed for new shape_list.
+    """
+    assert len(sequence) == len(dot) == len(shape_list)
+    assert mode in ('label', 'fill', 'heatmap')
+    assert len(cutofflist) == 3
+    
+    if correctT:
+        sequence = sequence.replace('T', 'U')
+    
+    layout = layout_structure(dot, spacing=spacing)
+    
+    if mode == 'label':
+        base_label = [ SHAPE_LABEL_COLORS[__shape_level(shape, cutofflist)] for shape in shape_list ]
+        base_fill = [ None ] * len(sequence)
+    elif mode == 'fill':
+        base_fill = [ SHAPE_LABEL_COLORS[__shape_level(shape, cutofflist)] for shape in shape_list ]
+        base_label = [ '#FFFFFF' ] * len(sequence)
+    else:
+        base_fill = [ __heatmap_color(shape) for shape in shape_list ]
+        base_label = [ '#000000' ] * len(sequence)
+    
+    pair_style = {}
+    if bpprob:
+        for b1,b2,prob in __dot_match_bpprob(dot, list(bpprob), bpwarning):
+            if prob is None:
+                level = 4
+            elif prob > bpprob_cutofflist[2]:
+                level = 0
+            elif prob > bpprob_cutofflist[1]:
+                level = 1
+            elif prob > bpprob_cutofflist[0]:
+                level = 2
+            else:
+                level = 3
+            color = BPPROB_COLORS[level] if bpprob_mode in ('color', 'both') else '#616161'
+            width = BPPROB_THICKNESS[level] if bpprob_mode in ('thickness', 'both') else 1
+            pair_style[(b1, b2)] = (color, width)
+    
+    prims = __structure_primitives(layout, sequence, base_fill, base_label, pair_style, 
+        highlight_region, annotation, period, first_base_pos, peroid_color, spacing)
+    __render_primitives(prims, outFn, title=title)
+
+
 ##################################
 ####    rRNA structure ps
 ##################################
@@ -454,24 +856,78 @@ PS_FILE = {
     'arabidopsis_large':    ['arabidopsis_large_5.ps', 'arabidopsis_large_3.ps']
 }
 
+RRNA_TITLE = {  'yeast_small':'Yeast small subunit rRNA',
+                'yeast_large':'Yeast large subunit rRNA',
+                'yeast_5S': 'Yeast 5S rRNA',
+                'yeast_smallMito': 'Yeast mitochodria small subunit rRNA',
+                'human_small':'Human small subunit rRNA',
+                'human_5S': 'Human 5S rRNA',
+                'human_smallMito': 'Human mitochodria small subunit rRNA',
+                'mouse_small':'Mouse small subunit rRNA',
+                'mouse_5S': 'Mouse 5S rRNA',
+                'mouse_smallMito': 'Mouse mitochodria small subunit rRNA',
+                'arabidopsis_small': 'Arabidopsis small subunit rRNA',
+                'arabidopsis_large': 'Arabidopsis large subunit rRNA' }
+
+__PS_CACHE = {}
+
 def load_ps(psFn):
+    """
+    psFn                -- PostScript template file
+    
+    Parse a rRNA PostScript template. Parsed templates are cached in memory
+    and reloaded only when the file is modified.
+    
+    Return header_lines, base_lines, tail_lines, seq
+    """
     import re
+    
+    key = os.path.abspath(psFn)
+    mtime = os.path.getmtime(key)
+    if key in __PS_CACHE and __PS_CACHE[key][0] == mtime:
+        return __PS_CACHE[key][1]
+    
     header_lines = []
     tail_lines = []
     base_lines = []
     base_through = False
-    seq = ""
+    seq = []
+    base_regex = re.compile(r"^\([AUTCG]\)")
     for line in open(psFn):
-        if re.match(r"^\([AUTCG]\)", line):
+        if base_regex.match(line):
             base_lines.append(line)
             base_through = True
-            seq += line[1]
+            seq.append(line[1])
         elif base_through:
             tail_lines.append(line)
         else:
             header_lines.append(line)
     
-    return header_lines, base_lines, tail_lines, seq
+    template = (tuple(header_lines), tuple(base_lines), tuple(tail_lines), "".join(seq))
+    __PS_CACHE[key] = (mtime, template)
+    return template
+
+def clear_ps_cache():
+    """
+    Remove all cached PostScript templates
+    """
+    __PS_CACHE.clear()
+
+def __load_rRNA_templates(target):
+    """
+    Return [ (psfile, header_lines, base_lines, tail_lines, seq), ... ]
+    """
+    psfiles = PS_FILE[target]
+    if not isinstance(psfiles, list):
+        psfiles = [psfiles]
+    return [ (psfile,)+tuple(load_ps(PS_PATH + psfile)) for psfile in psfiles ]
+
+def __ps_out_file(psfile, outPrex):
+    if '_5.ps' in psfile:
+        return outPrex + '_5p.ps'
+    elif '_3.ps' in psfile:
+        return outPrex + '_3p.ps'
+    return outPrex + '.ps'
 
 def Map_rRNA_Shape(sequence, shape_list, target, outPrex, title=None, mode='label', cutofflist=[0.3,0.5,0.7]):
     """
@@ -487,57 +943,53 @@ def Map_rRNA_Shape(sequence, shape_list, target, outPrex, title=None, mode='labe
     mode                -- Color mode: [label|fill|heatmap]
     cutofflist          -- The color cutoff
     """
+    if title is None:
+        title = RRNA_TITLE[target]
+    Map_rRNA_Shape_batch(sequence, {outPrex: shape_list}, target, title_dict={outPrex: title}, mode=mode, cutofflist=cutofflist)
+
+def Map_rRNA_Shape_batch(sequence, shape_list_dict, target, title_dict={}, mode='label', cutofflist=[0.3,0.5,0.7]):
+    """
+    sequence            -- Raw sequence is used to double-check
+    shape_list_dict     -- { outPrex1: shape_list1, outPrex2: shape_list2, ... }
+    target              -- rRNA target
+                           yeast_small, yeast_large, yeast_5S, yeast_smallMito,
+                           human_small, human_5S, human_smallMito,
+                           mouse_small, mouse_5S, mouse_smallMito,
+                           arabidopsis_small, arabidopsis_large
+    title_dict          -- { outPrex1: title1, ... }, the default title is the rRNA name
+    mode                -- Color mode: [label|fill|heatmap]
+    cutofflist          -- The color cutoff
+    
+    Map multiple samples to the same rRNA template. The template is loaded
+    and checked once, then each sample only costs the color pass.
+    """
     assert target in PS_FILE
     assert mode in ('label', 'fill', 'heatmap')
-    assert len(sequence) == len(shape_list)
-    
-    title_map = {   'yeast_small':'Yeast small subunit rRNA',
-                    'yeast_large':'Yeast large subunit rRNA',
-                    'yeast_5S': 'Yeast 5S rRNA',
-                    'yeast_smallMito': 'Yeast mitochodria small subunit rRNA',
-                    'human_small':'Human small subunit rRNA',
-                    'human_5S': 'Human 5S rRNA',
-                    'human_smallMito': 'Human mitochodria small subunit rRNA',
-                    'mouse_small':'Mouse small subunit rRNA',
-                    'mouse_5S': 'Mouse 5S rRNA',
-                    'mouse_smallMito': 'Mouse mitochodria small subunit rRNA',
-                    'arabidopsis_small': 'Arabidopsis small subunit rRNA',
-                    'arabidopsis_large': 'Arabidopsis large subunit rRNA' }
-
-    if title is None:
-        title = title_map[target]
+    for shape_list in shape_list_dict.values():
+        assert len(sequence) == len(shape_list)
     
-    psfiles = PS_FILE[target]
-    if not isinstance(psfiles, list):
-        psfiles = [psfiles]
-    start=0
-    for psfile in psfiles:
-        full_path = PS_PATH + psfile
-        header_lines, base_lines, tail_lines, seq = load_ps(full_path)
+    templates = __load_rRNA_templates(target)
+    start = 0
+    for psfile, header_lines, base_lines, tail_lines, seq in templates:
         cur_len = len(seq)
-        #print( len(sequence[start:start+cur_len]) )
-        #print( len(seq) )
         if sequence[start:start+cur_len].replace('T','U') != seq.replace('T','U'):
-            #sys.stderr.writelines(sequence[start:start+cur_len].replace('T','U')+"|\n")
-            #sys.stderr.writelines(seq.replace('T','U')+"|\n")
             sys.stderr.writelines("Error: Different Sequence!!\n")
             return
-        if '_5.ps' in psfile:
-            outFn = outPrex + '_5p.ps'
-        elif '_3.ps' in psfile:
-            outFn = outPrex + '_3p.ps'
-        else:
-            outFn = outPrex + '.ps'
-        if mode == 'label':
-            print("Write file: "+outFn+"...")
-            assert len(base_lines)==cur_len
-            #print(base_lines[:100], cur_len)
-            write_label_ps(header_lines, base_lines, tail_lines, shape_list[start:start+cur_len], title, outFn, cutofflist=cutofflist)
-        elif mode == 'fill':
-            sys.stderr.writelines("Sorry: Not applicant now\n")
-        else:
-            sys.stderr.writelines("Sorry: Not applicant now\n")
         start += cur_len
+    
+    writer = { 'label': write_label_ps, 'fill': write_fill_ps, 'heatmap': write_heatmap_ps }[mode]
+    for outPrex, shape_list in shape_list_dict.items():
+        title = title_dict.get(outPrex, RRNA_TITLE[target])
+        start = 0
+        for psfile, header_lines, base_lines, tail_lines, seq in templates:
+            cur_len = len(seq)
+            outFn = __ps_out_file(psfile, outPrex)
+            print("Write file: "+outFn+"...")
+            if mode == 'heatmap':
+                writer(header_lines, base_lines, tail_lines, shape_list[start:start+cur_len], title, outFn)
+            else:
+                writer(header_lines, base_lines, tail_lines, shape_list[start:start+cur_len], title, outFn, cutofflist=cutofflist)
+            start += cur_len
 
 def get_rRNA_refseq(target):
     """
@@ -549,16 +1001,64 @@ def get_rRNA_refseq(target):
                            arabidopsis_small, arabidopsis_large
     """
     assert target in PS_FILE
-    
-    fullseq = ""
-    psfiles = PS_FILE[target]
-    if not isinstance(psfiles, list):
-        psfiles = [psfiles]
-    for psfile in psfiles:
-        full_path = PS_PATH + psfile
-        header_lines, base_lines, tail_lines, seq = load_ps(full_path)
-        fullseq += seq
-    return fullseq
+    return "".join( template[4] for template in __load_rRNA_templates(target) )
+
+def __ps_shape_rgb(shape, cutofflist):
+    if shape == 'NULL':
+        return "0.51 0.51 0.51"
+    elif float(shape) < cutofflist[0]:
+        return "0.00 0.00 0.00"
+    elif float(shape) < cutofflist[1]:
+        return "0.10 0.26 0.60"
+    elif float(shape) < cutofflist[2]:
+        return "0.93 0.59 0.09"
+    return "0.71 0.11 0.13"
+
+def __ps_heatmap_rgb(shape):
+    if shape == 'NULL':
+        return "0.51 0.51 0.51"
+    return "%.2f %.2f %.2f" % __heatmap_rgb(shape)
+
+def __write_ps_header(OUT, header_lines, title):
+    for header_line in header_lines:
+        if r'{title}' in header_line:
+            header_line = header_line.format(title=title)
+        OUT.writelines(header_line)
+
+def __write_label_colors(OUT, header_lines, base_lines, tail_lines, colors, title):
+    """
+    Colored base labels. setrgbcolor is only emitted when the color changes
+    """
+    buf = []
+    last_color = None
+    for color, base_line in zip(colors, base_lines):
+        if color != last_color:
+            buf.append(color+" setrgbcolor\n")
+            last_color = color
+        buf.append(base_line)
+    __write_ps_header(OUT, header_lines, title)
+    OUT.writelines(buf)
+    OUT.writelines(tail_lines)
+
+def __write_fill_colors(OUT, header_lines, base_lines, tail_lines, colors, title, label_color="1.00 1.00 1.00", radius=4.5):
+    """
+    Filled circle under each base. Circles are drawn in runs of the same
+    color, then all labels are drawn with label_color
+    """
+    buf = []
+    last_color = None
+    for color, base_line in zip(colors, base_lines):
+        if color != last_color:
+            buf.append(color+" setrgbcolor\n")
+            last_color = color
+        data = base_line.split()
+        x, y = float(data[1])+2.8, float(data[2])+2.9
+        buf.append("newpath %.2f %.2f %.1f 0 360 arc fill\n" % (x, y, radius))
+    buf.append(label_color+" setrgbcolor\n")
+    buf += base_lines
+    __write_ps_header(OUT, header_lines, title)
+    OUT.writelines(buf)
+    OUT.writelines(tail_lines)
 
 def write_label_ps(header_lines, base_lines, tail_lines, shape_list, title, outFn, cutofflist=[0.3,0.5,0.7]):
     """
@@ -569,28 +1069,34 @@ def write_label_ps(header_lines, base_lines, tail_lines, shape_list, title, outF
     outFn                   -- Output file name
     cutofflist              -- The color cutoff
     """
+    colors = [ __ps_shape_rgb(shape, cutofflist) for shape in shape_list ]
     OUT = open(outFn, "w")
-    for header_line in header_lines:
-        if r'{title}' in header_line:
-            header_line = header_line.format(title=title)
-        OUT.writelines(header_line)
-    #print(len(shape_list), len())
-    for shape,base_line in zip(shape_list,base_lines):
-        if shape == 'NULL':
-            OUT.writelines("0.51 0.51 0.51 setrgbcolor\n")
-        elif float(shape) < cutofflist[0]:
-            OUT.writelines("0.00 0.00 0.00 setrgbcolor\n")
-        elif float(shape) < cutofflist[1]:
-            OUT.writelines("0.10 0.26 0.60 setrgbcolor\n")
-        elif float(shape) < cutofflist[2]:
-            OUT.writelines("0.93 0.59 0.09 setrgbcolor\n")
-        else:
-            OUT.writelines("0.71 0.11 0.13 setrgbcolor\n")
-        OUT.writelines(base_line)
-    for tail_line in tail_lines:
-        OUT.writelines(tail_line)
+    __write_label_colors(OUT, header_lines, base_lines, tail_lines, colors, title)
     OUT.close()
 
+def write_fill_ps(header_lines, base_lines, tail_lines, shape_list, title, outFn, cutofflist=[0.3,0.5,0.7]):
+    """
+    header_lines            -- produced by load_ps
+    base_lines              -- produced by load_ps
+    tail_lines              -- produced by load_ps
+    shape_list              -- A list of SHAPE scores
+    outFn                   -- Output file name
+    cutofflist              -- The color cutoff
+    """
+    colors = [ __ps_shape_rgb(shape, cutofflist) for shape in shape_list ]
+    OUT = open(outFn, "w")
+    __write_fill_colors(OUT, header_lines, base_lines, tail_lines, colors, title)
+    OUT.close()
 
-
-
+def write_heatmap_ps(header_lines, base_lines, tail_lines, shape_list, title, outFn):
+    """
+    header_lines            -- produced by load_ps
+    base_lines              -- produced by load_ps
+    tail_lines              -- produced by load_ps
+    shape_list              -- A list of SHAPE scores
+    outFn                   -- Output file name
+    """
+    colors = [ __ps_heatmap_rgb(shape) for shape in shape_list ]
+    OUT = open(outFn, "w")
+    __write_fill_colors(OUT, header_lines, base_lines, tail_lines, colors, title, label_color="0.00 0.00 0.00")
+    OUT.close()